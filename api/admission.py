@@ -0,0 +1,271 @@
+import asyncio
+import threading
+import time
+
+DELAY_HEADER = "X-Queue-Delay-Ms"  # queueing delay the queue reports with every accepted job
+
+
+def queue_delay(headers):
+    """
+    Args:
+        headers (Mapping): Response headers of ``/enqueue``.
+
+    Returns:
+        float or None: The queueing delay the queue reported in seconds, None without one.
+    """
+    value = headers.get(DELAY_HEADER)
+    try:
+        return float(value) / 1000.0 if value is not None else None
+    except ValueError:
+        return None
+
+
+class AdmissionRate:
+    """
+    An adaptive admission rate for increments, adjusted by AIMD on the queue's load signals.
+
+    Increments are admitted from a token bucket refilled at ``rate`` per second
+    (bursts up to ``burst`` seconds worth), so an API instance rejects excess
+    work locally, before the hop to the queue. Every ``interval`` the rate is
+    adjusted: if the queue reported a queueing delay above ``target`` or refused
+    a job, it is multiplied by ``backoff``; otherwise, if the bucket ran dry, it
+    grows by ``step``. A rate that is not used is not raised, so an idle instance
+    does not build up an allowance that a burst could then overrun the queue with.
+    A backlog takes about ``target`` to drain after a decrease, so decreases are
+    at least that far apart instead of collapsing the rate on one slow backlog.
+
+    Enqueueing is asynchronous, so a limit on concurrent enqueue calls would not
+    bound queueing delay; a rate does. Several API instances adapting their own
+    rates on the same signal converge on fair shares, like TCP flows.
+
+    Attributes:
+        target (float): Queueing delay in seconds the rate is steered to stay under.
+        rate (float): Current admission rate in increments per second.
+        delay (float): Latest queueing delay reported by the queue, in seconds.
+        admitted (int): Increments admitted.
+        rejected (int): Increments rejected locally.
+        decreases (int): Multiplicative decreases so far.
+    """
+
+    def __init__(self, target, rate=1000.0, min_rate=10.0, max_rate=100000.0, step=50.0, backoff=0.5,
+                 interval=0.1, burst=0.2, clock=time.monotonic):
+        """
+        Args:
+            target (float): Queueing delay target in seconds.
+            rate (float): Initial rate in increments per second.
+            min_rate (float): Lowest rate.
+            max_rate (float): Highest rate.
+            step (float): Additive increase per interval, in increments per second.
+            backoff (float): Factor of a multiplicative decrease.
+            interval (float): Seconds between adjustments.
+            burst (float): Bucket size in seconds of the current rate.
+            clock (callable): Monotonic time source, replaceable in tests.
+        """
+        self.target = target
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.backoff = backoff
+        self.interval = interval
+        self.burst = burst
+        self.delay = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = max(1.0, rate * burst)
+        self._refilled_at = self._adjusted_at = clock()
+        self._decreased_at = self._adjusted_at - target
+        self._overloaded = False  # the queue signalled overload during this interval
+        self._limited = False  # the bucket ran dry during this interval
+
+    def acquire(self):
+        """
+        Take one admission, without blocking.
+
+        Returns:
+            bool: False if the increment should be rejected right away.
+        """
+        with self._lock:
+            now = self._clock()
+            if now - self._adjusted_at >= self.interval:
+                self._adjust(now)
+            self._tokens = min(max(1.0, self.rate * self.burst), self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1.0:
+                self._limited = True
+                self.rejected += 1
+                return False
+            self._tokens -= 1.0
+            self.admitted += 1
+            return True
+
+    def release(self, delay=None, overloaded=False):
+        """
+        Report how the queue answered an admitted increment.
+
+        Args:
+            delay (float, optional): Queueing delay the queue reported, in seconds.
+            overloaded (bool): The queue refused the job or failed.
+        """
+        with self._lock:
+            if delay is not None:
+                self.delay = delay
+            if overloaded or (delay is not None and delay > self.target):
+                self._overloaded = True
+
+    def stats(self):
+        """
+        Returns:
+            dict: Target, current rate, latest queue delay and admission counters.
+        """
+        with self._lock:
+            return {
+                "target_ms": self.target * 1000,
+                "rate": self.rate,
+                "queue_delay_ms": self.delay * 1000,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "decreases": self.decreases,
+            }
+
+    def _adjust(self, now):
+        """
+        Apply one AIMD step for the interval that just ended. Caller holds the lock.
+        """
+        if self._overloaded:
+            if now - self._decreased_at >= self.target:
+                self.rate = max(self.min_rate, self.rate * self.backoff)
+                self.decreases += 1
+                self._decreased_at = now
+        elif self._limited:
+            self.rate = min(self.max_rate, self.rate + self.step)
+        self._overloaded = self._limited = False
+        self._adjusted_at = now
+
+
+class _Batch:
+    """
+    Increments of one key waiting for the end of their coalescing window.
+    """
+    __slots__ = ("count", "done", "result", "error")
+
+    def __init__(self):
+        self.count = 1
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    """
+    Merges increments of the same key that arrive within ``window`` into one job.
+
+    The first increment of a key opens a window; increments of the key arriving
+    before it closes join it, and the first caller then enqueues a single job with
+    the summed delta. Every caller gets the outcome of that job, so all are
+    acknowledged only once it was accepted, and all see its error otherwise. A hot
+    key then costs the queue one job per window instead of one per request.
+    """
+
+    def __init__(self, window, send):
+        """
+        Args:
+            window (float): Seconds an increment waits for others of the same key.
+            send (callable): ``send(key, delta)`` enqueues the merged job; with
+                :meth:`aincrement` a coroutine function.
+        """
+        self.window = window
+        self.merged = 0
+        self._send = send
+        self._lock = threading.Lock()
+        self._batches = {}  # key -> _Batch, for threads
+        self._async_batches = {}  # key -> [count, future], for the event loop
+
+    def increment(self, key):
+        """
+        Add one to ``key`` through the current window of that key.
+
+        Args:
+            key (str): The counter key.
+
+        Returns:
+            The result of ``send`` for the merged job.
+        """
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = _Batch()
+            else:
+                batch.count += 1
+                self.merged += 1
+        if not leader:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            return batch.result
+
+        time.sleep(self.window)
+        with self._lock:
+            del self._batches[key]
+        try:
+            batch.result = self._send(key, batch.count)
+            return batch.result
+        except Exception as e:
+            batch.error = e
+            raise
+        finally:
+            batch.done.set()
+
+    async def aincrement(self, key):
+        """
+        Event loop variant of :meth:`increment`.
+
+        Args:
+            key (str): The counter key.
+
+        Returns:
+            The result of ``send`` for the merged job.
+        """
+        batch = self._async_batches.get(key)
+        if batch is not None:
+            batch[0] += 1
+            self.merged += 1
+            return await asyncio.shield(batch[1])
+
+        batch = self._async_batches[key] = [1, asyncio.get_running_loop().create_future()]
+        try:
+            await asyncio.sleep(self.window)
+        except asyncio.CancelledError:
+            del self._async_batches[key]
+            batch[0] -= 1  # the leader's own increment goes away with its request
+            if batch[0]:
+                asyncio.ensure_future(self._send_batch(key, batch))
+            else:
+                batch[1].cancel()
+            raise
+        del self._async_batches[key]
+        # sent by a task of its own, so the followers get its outcome even if the leader is cancelled
+        asyncio.ensure_future(self._send_batch(key, batch))
+        return await asyncio.shield(batch[1])
+
+    async def _send_batch(self, key, batch):
+        """
+        Send the merged job of a closed window and hand its outcome to everyone waiting on it.
+
+        Args:
+            key (str): The counter key.
+            batch (list): ``[count, future]`` of the window.
+        """
+        future = batch[1]
+        try:
+            future.set_result(await self._send(key, batch[0]))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody waited
@@ -1,15 +1,35 @@
-import os
+import contextvars
 import requests
-from flask import Flask, jsonify, abort
-from shard import ConsistentHash
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Flask, Response, jsonify, abort, request
+from requests.adapters import HTTPAdapter
+from admission import Coalescer
+from metrics import CONTENT_TYPE, instrument_flask
+from tracing import trace_flask
+from routing import max_replication_lag
+from service import (API_MODE, API_PORT, CACHE, COALESCE_WINDOW_MS, FANOUT_THREADS, HOTKEYS,
+                     HOTKEYS_URL, LAG_POLL_SEC, METRICS, QUEUE_URL, READ_POLICY, REQUEST_LATENCY, ROUTER,
+                     SECONDARY_NODES, STORE_NODES, TOPOLOGY_POLL_SEC, TOPOLOGY_URL, TRACER, UPSTREAM_CONNECT_TIMEOUT_SEC,
+                     UPSTREAM_POOL_SIZE, UPSTREAM_TIMEOUT_SEC, adopt_topology, admission_report,
+                     admit, cached_counters, complete_counters, counter_owners, counter_value, current_topology,
+                     increment_job, merge_reads, parse_keys, plan_reads, queue_answered, queue_unreachable, read_span,
+                     secondary_for)
 
 app = Flask(__name__)
 
-STORE_NODES      = [n for n in os.getenv("STORE_NODES", "").split(",") if n]
-SECONDARY_NODES  = [n for n in os.getenv("STORE_SECONDARIES", "").split(",") if n]
-QUEUE_URL        = os.getenv("QUEUE_URL",   "http://queue:7000/enqueue")
+TIMEOUT = (UPSTREAM_CONNECT_TIMEOUT_SEC, UPSTREAM_TIMEOUT_SEC)
 
-ring = ConsistentHash(STORE_NODES)
+session = requests.Session()  # keep-alive pools shared by all request threads, one per upstream host
+session.mount("http://", HTTPAdapter(pool_connections=len(STORE_NODES) + len(SECONDARY_NODES) + 1,
+                                     pool_maxsize=UPSTREAM_POOL_SIZE))
+
+FANOUT = ThreadPoolExecutor(max_workers=FANOUT_THREADS)
+HEDGE_POOL = ThreadPoolExecutor(max_workers=FANOUT_THREADS)  # separate from FANOUT so hedges never wait on it
+
+instrument_flask(app, REQUEST_LATENCY)
+trace_flask(app, TRACER)
 
 @app.route("/health", methods=["GET"])
 def health():
@@ -26,8 +46,8 @@ def get_counter(key):
     """
     Fetch the counter value for a given key.
 
-    Uses consistent hashing to route to the correct store node.
-    Falls back to a secondary node if the primary is unreachable.
+    Served from the read cache when a value younger than CACHE_TTL_MS is cached;
+    concurrent misses on one key share a single store request.
 
     Args:
         key (str): The key to look up.
@@ -37,27 +57,243 @@ def get_counter(key):
     Raises:
         503: If the primary and secondary nodes are both unreachable.
     """
-    node = ring.get_node(key)
-    idx = STORE_NODES.index(node) if node in STORE_NODES else -1
-    secondary = SECONDARY_NODES[idx] if idx >= 0 and idx < len(SECONDARY_NODES) else None
-    try:
-        resp = requests.get(f"{node}/store/{key}")
-    except requests.exceptions.ConnectionError:
-        if secondary:
-            resp = requests.get(f"{secondary}/store/{key}")
-        else:
-            abort(503, description="Primary unreachable")
+    if CACHE is None:
+        value = fetch_counter(key)
+    else:
+        value = CACHE.get_or_load(key, lambda: fetch_counter(key))
+    return jsonify({"key": key, "value": value}), 200
+
+def fetch_counter(key):
+    """
+    Read a counter from its store node.
+
+    Uses consistent hashing to route to the correct store node.
+    Falls back to a secondary node if the primary is unreachable or times out.
+    While the key is moving to another shard, the part still on its previous
+    owner is added. A hot key is the sum of its sub-counters, read with one
+    bulk request per node.
+
+    Args:
+        key (str): The key to look up.
+
+    Returns:
+        str: The stored value, "0" if the key does not exist.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    if HOTKEYS.shards(key):
+        return HOTKEYS.total(key, fetch_many(HOTKEYS.expand(key)))
+    node, previous = counter_owners(key)
+    return counter_value(read_counter(node, key), read_counter(previous, key) if previous is not None else None)
+
+def read_counter(node, key):
+    """
+    Read a counter from one shard.
+
+    Args:
+        node (str): The primary store node.
+        key (str): The key to look up.
+
+    Returns:
+        The stored value, or None if the key does not exist.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    resp = call_with_fallback(node, "GET", f"/store/{key}")
     if resp.status_code == 404:
-        return jsonify({"key": key, "value": 0}), 200
+        return None
+    resp.raise_for_status()
+    return resp.json()["value"]
+
+@app.route("/counters", methods=["POST"])
+def get_counters():
+    """
+    Fetch many counters at once.
+
+    Cached keys are answered directly; the rest are grouped by store node and
+    fetched with one bulk read per node, all nodes in parallel, so the response
+    time depends on the slowest shard rather than on the number of keys. Hot keys
+    are read as the sum of their sub-counters.
+
+    Request Body:
+        JSON: {"keys": [<key>, ...]}
+
+    Returns:
+        JSON: {"values": {<key>: <value>, ...}} with 200 OK; unknown keys are "0".
+    Raises:
+        400: If 'keys' is missing, not a list of strings or longer than MGET_MAX_KEYS.
+        503: If the primary and secondary of any involved shard are both unreachable.
+    """
+    try:
+        keys = parse_keys(request.get_json(silent=True))
+    except ValueError as e:
+        abort(400, description=str(e))
+    values, misses, parts = cached_counters(keys)
+    return jsonify({"values": complete_counters(values, misses, fetch_many(parts))}), 200
+
+def fetch_many(keys):
+    """
+    Read many keys with one bulk request per store node, all nodes in parallel.
+
+    Keys that are moving to another shard are also read from their previous
+    owner and both parts are added. Each read runs in a copy of the caller's
+    context, so pool threads see the request's trace span.
+
+    Args:
+        keys (list): The keys to look up.
+
+    Returns:
+        dict: {key: value} for the keys that exist.
+    Raises:
+        503: If the primary and secondary of any involved shard are both unreachable.
+    """
+    by_node, moving = plan_reads(keys)
+    owned = [FANOUT.submit(contextvars.copy_context().run, fetch_counters, node, node_keys)
+             for node, node_keys in by_node.items()]
+    previous = [FANOUT.submit(contextvars.copy_context().run, fetch_counters, node, node_keys)
+                for node, node_keys in moving.items()]
+    return merge_reads((f.result() for f in owned), (f.result() for f in previous))
+
+def fetch_counters(node, keys):
+    """
+    Read several counters of one shard with a single bulk request.
+
+    Args:
+        node (str): The primary store node owning the keys.
+        keys (list): The keys to look up.
+
+    Returns:
+        dict: {key: value} for the requested keys the shard holds.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    resp = call_with_fallback(node, "POST", "/bulk/read", json={"keys": keys})
     resp.raise_for_status()
-    return jsonify(resp.json()), 200
+    return resp.json()["values"]
+
+def call_with_fallback(node, method, path, **kwargs):
+    """
+    Send a read to a shard according to READ_POLICY.
+
+    The replicas are tried in the order chosen by the router; a replica that is
+    unreachable or times out falls through to the next one. With the hedged policy
+    the secondary is also asked once the first replica is slower than its observed
+    p95, and the first answer wins.
+
+    Args:
+        node (str): The primary store node.
+        method (str): HTTP method.
+        path (str): Request path on the store node.
+        **kwargs: Passed on to ``session.request``.
+
+    Returns:
+        requests.Response: The response of the primary or the secondary.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    span = read_span(node, path, kwargs)
+    secondary = secondary_for(node)
+    resp = None
+    try:
+        if ROUTER.should_hedge(node, secondary):
+            resp = hedged_request(node, secondary, method, path, **kwargs)
+        else:
+            for target in ROUTER.order(node, secondary):
+                try:
+                    resp = timed_request(target, method, path, **kwargs)
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    continue
+    finally:
+        if span is not None:
+            span.finish(status=resp.status_code if resp is not None else None)
+    if resp is None:
+        abort(503, description="Primary unreachable")
+    return resp
+
+def hedged_request(primary, secondary, method, path, **kwargs):
+    """
+    Ask the primary, and the secondary too if the primary has not answered within
+    its hedge delay; return whichever successful response arrives first.
+
+    Returns:
+        requests.Response or None: The first response, None if both replicas failed.
+    """
+    pending = {HEDGE_POOL.submit(timed_request, primary, method, path, **kwargs)}
+    done, _ = wait(pending, timeout=ROUTER.hedge_delay(primary))
+    hedge = None
+    if not done or next(iter(done)).exception() is not None:
+        hedge = HEDGE_POOL.submit(timed_request, secondary, method, path, **kwargs)
+        pending.add(hedge)
+        if not done:
+            ROUTER.hedges += 1
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge and pending:
+                    ROUTER.hedge_wins += 1
+                return future.result()
+    return None
+
+def timed_request(target, method, path, **kwargs):
+    """
+    Send one request to a replica, recording its load and latency in the router.
+
+    Returns:
+        requests.Response: The response.
+    """
+    ROUTER.begin(target)
+    start = time.perf_counter()
+    elapsed = None
+    try:
+        resp = session.request(method, f"{target}{path}", timeout=TIMEOUT, **kwargs)
+        elapsed = time.perf_counter() - start
+        return resp
+    finally:
+        ROUTER.end(target, elapsed)
+
+def lag_poller():
+    """
+    Background thread that keeps the router's view of each shard's replication lag
+    current by polling the primaries' ``GET /stats``.
+    """
+    while True:
+        for node in current_topology().nodes:
+            try:
+                resp = session.get(f"{node}/stats", timeout=TIMEOUT)
+                resp.raise_for_status()
+                ROUTER.set_lag(node, max_replication_lag(resp.json()))
+            except Exception:
+                ROUTER.set_lag(node, None)
+        time.sleep(LAG_POLL_SEC)
+
+def topology_poller():
+    """
+    Background thread that follows the shard topology and the hot keys published by
+    the queue's ``GET /topology`` and ``GET /hotkeys``, so shards can be added or
+    removed and keys split without restarting the API.
+    """
+    while True:
+        try:
+            resp = session.get(TOPOLOGY_URL, timeout=TIMEOUT)
+            resp.raise_for_status()
+            adopt_topology(resp.json()["topology"])
+            resp = session.get(HOTKEYS_URL, timeout=TIMEOUT)
+            resp.raise_for_status()
+            HOTKEYS.update(resp.json()["keys"])
+        except Exception:
+            pass  # keep the current view until the queue answers again
+        time.sleep(TOPOLOGY_POLL_SEC)
 
 @app.route("/counter/<key>/increment", methods=["POST"])
 def increment_counter(key):
     """
     Enqueue a request to increment the counter for a given key.
 
-    Sends a job to the queueing service for asynchronous processing.
+    Sends a job to the queueing service for asynchronous processing. With
+    COALESCE_WINDOW_MS, increments of the same key arriving within the window
+    are sent as one job and answered together once it was accepted.
 
     Args:
         key (str): The key to increment.
@@ -65,13 +301,128 @@ def increment_counter(key):
     Returns:
         JSON: {"status": "queued", "key": key} with 202 Accepted.
     Raises:
-        429: If the queue system is full or rate-limited.
+        429: If admission control rejects the increment, or the queue is full or rate-limited.
+        503: If the queue is unreachable or the key's store shard is unavailable.
     """
-    resp = requests.post(QUEUE_URL, json={"action": "increment", "key": key})
-    if resp.status_code == 429:
-        abort(429, description="Too many requests – queue is full")
-    resp.raise_for_status()
+    if COALESCER is not None:
+        COALESCER.increment(key)
+    else:
+        enqueue(key)
+    if CACHE is not None:
+        CACHE.on_increment(key)
     return jsonify({"status": "queued", "key": key}), 202
 
+def enqueue(key, delta=1):
+    """
+    Send an increment job to the queue, unless admission control rejects it right away.
+
+    The queue's answer feeds admission control: the queueing delay it reports
+    with an accepted job, or overload if it refused the job or could not be reached.
+
+    Args:
+        key (str): The key to increment.
+        delta (int): The increment, more than 1 for coalesced increments.
+
+    Raises:
+        429: If admission control or the queue rejects the job.
+        503: If the queue cannot be reached, fails or sheds the job's store shard.
+    """
+    refused = admit()
+    if refused is not None:
+        abort(refused[0], description=refused[1])
+    job = increment_job(key, delta)
+    span = TRACER.current()
+    if span is not None:
+        span = span.child("api.enqueue", delta=delta)
+    try:
+        resp = session.post(QUEUE_URL, json=job, timeout=TIMEOUT, headers=span.headers() if span is not None else None)
+    except requests.RequestException as e:
+        if span is not None:
+            span.finish(error=str(e))
+        status, message = queue_unreachable()
+        abort(status, description=message)
+    if span is not None:
+        span.finish(status=resp.status_code)
+    refused = queue_answered(resp.status_code, resp.headers)
+    if refused is not None:
+        abort(refused[0], description=refused[1])
+    resp.raise_for_status()
+
+COALESCER = Coalescer(COALESCE_WINDOW_MS / 1000.0, enqueue) if COALESCE_WINDOW_MS > 0 else None
+
+@app.route("/routing/stats", methods=["GET"])
+def routing_stats():
+    """
+    Report read routing statistics.
+
+    Returns:
+        JSON: Policy, hedge counters, replication lag and per-node latency quantiles with 200 OK.
+    """
+    return jsonify(ROUTER.stats()), 200
+
+@app.route("/admission/stats", methods=["GET"])
+def admission_stats():
+    """
+    Report admission control and coalescing statistics.
+
+    Returns:
+        JSON: Target, admission rate, last queueing delay, admitted/rejected counts
+        and merged increments with 200 OK.
+    """
+    return jsonify(admission_report(COALESCER)), 200
+
+@app.route("/topology", methods=["GET"])
+def get_topology():
+    """
+    Report the shard topology this API instance routes with.
+
+    Returns:
+        JSON: Version, nodes, secondaries and migration state with 200 OK.
+    """
+    return jsonify(current_topology().to_dict()), 200
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """
+    Report read cache statistics.
+
+    Returns:
+        JSON: Cache size and hit/miss/eviction/collapse counters with 200 OK.
+    """
+    return jsonify(CACHE.stats() if CACHE is not None else {"enabled": False}), 200
+
+@app.route("/debug/traces", methods=["GET"])
+def debug_traces():
+    """
+    Return the newest finished spans of this API instance.
+
+    Query Parameters:
+        trace_id (str, optional): Only spans of this trace.
+        limit (int, optional): Maximum number of spans, default 1000.
+
+    Returns:
+        JSON: {"spans": [...]} oldest first, with 200 OK.
+    """
+    limit = request.args.get("limit", 1000, type=int)
+    return jsonify({"spans": TRACER.recent(request.args.get("trace_id"), limit)}), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Expose request latency, read cache and read routing metrics for Prometheus.
+
+    Returns:
+        Response: The metrics in the Prometheus text format, 200 OK.
+    """
+    return Response(METRICS.expose(), mimetype=CONTENT_TYPE)
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000)
+    if API_MODE == "async":
+        from async_app import main
+        main()
+    else:
+        if READ_POLICY != "primary":
+            threading.Thread(target=lag_poller, daemon=True).start()
+        if TOPOLOGY_POLL_SEC > 0:
+            threading.Thread(target=topology_poller, daemon=True).start()
+        app.run(host="0.0.0.0", port=API_PORT)
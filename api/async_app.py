@@ -0,0 +1,528 @@
+import asyncio
+import functools
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+from admission import Coalescer
+from metrics import CONTENT_TYPE, aiohttp_middleware
+from tracing import trace_aiohttp
+from routing import max_replication_lag
+from service import (API_PORT, CACHE, COALESCE_WINDOW_MS, HOTKEYS, HOTKEYS_URL, LAG_POLL_SEC, METRICS, QUEUE_URL,
+                     READ_POLICY, REQUEST_LATENCY, ROUTER, TOPOLOGY_POLL_SEC, TOPOLOGY_URL, TRACER,
+                     UPSTREAM_CONNECT_TIMEOUT_SEC, UPSTREAM_POOL_SIZE, UPSTREAM_TIMEOUT_SEC, adopt_topology,
+                     admission_report, admit, cached_counters, complete_counters, counter_owners, counter_value,
+                     current_topology, increment_job, merge_reads, parse_keys, plan_reads, queue_answered,
+                     queue_unreachable, read_span, secondary_for)
+
+routes = web.RouteTableDef()
+
+ERRORS = {400: web.HTTPBadRequest, 429: web.HTTPTooManyRequests, 503: web.HTTPServiceUnavailable}  # status -> exception
+
+
+class UpstreamPools:
+    """
+    One ``aiohttp.ClientSession`` with its own keep-alive connection pool per upstream
+    (scheme, host and port), so a slow upstream can only exhaust its own pool.
+
+    Attributes:
+        pool_size (int): Maximum open connections per upstream.
+        timeout (aiohttp.ClientTimeout): Timeouts applied to every request.
+    """
+
+    def __init__(self, pool_size, timeout, connect_timeout):
+        """
+        Args:
+            pool_size (int): Maximum open connections per upstream.
+            timeout (float): Total seconds allowed per request.
+            connect_timeout (float): Seconds allowed to open a connection.
+        """
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self._sessions = {}
+
+    def session(self, url):
+        """
+        Args:
+            url (str): Any URL on the upstream.
+
+        Returns:
+            aiohttp.ClientSession: The pooled session for the URL's upstream.
+        """
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(origin)
+        if session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            session = self._sessions[origin] = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return session
+
+    async def close(self):
+        """
+        Close every pooled session.
+        """
+        await asyncio.gather(*(s.close() for s in self._sessions.values()))
+        self._sessions.clear()
+
+
+@routes.get("/health")
+async def health(request):
+    """
+    Health check endpoint.
+
+    Returns:
+        JSON: {"status": "api up"} with 200 OK.
+    """
+    return web.json_response({"status": "api up"})
+
+
+@routes.get("/counter/{key}")
+async def get_counter(request):
+    """
+    Fetch the counter value for a given key.
+
+    Served from the read cache when a value younger than CACHE_TTL_MS is cached;
+    concurrent misses on one key share a single store request.
+
+    Returns:
+        JSON: {"key": key, "value": value} with 200 OK.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    key = request.match_info["key"]
+    pools = request.app["pools"]
+    if CACHE is None:
+        value = await fetch_counter(pools, key)
+    else:
+        value = await CACHE.aget_or_load(key, lambda: fetch_counter(pools, key))
+    return web.json_response({"key": key, "value": value})
+
+
+async def fetch_counter(pools, key):
+    """
+    Read a counter from its store node.
+
+    Uses consistent hashing to route to the correct store node.
+    Falls back to a secondary node if the primary is unreachable or times out.
+    While the key is moving to another shard, the part still on its previous
+    owner is added. A hot key is the sum of its sub-counters, read with one
+    bulk request per node.
+
+    Args:
+        pools (UpstreamPools): Connection pools to use.
+        key (str): The key to look up.
+
+    Returns:
+        str: The stored value, "0" if the key does not exist.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    if HOTKEYS.shards(key):
+        return HOTKEYS.total(key, await fetch_many(pools, HOTKEYS.expand(key)))
+    node, previous = counter_owners(key)
+    if previous is None:
+        return counter_value(await read_counter(pools, node, key))
+    return counter_value(*await asyncio.gather(read_counter(pools, node, key), read_counter(pools, previous, key)))
+
+
+async def read_counter(pools, node, key):
+    """
+    Read a counter from one shard.
+
+    Args:
+        pools (UpstreamPools): Connection pools to use.
+        node (str): The primary store node.
+        key (str): The key to look up.
+
+    Returns:
+        The stored value, or None if the key does not exist.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    status, body = await call_with_fallback(pools, node, "GET", f"/store/{key}")
+    if status == 404:
+        return None
+    return body["value"]
+
+
+@routes.post("/counters")
+async def get_counters(request):
+    """
+    Fetch many counters at once.
+
+    Cached keys are answered directly; the rest are grouped by store node and
+    fetched with one bulk read per node, all nodes concurrently, so the response
+    time depends on the slowest shard rather than on the number of keys. Hot keys
+    are read as the sum of their sub-counters.
+
+    Request Body:
+        JSON: {"keys": [<key>, ...]}
+
+    Returns:
+        JSON: {"values": {<key>: <value>, ...}} with 200 OK; unknown keys are "0".
+    Raises:
+        400: If 'keys' is missing, not a list of strings or longer than MGET_MAX_KEYS.
+        503: If the primary and secondary of any involved shard are both unreachable.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    try:
+        keys = parse_keys(body)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    values, misses, parts = cached_counters(keys)
+    found = await fetch_many(request.app["pools"], parts)
+    return web.json_response({"values": complete_counters(values, misses, found)})
+
+
+async def fetch_many(pools, keys):
+    """
+    Read many keys with one bulk request per store node, all nodes concurrently.
+
+    Keys that are moving to another shard are also read from their previous
+    owner and both parts are added.
+
+    Args:
+        pools (UpstreamPools): Connection pools to use.
+        keys (list): The keys to look up.
+
+    Returns:
+        dict: {key: value} for the keys that exist.
+    Raises:
+        503: If the primary and secondary of any involved shard are both unreachable.
+    """
+    by_node, moving = plan_reads(keys)
+    results = await asyncio.gather(*(fetch_counters(pools, n, k) for n, k in by_node.items()),
+                                   *(fetch_counters(pools, n, k) for n, k in moving.items()))
+    return merge_reads(results[:len(by_node)], results[len(by_node):])
+
+
+async def fetch_counters(pools, node, keys):
+    """
+    Read several counters of one shard with a single bulk request.
+
+    Args:
+        pools (UpstreamPools): Connection pools to use.
+        node (str): The primary store node owning the keys.
+        keys (list): The keys to look up.
+
+    Returns:
+        dict: {key: value} for the requested keys the shard holds.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    _, body = await call_with_fallback(pools, node, "POST", "/bulk/read", json={"keys": keys})
+    return body["values"]
+
+
+async def call_with_fallback(pools, node, method, path, **kwargs):
+    """
+    Send a read to a shard according to READ_POLICY.
+
+    The replicas are tried in the order chosen by the router; a replica that is
+    unreachable or times out falls through to the next one. With the hedged policy
+    the secondary is also asked once the first replica is slower than its observed
+    p95, and the first answer wins.
+
+    Args:
+        pools (UpstreamPools): Connection pools to use.
+        node (str): The primary store node.
+        method (str): HTTP method.
+        path (str): Request path on the store node.
+        **kwargs: Passed on to ``ClientSession.request``.
+
+    Returns:
+        tuple: ``(status, json body)``; the body is None for a 404.
+    Raises:
+        503: If the primary and secondary nodes are both unreachable.
+    """
+    span = read_span(node, path, kwargs)
+    secondary = secondary_for(node)
+    try:
+        if ROUTER.should_hedge(node, secondary):
+            return await hedged_request(pools, node, secondary, method, path, **kwargs)
+        for target in ROUTER.order(node, secondary):
+            try:
+                return await timed_request(pools, target, method, path, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                continue
+        raise web.HTTPServiceUnavailable(text="Primary unreachable")
+    finally:
+        if span is not None:
+            span.finish()
+
+
+async def hedged_request(pools, primary, secondary, method, path, **kwargs):
+    """
+    Ask the primary, and the secondary too if the primary has not answered within
+    its hedge delay; return whichever successful response arrives first.
+
+    Returns:
+        tuple: ``(status, json body)`` of the first successful replica.
+    Raises:
+        503: If both replicas failed.
+    """
+    first = asyncio.ensure_future(timed_request(pools, primary, method, path, **kwargs))
+    pending = {first}
+    done, _ = await asyncio.wait(pending, timeout=ROUTER.hedge_delay(primary))
+    hedge = None
+    if not done or first.exception() is not None:
+        hedge = asyncio.ensure_future(timed_request(pools, secondary, method, path, **kwargs))
+        pending.add(hedge)
+        if not done:
+            ROUTER.hedges += 1
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge and pending:
+                        ROUTER.hedge_wins += 1
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise web.HTTPServiceUnavailable(text="Primary unreachable")
+
+
+async def timed_request(pools, target, method, path, **kwargs):
+    """
+    Send one request to a replica, recording its load and latency in the router.
+
+    Returns:
+        tuple: ``(status, json body)``; the body is None for a 404.
+    """
+    ROUTER.begin(target)
+    start = time.perf_counter()
+    elapsed = None
+    try:
+        async with pools.session(target).request(method, f"{target}{path}", **kwargs) as resp:
+            if resp.status == 404:
+                result = 404, None
+            else:
+                resp.raise_for_status()
+                result = resp.status, await resp.json()
+        elapsed = time.perf_counter() - start
+        return result
+    finally:
+        ROUTER.end(target, elapsed)
+
+
+async def lag_poller(app):
+    """
+    Background task that keeps the router's view of each shard's replication lag
+    current by polling the primaries' ``GET /stats``.
+    """
+    pools = app["pools"]
+    while True:
+        for node in current_topology().nodes:
+            try:
+                async with pools.session(node).get(f"{node}/stats") as resp:
+                    resp.raise_for_status()
+                    ROUTER.set_lag(node, max_replication_lag(await resp.json()))
+            except Exception:
+                ROUTER.set_lag(node, None)
+        await asyncio.sleep(LAG_POLL_SEC)
+
+
+async def topology_poller(app):
+    """
+    Background task that follows the shard topology and the hot keys published by
+    the queue's ``GET /topology`` and ``GET /hotkeys``, so shards can be added or
+    removed and keys split without restarting the API.
+    """
+    pools = app["pools"]
+    while True:
+        try:
+            async with pools.session(TOPOLOGY_URL).get(TOPOLOGY_URL) as resp:
+                resp.raise_for_status()
+                adopt_topology((await resp.json())["topology"])
+            async with pools.session(HOTKEYS_URL).get(HOTKEYS_URL) as resp:
+                resp.raise_for_status()
+                HOTKEYS.update((await resp.json())["keys"])
+        except Exception:
+            pass  # keep the current view until the queue answers again
+        await asyncio.sleep(TOPOLOGY_POLL_SEC)
+
+
+@routes.post("/counter/{key}/increment")
+async def increment_counter(request):
+    """
+    Enqueue a request to increment the counter for a given key.
+
+    Sends a job to the queueing service for asynchronous processing. With
+    COALESCE_WINDOW_MS, increments of the same key arriving within the window
+    are sent as one job and answered together once it was accepted.
+
+    Returns:
+        JSON: {"status": "queued", "key": key} with 202 Accepted.
+    Raises:
+        429: If admission control rejects the increment, or the queue is full or rate-limited.
+        503: If the queue is unreachable or the key's store shard is unavailable.
+    """
+    key = request.match_info["key"]
+    coalescer = request.app.get("coalescer")
+    if coalescer is not None:
+        await coalescer.aincrement(key)
+    else:
+        await enqueue(request.app["pools"], key)
+    if CACHE is not None:
+        CACHE.on_increment(key)
+    return web.json_response({"status": "queued", "key": key}, status=202)
+
+
+async def enqueue(pools, key, delta=1):
+    """
+    Send an increment job to the queue, unless admission control rejects it right away.
+
+    The queue's answer feeds admission control: the queueing delay it reports
+    with an accepted job, or overload if it refused the job or could not be reached.
+
+    Args:
+        pools (UpstreamPools): The app's connection pools.
+        key (str): The key to increment.
+        delta (int): The increment, more than 1 for coalesced increments.
+
+    Raises:
+        web.HTTPTooManyRequests: If admission control or the queue rejects the job.
+        web.HTTPServiceUnavailable: If the queue cannot be reached, fails or sheds the job's store shard.
+    """
+    refused = admit()
+    if refused is not None:
+        raise ERRORS[refused[0]](text=refused[1])
+    job = increment_job(key, delta)
+    span = TRACER.current()
+    if span is not None:
+        span = span.child("api.enqueue", delta=delta)
+    try:
+        async with pools.session(QUEUE_URL).post(QUEUE_URL, json=job,
+                                                 headers=span.headers() if span is not None else None) as resp:
+            if span is not None:
+                span.finish(status=resp.status)
+            refused = queue_answered(resp.status, resp.headers)
+            if refused is not None:
+                raise ERRORS[refused[0]](text=refused[1])
+            resp.raise_for_status()
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        if span is not None:
+            span.finish(error=str(e) or type(e).__name__)
+        status, message = queue_unreachable()
+        raise ERRORS[status](text=message)
+
+
+@routes.get("/routing/stats")
+async def routing_stats(request):
+    """
+    Report read routing statistics.
+
+    Returns:
+        JSON: Policy, hedge counters, replication lag and per-node latency quantiles with 200 OK.
+    """
+    return web.json_response(ROUTER.stats())
+
+
+@routes.get("/admission/stats")
+async def admission_stats(request):
+    """
+    Report admission control and coalescing statistics.
+
+    Returns:
+        JSON: Target, admission rate, last queueing delay, admitted/rejected counts
+        and merged increments with 200 OK.
+    """
+    return web.json_response(admission_report(request.app.get("coalescer")))
+
+
+@routes.get("/topology")
+async def get_topology(request):
+    """
+    Report the shard topology this API instance routes with.
+
+    Returns:
+        JSON: Version, nodes, secondaries and migration state with 200 OK.
+    """
+    return web.json_response(current_topology().to_dict())
+
+
+@routes.get("/cache/stats")
+async def cache_stats(request):
+    """
+    Report read cache statistics.
+
+    Returns:
+        JSON: Cache size and hit/miss/eviction/collapse counters with 200 OK.
+    """
+    return web.json_response(CACHE.stats() if CACHE is not None else {"enabled": False})
+
+
+@routes.get("/debug/traces")
+async def debug_traces(request):
+    """
+    Return the newest finished spans of this API instance.
+
+    Query Parameters:
+        trace_id (str, optional): Only spans of this trace.
+        limit (int, optional): Maximum number of spans, default 1000.
+
+    Returns:
+        JSON: {"spans": [...]} oldest first, with 200 OK.
+    """
+    try:
+        limit = int(request.query.get("limit", 1000))
+    except ValueError:
+        raise web.HTTPBadRequest(text="'limit' must be an integer")
+    return web.json_response({"spans": TRACER.recent(request.query.get("trace_id"), limit)})
+
+
+@routes.get("/metrics")
+async def metrics(request):
+    """
+    Expose request latency, read cache and read routing metrics for Prometheus.
+
+    Returns:
+        Response: The metrics in the Prometheus text format, 200 OK.
+    """
+    return web.Response(body=METRICS.expose().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def _open_pools(app):
+    app["pools"] = UpstreamPools(UPSTREAM_POOL_SIZE, UPSTREAM_TIMEOUT_SEC, UPSTREAM_CONNECT_TIMEOUT_SEC)
+    if COALESCE_WINDOW_MS > 0:
+        app["coalescer"] = Coalescer(COALESCE_WINDOW_MS / 1000.0, functools.partial(enqueue, app["pools"]))
+    if READ_POLICY != "primary":
+        app["lag_poller"] = asyncio.ensure_future(lag_poller(app))
+    if TOPOLOGY_POLL_SEC > 0:
+        app["topology_poller"] = asyncio.ensure_future(topology_poller(app))
+
+
+async def _close_pools(app):
+    for task in ("lag_poller", "topology_poller"):
+        if task in app:
+            app[task].cancel()
+    await app["pools"].close()
+
+
+def create_app():
+    """
+    Build the asyncio API application.
+
+    Returns:
+        aiohttp.web.Application: The app with the same routes as the Flask API.
+    """
+    app = web.Application(middlewares=[aiohttp_middleware(REQUEST_LATENCY), trace_aiohttp(TRACER)])
+    app.add_routes(routes)
+    app.on_startup.append(_open_pools)
+    app.on_cleanup.append(_close_pools)
+    return app
+
+
+def main():
+    web.run_app(create_app(), host="0.0.0.0", port=API_PORT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+ON_WRITE_INVALIDATE = "invalidate"  # drop the cached value when an increment is enqueued
+ON_WRITE_ADJUST     = "adjust"      # add the delta to the cached value in place
+ON_WRITE_NONE       = "none"        # leave it until the TTL expires
+ON_WRITE_MODES      = (ON_WRITE_INVALIDATE, ON_WRITE_ADJUST, ON_WRITE_NONE)
+
+
+class _Flight:
+    """
+    An in-progress threaded load that followers wait on.
+    """
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CounterCache:
+    """
+    A bounded, TTL-limited read-through cache of counter values with single-flight loading.
+
+    Entries are kept in an ``OrderedDict`` in least-recently-used order and the
+    oldest entry is evicted once ``max_keys`` is exceeded. An entry older than
+    ``ttl`` is never served, which bounds how stale a read can be. Concurrent misses
+    on the same key share one load: the first caller runs the loader and the others
+    wait for its result (or exception), in threads via :meth:`get_or_load` or on an
+    event loop via :meth:`aget_or_load`.
+
+    Attributes:
+        max_keys (int): Maximum number of cached keys.
+        ttl (float): Seconds a value may be served after it was loaded.
+        on_write (str): What :meth:`on_increment` does, see ``ON_WRITE_MODES``.
+        hits (int): Lookups served from the cache.
+        misses (int): Lookups that had to load.
+        evictions (int): Entries dropped to stay within ``max_keys``.
+        collapsed (int): Misses that waited for another caller's load.
+    """
+
+    def __init__(self, max_keys=100000, ttl=1.0, on_write=ON_WRITE_INVALIDATE, clock=time.monotonic):
+        """
+        Args:
+            max_keys (int): Maximum number of cached keys.
+            ttl (float): Seconds a value may be served after it was loaded.
+            on_write (str): What :meth:`on_increment` does, see ``ON_WRITE_MODES``.
+            clock (callable): Monotonic time source, in seconds.
+
+        Raises:
+            ValueError: If ``on_write`` is unknown.
+        """
+        if on_write not in ON_WRITE_MODES:
+            raise ValueError(f"Unknown cache write mode {on_write!r}, expected one of {ON_WRITE_MODES}")
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.on_write = on_write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.collapsed = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, loaded_at)
+        self._flights = {}             # key -> _Flight, for threaded loads
+        self._async_flights = {}       # key -> asyncio.Future, for event loop loads
+
+    def get(self, key):
+        """
+        Look up a fresh cached value.
+
+        Args:
+            key (str): The counter key.
+
+        Returns:
+            tuple: ``(True, value)`` on a hit, ``(False, None)`` otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        """
+        Store a freshly loaded value, evicting the least recently used entries.
+
+        Args:
+            key (str): The counter key.
+            value: The value loaded from the store.
+        """
+        with self._lock:
+            self._entries[key] = (value, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def on_increment(self, key, delta=1):
+        """
+        Apply ``on_write`` after an increment for ``key`` was accepted.
+
+        Counter values are strings, as the store answers reads, so the adjusted
+        value is one too. A cached value that is not an integer cannot be adjusted
+        and is dropped instead.
+
+        Args:
+            key (str): The counter key.
+            delta (int): The increment.
+        """
+        if self.on_write == ON_WRITE_NONE:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if self.on_write == ON_WRITE_ADJUST:
+                try:
+                    self._entries[key] = (str(int(entry[0]) + delta), entry[1])
+                    return
+                except (TypeError, ValueError):
+                    pass
+            del self._entries[key]
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value or load it, collapsing concurrent loads of one key.
+
+        Args:
+            key (str): The counter key.
+            loader (callable): Returns the value from the store; may raise.
+
+        Returns:
+            The counter value.
+        """
+        hit, value = self.get(key)
+        if hit:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.collapsed += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.put(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def aget_or_load(self, key, loader):
+        """
+        Event loop variant of :meth:`get_or_load`.
+
+        Args:
+            key (str): The counter key.
+            loader (callable): Coroutine function returning the value; may raise.
+
+        Returns:
+            The counter value.
+        """
+        hit, value = self.get(key)
+        if hit:
+            return value
+        flight = self._async_flights.get(key)
+        if flight is not None:
+            self.collapsed += 1
+            return await asyncio.shield(flight)
+
+        flight = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await loader()
+            self.put(key, value)
+            flight.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # mark retrieved when nobody else waited
+            raise
+        finally:
+            del self._async_flights[key]
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size and hit/miss/eviction/collapse counters.
+        """
+        with self._lock:
+            return {
+                "keys": len(self._entries),
+                "max_keys": self.max_keys,
+                "ttl_ms": self.ttl * 1000,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "collapsed": self.collapsed,
+            }
@@ -0,0 +1,139 @@
+import json
+import os
+import random
+import threading
+
+SEPARATOR = "#"  # sub-counter i of key k is stored as "k#i"
+
+
+class HotKeys:
+    """
+    Registry of hot counters whose increments are split over sub-counters.
+
+    A hot key ``k`` with ``n`` shards is written as ``k#0`` .. ``k#n-1``, which
+    the hash ring spreads over the store nodes, so its write throughput is no
+    longer bounded by one node and one lock. Its value is the sum of the
+    sub-counters plus whatever ``k`` itself held before it became hot.
+
+    Keys are only ever added: once increments went to sub-counters, every reader
+    has to include them. If ``path`` is given the registry is saved there on every
+    change and loaded on startup.
+
+    Attributes:
+        default_shards (int): Sub-counters of a key marked hot without a count.
+        path (str or None): JSON file the registry is persisted to.
+    """
+
+    def __init__(self, default_shards=8, path=None, keys=()):
+        """
+        Args:
+            default_shards (int): Sub-counters of a key marked hot without a count.
+            path (str, optional): JSON file to persist the registry to.
+            keys (iterable): Keys to mark hot from the start.
+        """
+        self.default_shards = default_shards
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = {}  # key -> number of sub-counters
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._keys.update(json.load(f))
+        for key in keys:
+            self._keys.setdefault(key, default_shards)
+
+    def shards(self, key):
+        """
+        Args:
+            key (str): The counter key.
+
+        Returns:
+            int: Number of sub-counters, 0 if the key is not hot.
+        """
+        return self._keys.get(key, 0)
+
+    def add(self, key, shards=None):
+        """
+        Mark a key hot. A key that is already hot keeps its shard count.
+
+        Args:
+            key (str): The counter key.
+            shards (int, optional): Number of sub-counters, defaults to ``default_shards``.
+
+        Returns:
+            int: The key's number of sub-counters.
+        """
+        with self._lock:
+            if key in self._keys:
+                return self._keys[key]
+            self._keys[key] = shards or self.default_shards
+            self._save()
+            return self._keys[key]
+
+    def update(self, keys):
+        """
+        Merge hot keys published elsewhere; known keys keep their shard count.
+
+        Args:
+            keys (dict): {key: number of sub-counters}.
+        """
+        with self._lock:
+            for key, shards in keys.items():
+                self._keys.setdefault(key, shards)
+
+    def pick(self, key):
+        """
+        Args:
+            key (str): A hot counter key.
+
+        Returns:
+            str: A random sub-counter of the key to send an increment to.
+        """
+        return f"{key}{SEPARATOR}{random.randrange(self._keys[key])}"
+
+    def expand(self, key):
+        """
+        Args:
+            key (str): The counter key.
+
+        Returns:
+            list: The keys whose values add up to the counter, the key itself first.
+        """
+        return [key] + [f"{key}{SEPARATOR}{i}" for i in range(self._keys.get(key, 0))]
+
+    def total(self, key, values):
+        """
+        Add up a counter from the values of its expanded keys.
+
+        Args:
+            key (str): The counter key.
+            values (dict): Values of (some of) the keys from :meth:`expand`; missing keys count as 0.
+
+        Returns:
+            str: The counter value, the sum for a hot key, else the key's value as read ("0" if missing).
+            A hot key with a value that is not an integer is not a counter and reads like any other key.
+        """
+        if not self._keys.get(key):
+            return values.get(key, "0")
+        try:
+            return str(sum(int(values.get(part, 0)) for part in self.expand(key)))
+        except (TypeError, ValueError):
+            return values.get(key, "0")
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: {key: number of sub-counters}.
+        """
+        return dict(self._keys)
+
+    def _save(self):
+        """
+        Write the registry to ``path`` atomically. Caller holds the lock.
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._keys, f)
+        os.replace(tmp, self.path)
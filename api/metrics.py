@@ -0,0 +1,409 @@
+import bisect
+import random
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # Prometheus text exposition format
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Cells:
+    """
+    Per-thread accumulators of one metric.
+
+    Every thread adds to its own list of numbers, so recording never takes a
+    lock (only the first record of a thread registers its cell); a scrape adds up
+    the cells of all threads. Cells of finished threads are kept so totals never
+    go down; a thread that reuses an ident continues its predecessor's cell.
+    """
+
+    def __init__(self, size):
+        """
+        Args:
+            size (int): Numbers kept per thread.
+        """
+        self._size = size
+        self._cells = {}  # thread ident -> [numbers]
+        self._lock = threading.Lock()
+
+    def cell(self):
+        """
+        Returns:
+            list: The calling thread's accumulators.
+        """
+        cell = self._cells.get(threading.get_ident())
+        if cell is None:
+            with self._lock:
+                cell = self._cells.setdefault(threading.get_ident(), [0] * self._size)
+        return cell
+
+    def totals(self):
+        """
+        Returns:
+            list: The accumulators summed over all threads.
+        """
+        totals = [0] * self._size
+        for cell in list(self._cells.values()):
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+class Counter(_Cells):
+    """
+    A monotonically increasing count.
+    """
+
+    def __init__(self):
+        """
+        Start at zero.
+        """
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        """
+        Args:
+            amount (int or float): Non-negative amount to add.
+        """
+        self.cell()[0] += amount
+
+    def samples(self, name, labels):
+        """
+        Args:
+            name (str): Metric name.
+            labels (tuple): (name, value) label pairs.
+
+        Returns:
+            list: (sample name, labels, value) tuples.
+        """
+        return [(name, labels, self.totals()[0])]
+
+
+class Histogram(_Cells):
+    """
+    Counts observations in cumulative buckets, plus their sum and count.
+
+    Attributes:
+        buckets (tuple): Upper bounds of the buckets, ascending; +Inf is implied.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            buckets (iterable): Upper bucket bounds, ascending.
+        """
+        self.buckets = tuple(buckets)
+        super().__init__(len(self.buckets) + 3)  # buckets, +Inf, sum, count
+
+    def observe(self, value):
+        """
+        Args:
+            value (float): The observation, e.g. seconds.
+        """
+        cell = self.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def time(self):
+        """
+        Returns:
+            contextmanager: Observes the seconds spent in its block.
+        """
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        """
+        Args:
+            name (str): Metric name.
+            labels (tuple): (name, value) label pairs.
+
+        Returns:
+            list: (sample name, labels, value) tuples.
+        """
+        totals = self.totals()
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), totals):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + (("le", _format(bound)),), cumulative))
+        samples.append((f"{name}_sum", labels, totals[-2]))
+        samples.append((f"{name}_count", labels, totals[-1]))
+        return samples
+
+
+class _Timer:
+    """
+    Context manager observing the duration of its block in a histogram.
+    """
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Family:
+    """
+    A named metric with optional labels; each label combination is its own child.
+
+    Children are created on first use and cached, so call sites on hot paths can
+    also keep the child returned by :meth:`labels`.
+
+    Attributes:
+        name (str): Metric name.
+        kind (str): ``counter`` or ``histogram``.
+    """
+
+    def __init__(self, name, help, kind, labelnames, factory):
+        """
+        Args:
+            name (str): Metric name.
+            help (str): Description.
+            kind (str): ``counter`` or ``histogram``.
+            labelnames (tuple): Label names.
+            factory (callable): Creates the metric of one label combination.
+        """
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        Args:
+            *values (str): One value per label name, in order.
+
+        Returns:
+            Counter or Histogram: The child for these label values.
+        """
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def inc(self, amount=1):
+        """
+        Increment an unlabelled counter, see :meth:`Counter.inc`.
+        """
+        self.labels().inc(amount)
+
+    def observe(self, value):
+        """
+        Record into an unlabelled histogram, see :meth:`Histogram.observe`.
+        """
+        self.labels().observe(value)
+
+    def time(self):
+        """
+        Time a block with an unlabelled histogram, see :meth:`Histogram.time`.
+        """
+        return self.labels().time()
+
+    def samples(self):
+        """
+        Returns:
+            list: (sample name, labels, value) tuples of all children.
+        """
+        samples = []
+        for values, child in list(self._children.items()):
+            samples.extend(child.samples(self.name, tuple(zip(self.labelnames, values))))
+        return samples
+
+
+class Callback:
+    """
+    A metric whose value is read from the service when scraped, e.g. a queue depth.
+
+    Attributes:
+        name (str): Metric name.
+        kind (str): ``gauge`` or ``counter``.
+    """
+
+    def __init__(self, name, help, kind, fn, labelnames):
+        """
+        Args:
+            name (str): Metric name.
+            help (str): Description.
+            kind (str): ``gauge`` or ``counter``.
+            fn (callable): Returns the value, or {(label values, ...): value}.
+            labelnames (tuple): Label names.
+        """
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._fn = fn
+
+    def samples(self):
+        """
+        Returns:
+            list: (sample name, labels, value) tuples read from the callback.
+        """
+        value = self._fn()
+        if not self.labelnames:
+            return [(self.name, (), value)]
+        return [(self.name, tuple(zip(self.labelnames, values)), v) for values, v in value.items()]
+
+
+class Registry:
+    """
+    The metrics of one service, rendered in the Prometheus text format by :meth:`expose`.
+    """
+
+    def __init__(self):
+        """
+        Start without metrics.
+        """
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        """
+        Returns:
+            Family: A counter family.
+        """
+        return self._register(Family(name, help, "counter", labels, Counter))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Returns:
+            Family: A histogram family.
+        """
+        return self._register(Family(name, help, "histogram", labels, lambda: Histogram(buckets)))
+
+    def gauge(self, name, help, fn, labels=()):
+        """
+        Register a value read at scrape time.
+
+        Args:
+            name (str): Metric name.
+            help (str): Description.
+            fn (callable): Returns the value, or {(label values, ...): value} if ``labels`` is given.
+            labels (tuple): Label names.
+        """
+        return self._register(Callback(name, help, "gauge", fn, labels))
+
+    def counter_fn(self, name, help, fn, labels=()):
+        """
+        Register a monotonic total kept elsewhere (e.g. bytes written), read at scrape time.
+
+        Args are the same as for :meth:`gauge`.
+        """
+        return self._register(Callback(name, help, "counter", fn, labels))
+
+    def expose(self):
+        """
+        Returns:
+            str: All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in list(self._metrics):
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                if labels:
+                    name += "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+                lines.append(f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        """
+        Add a metric to the exposition, in registration order.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+def sampled(rate):
+    """
+    Decide whether to write one of many similar log lines.
+
+    Args:
+        rate (float): Fraction of lines to keep; 1 keeps all, 0 none.
+
+    Returns:
+        bool: True for about ``rate`` of the calls.
+    """
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def instrument_flask(app, latency):
+    """
+    Record the latency of every request of a Flask app by method, route and status.
+
+    Args:
+        app (Flask): The app.
+        latency (Family): Histogram with the labels ("method", "route", "status").
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_latency(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            latency.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - start)
+        return response
+
+
+def aiohttp_middleware(latency):
+    """
+    Build an aiohttp middleware recording request latency by method, route and status.
+
+    Args:
+        latency (Family): Histogram with the labels ("method", "route", "status").
+
+    Returns:
+        The middleware.
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def observe_latency(request, handler):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else "unmatched"
+            latency.labels(request.method, route, str(status)).observe(time.perf_counter() - start)
+
+    return observe_latency
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(float(value) if isinstance(value, bool) else value)
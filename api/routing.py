@@ -0,0 +1,240 @@
+import threading
+
+POLICY_PRIMARY           = "primary"             # primary first, secondary only if it is unreachable
+POLICY_HEDGED            = "hedged"              # also ask the secondary if the primary is slower than its p95
+POLICY_LEAST_OUTSTANDING = "least_outstanding"   # start with the replica that has fewer requests in flight
+POLICIES = (POLICY_PRIMARY, POLICY_HEDGED, POLICY_LEAST_OUTSTANDING)
+
+
+class LatencyHistogram:
+    """
+    A fixed-size latency histogram with geometric buckets.
+
+    Recording is O(number of buckets) at worst and memory is constant. Once
+    ``decay_after`` samples are held all counts are halved, so the quantiles follow
+    recent behavior rather than the whole history.
+
+    Attributes:
+        bounds (list): Upper bound of each bucket in seconds.
+        counts (list): Samples per bucket.
+        total (int): Samples currently held.
+    """
+
+    def __init__(self, smallest=0.0005, factor=1.5, buckets=32, decay_after=10000):
+        """
+        Args:
+            smallest (float): Upper bound of the first bucket in seconds.
+            factor (float): Ratio between consecutive bucket bounds.
+            buckets (int): Number of buckets; the last one is unbounded.
+            decay_after (int): Sample count at which all counts are halved.
+        """
+        self.bounds = [smallest * factor ** i for i in range(buckets - 1)] + [float("inf")]
+        self.counts = [0] * buckets
+        self.total = 0
+        self.decay_after = decay_after
+
+    def record(self, seconds):
+        """
+        Args:
+            seconds (float): Observed latency.
+        """
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        if self.total >= self.decay_after:
+            self.counts = [c // 2 for c in self.counts]
+            self.total = sum(self.counts)
+
+    def quantile(self, q):
+        """
+        Args:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            float or None: Upper bound of the bucket holding the quantile, None if empty.
+        """
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float("inf") else self.bounds[-2]
+        return self.bounds[-2]
+
+
+class ReadRouter:
+    """
+    Chooses which replica serves a read and when to hedge, from per-node latency
+    histograms, in-flight request counts and the replication lag of secondaries.
+
+    A secondary is only used proactively (hedging or least-outstanding) while its
+    last reported replication lag is at most ``max_lag``; if the primary is
+    unreachable the secondary is still used as a fallback, as before.
+
+    Attributes:
+        policy (str): One of ``POLICIES``.
+        hedge_min (float): Lower bound of the hedge delay in seconds.
+        hedge_quantile (float): Primary latency quantile used as hedge delay.
+        min_samples (int): Samples needed before the quantile is trusted.
+        max_lag (float): Largest replication lag, in seconds, for proactive secondary reads.
+        hedges (int): Hedge requests sent.
+        hedge_wins (int): Hedge requests that answered first.
+    """
+
+    def __init__(self, policy=POLICY_PRIMARY, hedge_min=0.005, hedge_quantile=0.95, min_samples=20, max_lag=1.0):
+        """
+        Args:
+            policy (str): One of ``POLICIES``.
+            hedge_min (float): Lower bound of the hedge delay in seconds.
+            hedge_quantile (float): Primary latency quantile used as hedge delay.
+            min_samples (int): Samples needed before the quantile is trusted.
+            max_lag (float): Largest replication lag, in seconds, for proactive secondary reads.
+
+        Raises:
+            ValueError: If ``policy`` is unknown.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown read policy {policy!r}, expected one of {POLICIES}")
+        self.policy = policy
+        self.hedge_min = hedge_min
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.max_lag = max_lag
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._latency = {}      # node -> LatencyHistogram
+        self._outstanding = {}  # node -> requests in flight
+        self._lag = {}          # primary -> replication lag of its secondary in seconds
+
+    def begin(self, node):
+        """
+        Record that a request to ``node`` started.
+
+        Args:
+            node (str): Replica URL.
+        """
+        with self._lock:
+            self._outstanding[node] = self._outstanding.get(node, 0) + 1
+
+    def end(self, node, seconds=None):
+        """
+        Record that a request to ``node`` finished.
+
+        Args:
+            node (str): Replica URL.
+            seconds (float, optional): Latency of a successful request.
+        """
+        with self._lock:
+            self._outstanding[node] = self._outstanding.get(node, 1) - 1
+            if seconds is not None:
+                self._latency.setdefault(node, LatencyHistogram()).record(seconds)
+
+    def set_lag(self, primary, seconds):
+        """
+        Args:
+            primary (str): Primary URL.
+            seconds (float or None): Replication lag of its secondary, None if unknown.
+        """
+        with self._lock:
+            self._lag[primary] = seconds
+
+    def secondary_fresh(self, primary):
+        """
+        Args:
+            primary (str): Primary URL.
+
+        Returns:
+            bool: True if the primary's secondary is known to be within ``max_lag``.
+        """
+        with self._lock:
+            lag = self._lag.get(primary)
+        return lag is not None and lag <= self.max_lag
+
+    def order(self, primary, secondary):
+        """
+        Decide which replica to ask first.
+
+        Args:
+            primary (str): Primary URL.
+            secondary (str or None): Secondary URL.
+
+        Returns:
+            list: Replicas in the order they should be tried.
+        """
+        if secondary is None:
+            return [primary]
+        if self.policy == POLICY_LEAST_OUTSTANDING and self.secondary_fresh(primary):
+            with self._lock:
+                if self._outstanding.get(secondary, 0) < self._outstanding.get(primary, 0):
+                    return [secondary, primary]
+        return [primary, secondary]
+
+    def should_hedge(self, primary, secondary):
+        """
+        Args:
+            primary (str): Primary URL.
+            secondary (str or None): Secondary URL.
+
+        Returns:
+            bool: True if reads of this shard should be hedged.
+        """
+        return self.policy == POLICY_HEDGED and secondary is not None and self.secondary_fresh(primary)
+
+    def hedge_delay(self, node):
+        """
+        Args:
+            node (str): Replica that was asked first.
+
+        Returns:
+            float: Seconds to wait before sending the hedge request.
+        """
+        with self._lock:
+            hist = self._latency.get(node)
+            if hist is None or hist.total < self.min_samples:
+                return max(self.hedge_min, 0.05)
+            return max(self.hedge_min, hist.quantile(self.hedge_quantile))
+
+    def stats(self):
+        """
+        Returns:
+            dict: Policy, hedge counters and per-node latency quantiles, load and lag.
+        """
+        with self._lock:
+            nodes = {}
+            for node in set(self._latency) | set(self._outstanding):
+                hist = self._latency.get(node)
+                nodes[node] = {
+                    "outstanding": self._outstanding.get(node, 0),
+                    "samples": hist.total if hist else 0,
+                    "p50_ms": hist.quantile(0.5) * 1000 if hist and hist.total else None,
+                    "p95_ms": hist.quantile(0.95) * 1000 if hist and hist.total else None,
+                    "p99_ms": hist.quantile(0.99) * 1000 if hist and hist.total else None,
+                }
+            return {
+                "policy": self.policy,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "replication_lag_sec": dict(self._lag),
+                "nodes": nodes,
+            }
+
+
+def max_replication_lag(stats):
+    """
+    Extract the worst secondary lag from a primary's ``GET /stats`` response.
+
+    Args:
+        stats (dict): The parsed response.
+
+    Returns:
+        float or None: Lag in seconds, None if the primary reports no secondaries.
+    """
+    secondaries = stats.get("replication", {}).get("secondaries", {})
+    if not secondaries:
+        return None
+    return max(s.get("lag_seconds", 0.0) for s in secondaries.values())
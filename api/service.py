@@ -0,0 +1,334 @@
+"""
+Configuration, state and request logic shared by both API serving modes.
+
+The Flask API (app.py) and the asyncio API (async_app.py) only differ in how
+they send requests; routing, caching, merging moving and hot keys, admission
+control and the answers to queue errors are decided here, once for both.
+"""
+import os
+
+from admission import AdmissionRate, queue_delay
+from cache import CounterCache
+from hotkeys import HotKeys
+from metrics import Registry
+from routing import ReadRouter
+from tracing import Tracer
+from topology import Topology, follow, merge_counts
+
+STORE_NODES      = [n for n in os.getenv("STORE_NODES", "").split(",") if n]
+SECONDARY_NODES  = [n for n in os.getenv("STORE_SECONDARIES", "").split(",") if n]
+QUEUE_URL        = os.getenv("QUEUE_URL",   "http://queue:7000/enqueue")
+API_MODE         = os.getenv("API_MODE", "sync")  # sync (Flask) | async (aiohttp, see async_app.py)
+API_PORT         = int(os.getenv("API_PORT", "8000"))
+UPSTREAM_POOL_SIZE   = int(os.getenv("UPSTREAM_POOL_SIZE", "100"))  # keep-alive connections per upstream
+UPSTREAM_TIMEOUT_SEC = float(os.getenv("UPSTREAM_TIMEOUT_SEC", "2"))
+UPSTREAM_CONNECT_TIMEOUT_SEC = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_SEC", "0.5"))
+CACHE_MAX_KEYS   = int(os.getenv("CACHE_MAX_KEYS", "100000"))  # 0 disables the read cache
+CACHE_TTL_MS     = int(os.getenv("CACHE_TTL_MS", "1000"))  # maximum staleness of a cached read
+CACHE_ON_WRITE   = os.getenv("CACHE_ON_WRITE", "invalidate")  # invalidate | adjust | none
+MGET_MAX_KEYS    = int(os.getenv("MGET_MAX_KEYS", "1000"))  # keys allowed per batch read
+FANOUT_THREADS   = int(os.getenv("FANOUT_THREADS", "32"))  # concurrent shard requests for batch reads (sync mode)
+READ_POLICY      = os.getenv("READ_POLICY", "primary")  # primary | hedged | least_outstanding
+HEDGE_MIN_MS     = float(os.getenv("HEDGE_MIN_MS", "5"))  # never hedge earlier than this
+READ_MAX_LAG_MS  = int(os.getenv("READ_MAX_LAG_MS", "1000"))  # secondaries lagging more are only used as fallback
+LAG_POLL_SEC     = float(os.getenv("LAG_POLL_SEC", "1"))  # how often primaries are asked for replication lag
+RING_MEMO_SIZE   = int(os.getenv("RING_MEMO_SIZE", "100000"))  # memoized key-to-shard lookups, 0 disables
+TOPOLOGY_URL     = os.getenv("TOPOLOGY_URL", QUEUE_URL.rsplit("/", 1)[0] + "/topology")  # published by the queue
+TOPOLOGY_POLL_SEC = float(os.getenv("TOPOLOGY_POLL_SEC", "2"))  # 0 keeps the topology from the environment
+HOTKEYS_URL      = os.getenv("HOTKEYS_URL", QUEUE_URL.rsplit("/", 1)[0] + "/hotkeys")  # published by the queue
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # fraction of requests traced, 0 traces only requests with a sampled traceparent
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))  # finished spans kept for GET /debug/traces
+TRACE_FILE       = os.getenv("TRACE_FILE", "")  # JSON lines file finished spans are appended to, empty disables
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "aimd")  # aimd | off, see admission.py
+ADMISSION_TARGET_MS = float(os.getenv("ADMISSION_TARGET_MS", "500"))  # queueing delay the admission rate steers below
+ADMISSION_RATE   = float(os.getenv("ADMISSION_RATE", "1000"))  # initial increments per second admitted by this instance
+ADMISSION_MIN_RATE = float(os.getenv("ADMISSION_MIN_RATE", "10"))
+ADMISSION_MAX_RATE = float(os.getenv("ADMISSION_MAX_RATE", "100000"))
+ADMISSION_STEP   = float(os.getenv("ADMISSION_STEP", "50"))  # additive increase per 100 ms while the rate is the limit
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.5"))  # multiplicative decrease on overload
+COALESCE_WINDOW_MS = float(os.getenv("COALESCE_WINDOW_MS", "0"))  # merge increments of a key arriving this close, 0 disables
+
+TOPOLOGY = Topology(0, STORE_NODES, SECONDARY_NODES, memo_size=RING_MEMO_SIZE)  # replaced by adopt_topology
+CACHE = CounterCache(CACHE_MAX_KEYS, CACHE_TTL_MS / 1000.0, CACHE_ON_WRITE) if CACHE_MAX_KEYS > 0 else None
+ROUTER = ReadRouter(READ_POLICY, HEDGE_MIN_MS / 1000.0, max_lag=READ_MAX_LAG_MS / 1000.0)
+HOTKEYS = HotKeys()  # keys read as the sum of their sub-counters, filled by the topology poller
+ADMISSION = AdmissionRate(ADMISSION_TARGET_MS / 1000.0, ADMISSION_RATE, ADMISSION_MIN_RATE, ADMISSION_MAX_RATE,
+                          ADMISSION_STEP, ADMISSION_BACKOFF) if ADMISSION_CONTROL == "aimd" else None
+
+METRICS = Registry()  # exposed on GET /metrics
+REQUEST_LATENCY = METRICS.histogram("api_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+TRACER = Tracer("api", TRACE_SAMPLE_RATE, TRACE_BUFFER_SIZE, TRACE_FILE or None)
+
+
+def cache_events():
+    """
+    Returns:
+        dict: {(event,): count} of the read cache's hit, miss, eviction and collapse counters.
+    """
+    stats = CACHE.stats()
+    return {(event,): stats[event] for event in ("hits", "misses", "evictions", "collapsed")}
+
+
+METRICS.counter_fn("api_cache_events_total", "Read cache hits, misses, evictions and collapsed loads",
+                   cache_events if CACHE is not None else dict, ("event",))
+METRICS.counter_fn("api_read_hedges_total", "Reads hedged to a second replica", lambda: ROUTER.hedges)
+METRICS.gauge("api_upstream_outstanding", "Read requests in flight per store node",
+              lambda: {(node,): stats["outstanding"] for node, stats in ROUTER.stats()["nodes"].items()}, ("node",))
+if ADMISSION is not None:
+    METRICS.gauge("api_admission_rate", "Increments per second admission control lets through", lambda: ADMISSION.rate)
+    METRICS.gauge("api_queue_delay_seconds", "Queueing delay last reported by the queue", lambda: ADMISSION.delay)
+    METRICS.counter_fn("api_admission_rejected_total", "Increments rejected locally by admission control",
+                       lambda: ADMISSION.rejected)
+
+
+def current_topology():
+    """
+    Returns:
+        Topology: The shard topology to route with. Grab it once per request, so the
+        request keeps a consistent view while the topology is replaced.
+    """
+    return TOPOLOGY
+
+
+def adopt_topology(config):
+    """
+    Follow the topology published by the queue (see ``topology.follow``).
+
+    Args:
+        config (dict): The published topology.
+
+    Raises:
+        ValueError: If the config is malformed.
+    """
+    global TOPOLOGY
+    TOPOLOGY = follow(TOPOLOGY, config, RING_MEMO_SIZE)
+
+
+def secondary_for(node):
+    """
+    Args:
+        node (str): A primary store node.
+
+    Returns:
+        str or None: Its secondary, if one is configured.
+    """
+    return TOPOLOGY.secondary_for(node)
+
+
+def counter_owners(key):
+    """
+    Args:
+        key (str): A counter key that is not hot.
+
+    Returns:
+        tuple: (node owning the key, node it is moving away from or None).
+    """
+    topology = TOPOLOGY
+    return topology.ring.get_node(key), topology.previous_owner(key)
+
+
+def counter_value(value, previous=None):
+    """
+    Combine the parts of a counter read from its owner and previous owner.
+
+    Args:
+        value: Value on the owner, None if missing.
+        previous: Value on the previous owner, None if missing or not moving.
+
+    Returns:
+        str: The counter value, "0" if neither node has the key.
+    """
+    value = merge_counts(value, previous)
+    return "0" if value is None else value
+
+
+def parse_keys(body):
+    """
+    Validate the body of a batch read.
+
+    Args:
+        body: The parsed JSON body, None if it was not JSON.
+
+    Returns:
+        list: The requested keys.
+
+    Raises:
+        ValueError: With the message to answer 400 with.
+    """
+    keys = body.get("keys") if isinstance(body, dict) else None
+    if not isinstance(keys, list) or not all(isinstance(k, str) for k in keys):
+        raise ValueError("Request JSON must include a 'keys' list of strings")
+    if len(keys) > MGET_MAX_KEYS:
+        raise ValueError(f"At most {MGET_MAX_KEYS} keys per request")
+    return keys
+
+
+def cached_counters(keys):
+    """
+    Answer what the read cache can of a batch read.
+
+    Args:
+        keys (list): The requested keys.
+
+    Returns:
+        tuple: ({key: value} of the cached keys, missing keys, store keys to read for
+        the missing ones, hot keys expanded to their sub-counters).
+    """
+    values = {}
+    misses = []
+    for key in dict.fromkeys(keys):
+        hit, value = CACHE.get(key) if CACHE is not None else (False, None)
+        if hit:
+            values[key] = value
+        else:
+            misses.append(key)
+    return values, misses, [part for key in misses for part in HOTKEYS.expand(key)]
+
+
+def complete_counters(values, misses, found):
+    """
+    Fill the missing keys of a batch read from the store values and cache them.
+
+    Args:
+        values (dict): The cached values, completed in place.
+        misses (list): The keys that were not cached.
+        found (dict): Values read from the store for the expanded missing keys.
+
+    Returns:
+        dict: ``values``; unknown keys are "0".
+    """
+    for key in misses:
+        values[key] = HOTKEYS.total(key, found)
+        if CACHE is not None:
+            CACHE.put(key, values[key])
+    return values
+
+
+def plan_reads(keys):
+    """
+    Group the keys of a bulk read by the store nodes to ask.
+
+    Args:
+        keys (list): The keys to look up.
+
+    Returns:
+        tuple: ({node: [keys]} by owner, {node: [keys]} of moving keys by previous owner).
+    """
+    topology = TOPOLOGY
+    return topology.ring.group(keys), topology.moving(keys)
+
+
+def merge_reads(owned, previous):
+    """
+    Combine the answers to the bulk reads of :func:`plan_reads`.
+
+    Args:
+        owned (iterable): {key: value} answers of the owners.
+        previous (iterable): {key: value} answers of the previous owners.
+
+    Returns:
+        dict: {key: value} for the keys that exist, moving keys summed over both parts.
+    """
+    found = {}
+    for shard_values in owned:
+        found.update(shard_values)
+    for shard_values in previous:
+        for key, value in shard_values.items():
+            found[key] = merge_counts(found.get(key), value)
+    return found
+
+
+def read_span(node, path, kwargs):
+    """
+    Start the span of a store read if the request is traced, sending its trace context along.
+
+    Args:
+        node (str): The primary store node.
+        path (str): Request path on the store node.
+        kwargs (dict): Request options, given the trace header.
+
+    Returns:
+        Span or None: The span to finish when the read is done.
+    """
+    span = TRACER.current()
+    if span is None:
+        return None
+    span = span.child("api.store_read", node=node, path=path)
+    kwargs["headers"] = span.headers()
+    return span
+
+
+def admit():
+    """
+    Ask admission control for one increment.
+
+    Returns:
+        tuple or None: ``(429, message)`` if the increment is rejected right away.
+    """
+    if ADMISSION is not None and not ADMISSION.acquire():
+        return 429, "Too many requests – queue is overloaded"
+    return None
+
+
+def increment_job(key, delta=1):
+    """
+    Args:
+        key (str): The key to increment.
+        delta (int): The increment, more than 1 for coalesced increments.
+
+    Returns:
+        dict: The job to enqueue.
+    """
+    job = {"action": "increment", "key": key}
+    if delta != 1:
+        job["delta"] = delta
+    return job
+
+
+def queue_answered(status, headers):
+    """
+    Feed the queue's answer to an enqueue to admission control.
+
+    An accepted job reports the queueing delay; a full queue (429) or an
+    unavailable shard or queue (5xx) signals overload.
+
+    Args:
+        status (int): HTTP status of ``/enqueue``.
+        headers (Mapping): Its response headers.
+
+    Returns:
+        tuple or None: ``(status, message)`` to answer the client with if the
+        queue did not accept the job.
+    """
+    if ADMISSION is not None:
+        ADMISSION.release(queue_delay(headers), overloaded=status == 429 or status >= 500)
+    if status == 429:
+        return 429, "Too many requests – queue is full"
+    if status >= 500:
+        return 503, "Queue unavailable"
+    return None
+
+
+def queue_unreachable():
+    """
+    Report a failed attempt to reach the queue to admission control.
+
+    Returns:
+        tuple: ``(503, message)`` to answer the client with.
+    """
+    if ADMISSION is not None:
+        ADMISSION.release(overloaded=True)
+    return 503, "Queue unreachable"
+
+
+def admission_report(coalescer):
+    """
+    Args:
+        coalescer (Coalescer or None): The instance's increment coalescer.
+
+    Returns:
+        dict: Admission control statistics and the number of merged increments.
+    """
+    stats = ADMISSION.stats() if ADMISSION is not None else {"enabled": False}
+    stats["coalesced"] = coalescer.merged if coalescer is not None else 0
+    return stats
@@ -0,0 +1,306 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+HEADER = "traceparent"  # W3C trace context: 00-<trace id>-<parent span id>-<flags>
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """
+    One timed stage of a traced request.
+
+    Spans are only created for sampled traces; code on hot paths checks for a
+    span (``if span is not None``) before doing any tracing work, so an unsampled
+    request costs one context variable lookup per stage.
+
+    Attributes:
+        trace_id (str): 32 hex digits shared by all spans of the request.
+        span_id (str): 16 hex digits.
+        parent_id (str or None): Span id of the parent, possibly in another service.
+        name (str): The stage, e.g. ``queue.dwell``.
+        start (float): Start as a Unix timestamp, comparable across services on one host.
+        attrs (dict): Extra attributes.
+    """
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start", "end", "attrs")
+
+    def __init__(self, tracer, trace_id, parent_id, name, start=None, attrs=None):
+        """
+        Args:
+            tracer (Tracer): Exports the span when it ends.
+            trace_id (str): Trace id.
+            parent_id (str or None): Parent span id.
+            name (str): The stage.
+            start (float, optional): Start timestamp, defaults to now.
+            attrs (dict, optional): Extra attributes.
+        """
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attrs = attrs or {}
+
+    def child(self, name, **attrs):
+        """
+        Start a child span now; end it with :meth:`finish` or a ``with`` block.
+
+        Returns:
+            Span: The child.
+        """
+        return Span(self.tracer, self.trace_id, self.span_id, name, attrs=attrs)
+
+    def record(self, name, start, end, **attrs):
+        """
+        Export a child span that was timed elsewhere, e.g. the time a job waited in a queue.
+
+        Args:
+            name (str): The stage.
+            start (float): Start timestamp.
+            end (float): End timestamp.
+        """
+        span = Span(self.tracer, self.trace_id, self.span_id, name, start, attrs)
+        span.finish(end=end)
+
+    def finish(self, end=None, **attrs):
+        """
+        End the span and export it.
+
+        Args:
+            end (float, optional): End timestamp, defaults to now.
+            **attrs: Attributes to add.
+        """
+        self.end = time.time() if end is None else end
+        self.attrs.update(attrs)
+        self.tracer.export(self)
+
+    def traceparent(self):
+        """
+        Returns:
+            str: The trace context with this span as parent, for the ``traceparent`` header.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def headers(self):
+        """
+        Returns:
+            dict: Headers continuing the trace in the called service.
+        """
+        return {HEADER: self.traceparent()}
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The span as exported.
+        """
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.tracer.service,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": (self.end - self.start) * 1000,
+            "attrs": self.attrs,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+class Tracer:
+    """
+    Starts spans for sampled requests and keeps the finished ones.
+
+    A request that carries a sampled ``traceparent`` header continues that trace;
+    a request without one starts a new trace with probability ``sample_rate``.
+    Finished spans go to a ring buffer of the newest ``buffer_size`` spans and,
+    with ``path``, are appended to a JSON lines file.
+
+    Attributes:
+        service (str): Name of the service in exported spans.
+        sample_rate (float): Fraction of requests without trace context that start a trace.
+    """
+
+    def __init__(self, service, sample_rate=0.0, buffer_size=10000, path=None):
+        """
+        Args:
+            service (str): Name of the service.
+            sample_rate (float): Fraction of new requests traced; 0 turns tracing off for them.
+            buffer_size (int): Finished spans kept in memory.
+            path (str, optional): JSON lines file that finished spans are appended to.
+        """
+        self.service = service
+        self.sample_rate = sample_rate
+        self.spans = deque(maxlen=buffer_size)
+        self.path = path
+        self._file_lock = threading.Lock()
+
+    def start(self, name, traceparent=None, **attrs):
+        """
+        Start the root span of a request in this service, if the request is traced.
+
+        Args:
+            name (str): The stage, e.g. the route.
+            traceparent (str, optional): The incoming ``traceparent`` header.
+            **attrs: Span attributes.
+
+        Returns:
+            Span or None: The span, None if the request is not traced.
+        """
+        if traceparent:
+            parts = traceparent.split("-")
+            if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[3] != "01":
+                return None  # malformed, or the caller decided not to sample
+            return Span(self, parts[1], parts[2], name, attrs=attrs)
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return Span(self, _new_id(16), None, name, attrs=attrs)
+
+    def continue_from(self, traceparent, name, start=None, **attrs):
+        """
+        Start a span under a stored trace context, e.g. one carried by a queued job.
+
+        Args:
+            traceparent (str): A ``traceparent`` produced by :meth:`Span.traceparent`.
+            name (str): The stage.
+            start (float, optional): Start timestamp, defaults to now.
+
+        Returns:
+            Span: The span.
+        """
+        _, trace_id, parent_id, _ = traceparent.split("-")
+        return Span(self, trace_id, parent_id, name, start, attrs)
+
+    def current(self):
+        """
+        Returns:
+            Span or None: The span of the request handled by the calling thread or task.
+        """
+        return _current.get()
+
+    def activate(self, span):
+        """
+        Make a span the current one of the calling thread or task.
+
+        Returns:
+            contextvars.Token: Pass to :meth:`deactivate`.
+        """
+        return _current.set(span)
+
+    def deactivate(self, token):
+        """
+        Restore the span that was current before :meth:`activate`.
+        """
+        _current.reset(token)
+
+    def export(self, span):
+        """
+        Keep a finished span in the ring buffer and append it to the trace file.
+
+        Args:
+            span (Span): The finished span.
+        """
+        record = span.to_dict()
+        self.spans.append(record)
+        if self.path:
+            line = json.dumps(record) + "\n"
+            with self._file_lock:
+                with open(self.path, "a") as f:
+                    f.write(line)
+
+    def recent(self, trace_id=None, limit=1000):
+        """
+        Args:
+            trace_id (str, optional): Only spans of this trace.
+            limit (int): Maximum number of spans, the newest are kept.
+
+        Returns:
+            list: Finished spans, oldest first.
+        """
+        spans = [s for s in list(self.spans) if trace_id is None or s["trace_id"] == trace_id]
+        return spans[-limit:] if limit > 0 else []
+
+
+def trace_flask(app, tracer):
+    """
+    Trace the requests of a Flask app: a span per request, named by method and route,
+    current while the handler runs.
+
+    Args:
+        app (Flask): The app.
+        tracer (Tracer): The service's tracer.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_span():
+        span = tracer.start(request.method, request.headers.get(HEADER))
+        if span is not None:
+            g.trace_span = span
+            g.trace_token = tracer.activate(span)
+
+    @app.after_request
+    def _finish_span(response):
+        span = g.pop("trace_span", None)
+        if span is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            span.name = f"{span.name} {route}"
+            span.finish(status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _deactivate_span(exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            tracer.deactivate(token)
+
+
+def trace_aiohttp(tracer):
+    """
+    Build an aiohttp middleware tracing every request like :func:`trace_flask`.
+
+    Args:
+        tracer (Tracer): The service's tracer.
+
+    Returns:
+        The middleware.
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def trace_request(request, handler):
+        span = tracer.start(request.method, request.headers.get(HEADER))
+        if span is None:
+            return await handler(request)
+        token = tracer.activate(span)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            tracer.deactivate(token)
+            resource = request.match_info.route.resource
+            span.name = f"{span.name} {resource.canonical if resource is not None else 'unmatched'}"
+            span.finish(status=status)
+
+    return trace_request
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
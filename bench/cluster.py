@@ -0,0 +1,150 @@
+"""
+A local cluster of the store, queue and API services as plain processes on loopback ports.
+
+Every service runs from its own directory with ``python <app>``, configured
+only through environment variables like in ``docker-compose.yml``, so no Docker
+is needed. Logs and store data go to a working directory.
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    """
+    Returns:
+        int: A loopback port that was free a moment ago.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalCluster:
+    """
+    Store primaries (and optionally one secondary each), one queue and one or more API instances.
+
+    Use as a context manager; leaving it stops every process.
+
+    Attributes:
+        primaries (list): Store primary URLs, one per shard.
+        secondaries (list): Store secondary URLs, empty without replicas.
+        queue_url (str): Base URL of the queue.
+        api_urls (list): Base URLs of the API instances.
+    """
+
+    def __init__(self, workdir, shards=2, replicas=False, apis=1, api_mode="sync", env=None, start_timeout=30.0):
+        """
+        Args:
+            workdir (str): Directory for logs and store data.
+            shards (int): Number of store primaries.
+            replicas (bool): Start a secondary for every primary.
+            apis (int): Number of API instances.
+            api_mode (str): ``sync`` or ``async``, see ``API_MODE``.
+            env (dict, optional): Extra environment per service: {"store": {...}, "queue": {...}, "api": {...}}.
+            start_timeout (float): Seconds to wait for every service to answer.
+        """
+        self.workdir = workdir
+        self.env = env or {}
+        self.start_timeout = start_timeout
+        self.primaries = [f"http://127.0.0.1:{free_port()}" for _ in range(shards)]
+        self.secondaries = [f"http://127.0.0.1:{free_port()}" for _ in range(shards)] if replicas else []
+        self.queue_url = f"http://127.0.0.1:{free_port()}"
+        self.api_urls = [f"http://127.0.0.1:{free_port()}" for _ in range(apis)]
+        self.api_mode = api_mode
+        self._procs = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """
+        Start all services, stores first, and wait until each one answers.
+
+        Raises:
+            RuntimeError: If a service exits or does not answer within ``start_timeout``.
+        """
+        os.makedirs(self.workdir, exist_ok=True)
+        nodes = ",".join(self.primaries)
+        secondaries = ",".join(self.secondaries)
+        for i, url in enumerate(self.primaries):
+            env = {"LOG_PATH": os.path.join(self.workdir, f"store{i}.log"), "STORE_PORT": _port(url),
+                   "INGEST_PORT": str(free_port())}
+            if self.secondaries:
+                env["SECONDARIES"] = self.secondaries[i]
+            self._spawn(f"store{i}", "store", "store.py", env, f"{url}/stats")
+        for i, url in enumerate(self.secondaries):
+            env = {"LOG_PATH": os.path.join(self.workdir, f"store{i}-secondary.log"), "STORE_PORT": _port(url),
+                   "PRIMARY_URL": self.primaries[i], "INGEST_PORT": str(free_port())}
+            self._spawn(f"store{i}-secondary", "store", "store.py", env, f"{url}/stats")
+        self._spawn("queue", "queue", "app.py", {
+            "QUEUE_PORT": _port(self.queue_url),
+            "QUEUE_DIR": os.path.join(self.workdir, "queue-data"),
+            "STORE_NODES": nodes,
+            "STORE_SECONDARIES": secondaries,
+        }, f"{self.queue_url}/lanes")
+        for i, url in enumerate(self.api_urls):
+            self._spawn(f"api{i}", "api", "app.py", {
+                "API_PORT": _port(url),
+                "API_MODE": self.api_mode,
+                "STORE_NODES": nodes,
+                "STORE_SECONDARIES": secondaries,
+                "QUEUE_URL": f"{self.queue_url}/enqueue",
+            }, f"{url}/health")
+
+    def stop(self):
+        """
+        Terminate all services, newest first, killing those that do not exit within 5 seconds.
+        """
+        for name, proc, log in reversed(self._procs):
+            proc.terminate()
+        for name, proc, log in reversed(self._procs):
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            log.close()
+        self._procs = []
+
+    def _spawn(self, name, service, script, env, ready_url):
+        """
+        Start one service and wait until ``ready_url`` answers.
+
+        Args:
+            name (str): Process name, also the log file name.
+            service (str): Service directory below the repository root.
+            script (str): Script to run in that directory.
+            env (dict): Environment on top of ``os.environ`` and the profile's service env.
+            ready_url (str): URL polled until it answers without a server error.
+        """
+        full_env = {**os.environ, **{k: str(v) for k, v in self.env.get(service, {}).items()}, **env}
+        log = open(os.path.join(self.workdir, f"{name}.out"), "w")
+        proc = subprocess.Popen([sys.executable, script], cwd=os.path.join(ROOT, service), env=full_env,
+                                stdout=log, stderr=subprocess.STDOUT)
+        self._procs.append((name, proc, log))
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{name} exited with {proc.returncode}, see {log.name}")
+            try:
+                if requests.get(ready_url, timeout=1).status_code < 500:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"{name} did not answer {ready_url} within {self.start_timeout}s, see {log.name}")
+
+
+def _port(url):
+    return url.rsplit(":", 1)[1]
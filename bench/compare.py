@@ -0,0 +1,70 @@
+"""
+Compare result files of ``run.py``, e.g. the same profile before and after a change.
+
+The first file is the baseline; every other file is shown with its change
+relative to it.
+
+Usage:
+    python bench/compare.py BASELINE.json OTHER.json [...]
+"""
+import argparse
+import json
+
+COLUMNS = (
+    # (header, path in the result file, format)
+    ("req/s", ("throughput_rps",), "{:,.0f}"),
+    ("ok/s", ("ok_rps",), "{:,.0f}"),
+    ("p50 ms", ("latency_ms", "p50_ms"), "{:.1f}"),
+    ("p99 ms", ("latency_ms", "p99_ms"), "{:.1f}"),
+    ("p99.9 ms", ("latency_ms", "p999_ms"), "{:.1f}"),
+    ("429 rate", ("rate_429",), "{:.1%}"),
+    ("stale drops", ("queue", "stale_dropped"), "{:.0f}"),
+    ("missing", ("correctness", "missing"), "{:d}"),
+)
+
+
+def value(results, path):
+    """
+    Args:
+        results (dict): The ``results`` of a result file.
+        path (tuple): Keys leading to the value.
+
+    Returns:
+        The value, None if the file lacks it.
+    """
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="result files, the first is the baseline")
+    args = parser.parse_args()
+
+    runs = []
+    for path in args.files:
+        with open(path) as f:
+            runs.append(json.load(f))
+    profiles = {run["profile"].get("name") for run in runs}
+    if len(profiles) > 1:
+        print(f"warning: comparing different profiles {sorted(profiles)}")
+
+    print(f"{'run':<24}" + "".join(f"{header:>18}" for header, _, _ in COLUMNS))
+    base = runs[0]["results"]
+    for path, run in zip(args.files, runs):
+        commit = (run["git"]["commit"] or "nogit")[:8] + ("+" if run["git"]["dirty"] else "")
+        cells = []
+        for _, key, fmt in COLUMNS:
+            v, b = value(run["results"], key), value(base, key)
+            cell = "-" if v is None else fmt.format(v)
+            if run is not runs[0] and v is not None and b:
+                cell += f" ({(v - b) / abs(b):+.0%})"
+            cells.append(f"{cell:>18}")
+        print(f"{commit + ' ' + run['started_at'][:16]:<24}" + "".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+End-to-end load benchmark on a local cluster.
+
+Starts the store, queue and API services as local processes (see cluster.py)
+as described by a profile in ``profiles/``, drives the workload of the profile
+against the API (see workload.py), waits until the queue has drained and then
+checks that every counter holds exactly the increments the API acknowledged.
+The results, together with the effective profile, the git commit and the host,
+are printed and saved as JSON, so runs can be compared across commits with
+``compare.py``.
+
+A profile is a JSON object with the keys ``cluster`` (``shards``, ``replicas``,
+``apis``, ``api_mode`` and per-service ``env``), ``workload`` (the arguments of
+:class:`workload.Workload`) and optionally ``drain_timeout_sec``. Command-line
+options override single values.
+
+Usage:
+    python bench/run.py [--profile smoke] [--shards 2] [--workers 4] [--distribution zipf]
+                        [--read-ratio 0.2] [--rate 500] [--duration 30] [--set queue.MAX_KEY_RATE=1000]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cluster import ROOT, LocalCluster
+from workload import Workload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROFILES = os.path.join(HERE, "profiles")
+RESULTS = os.path.join(HERE, "results")
+READ_CHUNK = 1000  # keys per POST /counters, the API's default MGET_MAX_KEYS
+
+
+def load_profile(name):
+    """
+    Args:
+        name (str): A profile name from ``profiles/`` or the path of a profile file.
+
+    Returns:
+        dict: The profile.
+    """
+    path = name if os.path.exists(name) else os.path.join(PROFILES, f"{name}.json")
+    with open(path) as f:
+        profile = json.load(f)
+    profile.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    profile.setdefault("cluster", {}).setdefault("env", {})
+    profile.setdefault("workload", {})
+    return profile
+
+
+def apply_overrides(profile, args):
+    """
+    Apply the command-line overrides to a profile in place.
+
+    Args:
+        profile (dict): The profile.
+        args (argparse.Namespace): Parsed options; unset ones are None.
+
+    Raises:
+        ValueError: If a ``--set`` option is not ``service.VAR=value``.
+    """
+    cluster, workload, env = profile["cluster"], profile["workload"], profile["cluster"]["env"]
+    for option, key in (("shards", "shards"), ("replicas", "replicas"), ("apis", "apis"), ("api_mode", "api_mode")):
+        if getattr(args, option) is not None:
+            cluster[key] = getattr(args, option)
+    for option in ("duration_sec", "concurrency", "rate", "read_ratio", "keys", "distribution", "zipf_s", "seed"):
+        if getattr(args, option) is not None:
+            workload[option] = getattr(args, option)
+    if args.workers is not None:
+        env.setdefault("queue", {})["WORKER_COUNT"] = args.workers
+    for item in args.set:
+        name, _, value = item.partition("=")
+        service, _, var = name.partition(".")
+        if not value or not var or service not in ("store", "queue", "api"):
+            raise ValueError(f"--set expects service.VAR=value with service store, queue or api, got {item!r}")
+        env.setdefault(service, {})[var] = value
+
+
+def scrape(url):
+    """
+    Read a ``/metrics`` endpoint, summing each metric over its labels.
+
+    Args:
+        url (str): The metrics URL.
+
+    Returns:
+        dict: {metric name: total}.
+    """
+    totals = {}
+    for line in requests.get(url, timeout=5).text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, value = line.rsplit(" ", 1)
+        name = name.split("{", 1)[0]
+        totals[name] = totals.get(name, 0.0) + float(value)
+    return totals
+
+
+def wait_drained(cluster, timeout):
+    """
+    Wait until the queue holds no jobs and has stopped applying or dropping any.
+
+    Args:
+        cluster (LocalCluster): The cluster.
+        timeout (float): Seconds to wait at most.
+
+    Returns:
+        tuple: (drained, seconds waited).
+    """
+    start = time.monotonic()
+    last = None
+    while time.monotonic() - start < timeout:
+        lanes = requests.get(f"{cluster.queue_url}/lanes", timeout=5).json()
+        waiting = lanes["stale"] + sum(lane["queued"] + lane["excess"] + lane.get("held", 0) for lane in lanes["lanes"].values())
+        metrics = scrape(f"{cluster.queue_url}/metrics")
+        done = (metrics.get("queue_jobs_processed_total", 0), metrics.get("queue_stale_dropped_total", 0))
+        if waiting == 0 and done == last:
+            return True, time.monotonic() - start
+        last = done if waiting == 0 else None
+        time.sleep(0.5)
+    return False, time.monotonic() - start
+
+
+def verify(cluster, accepted, uncertain, cache_ttl_sec):
+    """
+    Compare every counter with the increments the API acknowledged.
+
+    Args:
+        cluster (LocalCluster): The cluster.
+        accepted (Counter): Acknowledged increments per key.
+        uncertain (int): Increments with an unknown outcome.
+        cache_ttl_sec (float): Read cache TTL of the API, waited out first.
+
+    Returns:
+        dict: Expected and observed totals, their difference and the mismatching keys.
+    """
+    time.sleep(cache_ttl_sec)
+    keys = sorted(accepted)
+    observed = {}
+    for start in range(0, len(keys), READ_CHUNK):
+        resp = requests.post(f"{cluster.api_urls[0]}/counters", json={"keys": keys[start:start + READ_CHUNK]}, timeout=30)
+        resp.raise_for_status()
+        observed.update({key: int(value or 0) for key, value in resp.json()["values"].items()})
+    mismatched = [key for key in keys if observed.get(key, 0) != accepted[key]]
+    expected_total = sum(accepted.values())
+    observed_total = sum(observed.values())
+    return {
+        "expected_total": expected_total,
+        "observed_total": observed_total,
+        "missing": expected_total - observed_total,
+        "uncertain_writes": uncertain,
+        "keys_checked": len(keys),
+        "keys_mismatched": len(mismatched),
+        "mismatch_examples": {key: [accepted[key], observed.get(key, 0)] for key in mismatched[:10]},
+        "correct": not mismatched,
+    }
+
+
+def git_revision():
+    """
+    Returns:
+        dict: Commit hash and whether tracked files have uncommitted changes.
+    """
+    def git(*cmd):
+        return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", default="smoke", help="profile name in bench/profiles or a profile file")
+    parser.add_argument("--shards", type=int)
+    parser.add_argument("--replicas", type=int, choices=[0, 1], help="start a secondary per shard")
+    parser.add_argument("--apis", type=int, help="API instances")
+    parser.add_argument("--api-mode", choices=["sync", "async"])
+    parser.add_argument("--workers", type=int, help="WORKER_COUNT of the queue")
+    parser.add_argument("--duration", dest="duration_sec", type=float)
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--rate", type=float, help="target requests per second, 0 for a closed loop")
+    parser.add_argument("--read-ratio", type=float)
+    parser.add_argument("--keys", type=int)
+    parser.add_argument("--distribution", choices=["uniform", "zipf"])
+    parser.add_argument("--zipf-s", type=float)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--set", action="append", default=[], metavar="SERVICE.VAR=VALUE",
+                        help="environment of a service, e.g. queue.MAX_KEY_RATE=1000")
+    parser.add_argument("--out", help="result file (default: bench/results/<profile>-<commit>-<time>.json)")
+    parser.add_argument("--workdir", help="directory for logs and data (default: a temporary one, removed)")
+    args = parser.parse_args()
+
+    profile = load_profile(args.profile)
+    apply_overrides(profile, args)
+    cluster_conf = profile["cluster"]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-")
+    started = datetime.datetime.now(datetime.timezone.utc)
+    cache_ttl_sec = float(cluster_conf["env"].get("api", {}).get("CACHE_TTL_MS", 1000)) / 1000.0
+
+    try:
+        with LocalCluster(workdir, shards=cluster_conf.get("shards", 2), replicas=bool(cluster_conf.get("replicas")),
+                          apis=cluster_conf.get("apis", 1), api_mode=cluster_conf.get("api_mode", "sync"),
+                          env=cluster_conf["env"]) as cluster:
+            workload = Workload(cluster.api_urls, **profile["workload"])
+            print(f"[bench] {profile['name']}: {json.dumps(profile['workload'])}")
+            results = workload.run()
+            drained, drain_sec = wait_drained(cluster, profile.get("drain_timeout_sec", 60))
+            queue = scrape(f"{cluster.queue_url}/metrics")
+            results["queue"] = {
+                "drained": drained,
+                "drain_sec": drain_sec,
+                "processed": queue.get("queue_jobs_processed_total", 0),
+                "rate_limited": queue.get("queue_rate_limited_total", 0),
+                "sidelined": queue.get("queue_sidelined_total", 0),
+                "stale_dropped": queue.get("queue_stale_dropped_total", 0),
+            }
+            results["correctness"] = verify(cluster, workload.accepted, workload.uncertain, cache_ttl_sec)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    revision = git_revision()
+    report = {
+        "profile": profile,
+        "git": revision,
+        "started_at": started.isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS, f"{profile['name']}-{(revision['commit'] or 'nogit')[:8]}-"
+                                            f"{started.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    lat, correctness = results["latency_ms"], results["correctness"]
+    print(f"[bench] {results['requests']} requests in {results['elapsed_sec']:.1f}s: "
+          f"{results['throughput_rps']:,.0f} req/s ({results['ok_rps']:,.0f} ok/s), "
+          f"p50 {lat['p50_ms']:.1f} ms, p99 {lat['p99_ms']:.1f} ms, p99.9 {lat['p999_ms']:.1f} ms, "
+          f"429 rate {results['rate_429']:.1%}")
+    print(f"[bench] stale drops {results['queue']['stale_dropped']:.0f}, drained {results['queue']['drained']}, "
+          f"expected {correctness['expected_total']} observed {correctness['observed_total']} "
+          f"({correctness['keys_mismatched']} keys differ, {correctness['uncertain_writes']} uncertain writes)")
+    print(f"[bench] saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Load generation against the API: key distributions, read/write mix and burst patterns.
+
+Without a target rate every client thread sends its next request as soon as the
+previous one returned (closed loop). With ``rate`` a scheduler thread draws
+Poisson arrivals and the client threads send them (open loop); latency is then
+measured from the scheduled send time, so time spent waiting for a free client
+thread is included instead of hidden (coordinated omission).
+"""
+import bisect
+import itertools
+import queue
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+
+import requests
+from requests.adapters import HTTPAdapter
+
+UNIFORM = "uniform"
+ZIPF    = "zipf"
+
+
+class KeySampler:
+    """
+    Draws keys ``key-0`` .. ``key-<n-1>`` uniformly or Zipf distributed.
+
+    Under Zipf the i-th key (1-based) is drawn with probability proportional to
+    ``1 / i**s``, so ``key-0`` is the hottest.
+    """
+
+    def __init__(self, keys, distribution=UNIFORM, zipf_s=1.1):
+        """
+        Args:
+            keys (int): Number of distinct keys.
+            distribution (str): ``uniform`` or ``zipf``.
+            zipf_s (float): Zipf exponent; larger is more skewed.
+
+        Raises:
+            ValueError: If the distribution is unknown.
+        """
+        if distribution not in (UNIFORM, ZIPF):
+            raise ValueError(f"unknown key distribution {distribution!r}")
+        self.names = [f"key-{i}" for i in range(keys)]
+        self._cum = list(accumulate(1.0 / (i ** zipf_s) for i in range(1, keys + 1))) if distribution == ZIPF else None
+
+    def sample(self, rng):
+        """
+        Args:
+            rng (random.Random): The calling thread's generator.
+
+        Returns:
+            str: A key.
+        """
+        if self._cum is None:
+            return self.names[rng.randrange(len(self.names))]
+        return self.names[bisect.bisect_left(self._cum, rng.random() * self._cum[-1])]
+
+
+def rate_at(elapsed, rate, burst):
+    """
+    The target request rate at a point of the run.
+
+    Args:
+        elapsed (float): Seconds since the start.
+        rate (float): Base rate in requests per second.
+        burst (dict or None): {"period_sec", "burst_sec", "factor"}: the first
+            ``burst_sec`` of every ``period_sec`` run at ``factor`` times the rate.
+
+    Returns:
+        float: Requests per second.
+    """
+    if burst and elapsed % burst["period_sec"] < burst["burst_sec"]:
+        return rate * burst["factor"]
+    return rate
+
+
+def percentile(values, p):
+    """
+    Args:
+        values (list): Sorted samples.
+        p (float): Percentile between 0 and 100.
+
+    Returns:
+        float: The nearest-rank percentile.
+    """
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))
+    return values[idx]
+
+
+class Workload:
+    """
+    Drives reads (``GET /counter/<key>``) and increments (``POST /counter/<key>/increment``)
+    against one or more API instances and records every outcome.
+
+    Attributes:
+        accepted (Counter): Increments per key the API acknowledged with 202.
+        uncertain (int): Increments whose outcome is unknown (timeouts, connection errors).
+    """
+
+    def __init__(self, api_urls, duration_sec=10.0, concurrency=16, rate=0.0, read_ratio=0.5,
+                 keys=1000, distribution=UNIFORM, zipf_s=1.1, burst=None, timeout=5.0, seed=42):
+        """
+        Args:
+            api_urls (list): API base URLs, used round robin.
+            duration_sec (float): Length of the run.
+            concurrency (int): Client threads.
+            rate (float): Target requests per second, 0 for a closed loop.
+            read_ratio (float): Fraction of requests that are reads.
+            keys (int): Number of distinct keys.
+            distribution (str): ``uniform`` or ``zipf``.
+            zipf_s (float): Zipf exponent.
+            burst (dict, optional): Burst pattern, see :func:`rate_at`; needs a rate.
+            timeout (float): Seconds per request.
+            seed (int): Seed of all random choices.
+
+        Raises:
+            ValueError: If a burst pattern is given without a rate.
+        """
+        if burst and rate <= 0:
+            raise ValueError("a burst pattern needs a target rate")
+        self.api_urls = list(api_urls)
+        self.duration = duration_sec
+        self.concurrency = concurrency
+        self.rate = rate
+        self.read_ratio = read_ratio
+        self.sampler = KeySampler(keys, distribution, zipf_s)
+        self.burst = burst
+        self.timeout = timeout
+        self.seed = seed
+        self.accepted = Counter()
+        self.uncertain = 0
+        self._samples = defaultdict(list)  # op -> latencies in seconds
+        self._status = Counter()  # (op, status code or "error") -> requests
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Run the workload to completion.
+
+        Returns:
+            dict: Throughput, latency percentiles and status counts, see :meth:`report`.
+        """
+        schedule = queue.Queue() if self.rate > 0 else None
+        start = time.monotonic()
+        stop_at = start + self.duration
+        threads = [threading.Thread(target=self._client, args=(i, schedule, stop_at), daemon=True)
+                   for i in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        if schedule is not None:
+            self._schedule(schedule, start, stop_at)
+        for t in threads:
+            t.join()
+        return self.report(time.monotonic() - start)
+
+    def report(self, elapsed):
+        """
+        Args:
+            elapsed (float): Seconds the run took.
+
+        Returns:
+            dict: Requests, throughput, latency percentiles in ms (overall and per op),
+            status codes and the share of 429 responses.
+        """
+        ops = {}
+        total = sum(self._status.values())
+        for op in ("read", "write"):
+            samples = sorted(self._samples[op])
+            count = sum(n for (o, _), n in self._status.items() if o == op)
+            ops[op] = {"requests": count, "throughput_rps": count / elapsed, **_latency(samples)}
+        status = Counter()
+        for (_, code), n in self._status.items():
+            status[str(code)] += n
+        return {
+            "elapsed_sec": elapsed,
+            "requests": total,
+            "throughput_rps": total / elapsed,
+            "ok_rps": sum(n for (_, code), n in self._status.items() if code in (200, 202)) / elapsed,
+            "latency_ms": _latency(sorted(itertools.chain(*self._samples.values()))),
+            "ops": ops,
+            "status": dict(status),
+            "rate_429": status["429"] / total if total else 0.0,
+        }
+
+    def _schedule(self, schedule, start, stop_at):
+        """
+        Put Poisson arrival times on the schedule until the end of the run, then one stop marker per client.
+        """
+        rng = random.Random(self.seed)
+        at = start
+        while True:
+            at += rng.expovariate(rate_at(at - start, self.rate, self.burst))
+            if at >= stop_at:
+                break
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            schedule.put(at)
+        for _ in range(self.concurrency):
+            schedule.put(None)
+
+    def _client(self, index, schedule, stop_at):
+        """
+        One client thread with its own keep-alive session and random generator.
+        """
+        rng = random.Random(self.seed + index + 1)
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=len(self.api_urls), pool_maxsize=1))
+        urls = itertools.cycle(self.api_urls[index % len(self.api_urls):] + self.api_urls[:index % len(self.api_urls)])
+        samples, status, accepted, uncertain = defaultdict(list), Counter(), Counter(), 0
+        while True:
+            if schedule is None:
+                if time.monotonic() >= stop_at:
+                    break
+                intended = time.monotonic()
+            else:
+                intended = schedule.get()
+                if intended is None:
+                    break
+            key = self.sampler.sample(rng)
+            op = "read" if rng.random() < self.read_ratio else "write"
+            try:
+                if op == "read":
+                    code = session.get(f"{next(urls)}/counter/{key}", timeout=self.timeout).status_code
+                else:
+                    code = session.post(f"{next(urls)}/counter/{key}/increment", timeout=self.timeout).status_code
+            except requests.RequestException:
+                code = "error"
+            samples[op].append(time.monotonic() - intended)
+            status[(op, code)] += 1
+            if op == "write":
+                if code == 202:
+                    accepted[key] += 1
+                elif code == "error" or code >= 500:
+                    uncertain += 1
+        session.close()
+        with self._lock:
+            for op, values in samples.items():
+                self._samples[op].extend(values)
+            self._status.update(status)
+            self.accepted.update(accepted)
+            self.uncertain += uncertain
+
+
+def _latency(samples):
+    """
+    Args:
+        samples (list): Sorted latencies in seconds.
+
+    Returns:
+        dict: p50, p99, p99.9 and max in milliseconds.
+    """
+    return {
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "p999_ms": percentile(samples, 99.9) * 1000,
+        "max_ms": samples[-1] * 1000 if samples else 0.0,
+    }
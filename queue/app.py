@@ -1,13 +1,26 @@
+import functools
+import itertools
+import json
 import logging
 import os
+import re
 import requests
 import threading
 import time
 from collections import defaultdict, deque
 
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort
+from requests.adapters import HTTPAdapter
 
-from shard import ConsistentHash
+from breaker import CircuitBreaker
+from diskqueue import DiskQueue
+from hotkeys import HotKeys
+from metrics import CONTENT_TYPE, Registry, instrument_flask, sampled
+from ratelimit import make_limiter
+from rebalance import Migration, save_state
+from stream import StoreError, StoreStream, StreamUnavailable
+from topology import Topology
+from tracing import HEADER, Tracer, trace_flask
 
 app = Flask(__name__)
 
@@ -18,26 +31,441 @@ logging.basicConfig(
 )
 
 MAX_KEY_RATE = int(os.getenv("MAX_KEY_RATE", "50"))  # per-10-seconds key limit
+RATE_LIMITER = os.getenv("RATE_LIMITER", "sliding")  # sliding | token
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "1000000"))  # keys tracked before LRU eviction
 STALE_THRESHOLD_SEC = int(os.getenv("STALE_THRESHOLD_SEC", "5"))  # age in seconds before sidelining
 SPILLOVER_QUEUE_SIZE= int(os.getenv("SPILLOVER_QUEUE_SIZE", "100"))
 
-MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "100"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "100"))  # per shard lane
 logging.log(logging.INFO, f"MAX_QUEUE_SIZE: {MAX_QUEUE_SIZE}")
-WORKER_COUNT  = int(os.getenv("WORKER_COUNT",     "1"))
+WORKER_COUNT  = int(os.getenv("WORKER_COUNT",     "1"))  # workers (and concurrent store calls) per shard lane
 logging.log(logging.INFO, f"WORKER_COUNT: {WORKER_COUNT}")
 QUEUE_PORT    = int(os.getenv("QUEUE_PORT",      "7000"))
 STORE_NODES   = os.getenv("STORE_NODES",         "").split(",")
+STORE_SECONDARIES = [n for n in os.getenv("STORE_SECONDARIES", "").split(",") if n]
 MAX_STALE_RETRIES = int(os.getenv("MAX_STALE_RETRIES", "3"))
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "500"))  # jobs drained per worker iteration
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "5"))  # extra wait for more jobs after the first
+EXCESS_RELEASE_INTERVAL_MS = int(os.getenv("EXCESS_RELEASE_INTERVAL_MS", "50"))  # pacing of excess promotion
+STALE_RETRY_DELAY_MS = int(os.getenv("STALE_RETRY_DELAY_MS", "200"))  # backoff before and between stale retries
+QUEUE_MODE = os.getenv("QUEUE_MODE", "memory")  # memory | disk
+QUEUE_DIR = os.getenv("QUEUE_DIR", "queue-data")
+DISK_QUEUE_SIZE = int(os.getenv("DISK_QUEUE_SIZE", "1000000"))  # capacity of each disk-backed queue
+DISK_QUEUE_HOT_SIZE = int(os.getenv("DISK_QUEUE_HOT_SIZE", "1000"))  # jobs kept in memory per disk-backed queue
+STORE_TIMEOUT_SEC = float(os.getenv("STORE_TIMEOUT_SEC", "2"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # consecutive store errors that open a lane's breaker
+BREAKER_RESET_SEC = float(os.getenv("BREAKER_RESET_SEC", "5"))  # how long an open breaker sheds traffic
+RING_MEMO_SIZE = int(os.getenv("RING_MEMO_SIZE", "100000"))  # memoized key-to-shard lookups, 0 disables
+REBALANCE_BATCH = int(os.getenv("REBALANCE_BATCH", "1000"))  # keys moved per drain/increment round trip
+REBALANCE_GRACE_SEC = float(os.getenv("REBALANCE_GRACE_SEC", str(2 * STORE_TIMEOUT_SEC)))  # let in-flight batches land first
+REBALANCE_TIMEOUT_SEC = float(os.getenv("REBALANCE_TIMEOUT_SEC", "30"))
+HOT_KEYS = [k for k in os.getenv("HOT_KEYS", "").split(",") if k]  # keys split into sub-counters from the start
+HOT_KEY_SHARDS = int(os.getenv("HOT_KEY_SHARDS", "8"))  # sub-counters per hot key
+HOT_KEY_AUTO = os.getenv("HOT_KEY_AUTO", "0") == "1"  # split a key once it hits the per-key rate limit
+HOT_KEYS_PATH = os.getenv("HOT_KEYS_PATH", os.path.join(QUEUE_DIR, "hotkeys.json"))
+TOPOLOGY_PATH = os.getenv("TOPOLOGY_PATH", os.path.join(QUEUE_DIR, "topology.json"))  # the topology, kept across restarts
+MIGRATION_PATH = os.getenv("MIGRATION_PATH", os.path.join(QUEUE_DIR, "migration.json"))  # journal of the running migration
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # fraction of per-job log lines written, 1 logs all
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # fraction of requests traced, 0 traces only requests with a sampled traceparent
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))  # finished spans kept for GET /debug/traces
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # JSON lines file finished spans are appended to, empty disables
+STORE_TRANSPORT = os.getenv("STORE_TRANSPORT", "stream")  # stream | http, how workers send increments to the store
+STREAM_MAX_INFLIGHT = int(os.getenv("STREAM_MAX_INFLIGHT", "64"))  # unanswered store calls per lane with STORE_TRANSPORT=stream
+LOAD_WINDOW_SEC = float(os.getenv("LOAD_WINDOW_SEC", "2"))  # window of the drain rate published on GET /load
+DELAY_HEADER = "X-Queue-Delay-Ms"  # queueing delay of the job's lane, sent with every accepted job
+CALL_ID_PREFIX = os.urandom(6).hex()  # keeps store call ids unique across queue restarts
+CALL_IDS = itertools.count(1)  # numbers the store calls of this process
 
-ring = ConsistentHash(STORE_NODES)
+TOPOLOGY = Topology(0, STORE_NODES, STORE_SECONDARIES, memo_size=RING_MEMO_SIZE)  # replaced as a whole on changes
+if os.path.exists(TOPOLOGY_PATH):  # the last topology set with POST /topology wins over STORE_NODES
+    with open(TOPOLOGY_PATH) as f:
+        TOPOLOGY = Topology.from_dict(json.load(f), memo_size=RING_MEMO_SIZE)
+TOPOLOGY_LOCK = threading.Lock()  # serializes topology changes
+MIGRATION = None  # the latest Migration, for GET /topology
 
-QUEUE = deque(maxlen=MAX_QUEUE_SIZE)
 LOCK  = threading.Lock()
+STALE_READY = threading.Condition(LOCK)  # STALE_QUEUE gained jobs
 
-EXCESS_QUEUE = deque(maxlen=SPILLOVER_QUEUE_SIZE)
 STALE_QUEUE = deque(maxlen=SPILLOVER_QUEUE_SIZE)
 
-KEY_TIMESTAMPS = defaultdict(list)  # For per-key rate limiting
+RATE_LIMIT = make_limiter(RATE_LIMITER, MAX_KEY_RATE, 10, RATE_LIMIT_MAX_KEYS)  # For per-key rate limiting
+HOTKEYS = HotKeys(HOT_KEY_SHARDS, HOT_KEYS_PATH, HOT_KEYS)  # keys whose increments go to sub-counters
+
+METRICS = Registry()  # exposed on GET /metrics
+REQUEST_LATENCY = METRICS.histogram("queue_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+JOB_AGE = METRICS.histogram("queue_job_age_seconds", "Age of jobs when a worker picks them up", ("node",))
+JOBS_PROCESSED = METRICS.counter("queue_jobs_processed_total", "Jobs applied by a store node", ("node",))
+STORE_CALL_LATENCY = METRICS.histogram("queue_store_call_duration_seconds", "Latency of bulk increment calls", ("node",))
+RATE_LIMITED = METRICS.counter("queue_rate_limited_total", "Jobs sidelined to an excess queue by the per-key rate limit", ("node",))
+SIDELINED = METRICS.counter("queue_sidelined_total", "Jobs moved to the stale queue", ("reason",))
+STALE_DROPPED = METRICS.counter("queue_stale_dropped_total", "Jobs dropped from the stale path", ("reason",))
+instrument_flask(app, REQUEST_LATENCY)
+TRACER = Tracer("queue", TRACE_SAMPLE_RATE, TRACE_BUFFER_SIZE, TRACE_FILE or None)
+trace_flask(app, TRACER)
+
+
+class ShardLane:
+    """
+    The queueing lane of one store node.
+
+    Every lane has its own main and excess queue, worker pool, keep-alive session
+    and circuit breaker, so a slow or failing shard only backs up and sheds its own
+    traffic while writes to healthy shards keep flowing.
+
+    Attributes:
+        node (str): Store node served by this lane.
+        queue (deque or DiskQueue): Jobs waiting for a worker.
+        excess (deque or DiskQueue): Rate-limited jobs waiting for promotion.
+        breaker (CircuitBreaker): Trips after repeated store errors.
+        session (requests.Session): Pooled keep-alive connections to the node.
+        stream (StoreStream or None): Pipelined ingest connection to the node, None to use HTTP.
+        drained (int): Jobs taken from the main queue by workers.
+        held (deque): ``(retry_at, batch, failed jobs)`` of disk-backed batches whose
+            store calls failed, kept unacknowledged until the failed jobs are applied.
+    """
+
+    def __init__(self, node):
+        """
+        Args:
+            node (str): Store node served by this lane.
+        """
+        self.node = node
+        if QUEUE_MODE == "disk":
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", node).strip("_") or "default"
+            self.queue = DiskQueue(QUEUE_DIR, f"queue-{slug}", DISK_QUEUE_SIZE, DISK_QUEUE_HOT_SIZE)
+            self.excess = DiskQueue(QUEUE_DIR, f"excess-{slug}", DISK_QUEUE_SIZE, DISK_QUEUE_HOT_SIZE)
+        else:
+            self.queue = deque(maxlen=MAX_QUEUE_SIZE)
+            self.excess = deque(maxlen=SPILLOVER_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.work_ready = threading.Condition(self.lock)   # queue gained jobs
+        self.space_ready = threading.Condition(self.lock)  # queue freed capacity or excess gained jobs
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_SEC)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKER_COUNT))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKER_COUNT))
+        self.job_age = JOB_AGE.labels(node)
+        self.store_latency = STORE_CALL_LATENCY.labels(node)
+        self.stream = StoreStream(node, STREAM_MAX_INFLIGHT, STORE_TIMEOUT_SEC, self.session) if STORE_TRANSPORT == "stream" else None
+        self.drained = 0
+        self.held = deque()
+        # monotonic time each job in the main queue got there, parallel to the queue;
+        # jobs recovered from disk count as queued since startup
+        self._queued_at = deque([time.monotonic()] * len(self.queue))
+        self._drain_samples = deque([(time.monotonic(), 0)])  # (monotonic time, drained), see _drain_rate
+
+    def put(self, job):
+        """
+        Add a job to the lane's main queue.
+
+        Args:
+            job (dict): The job.
+
+        Returns:
+            bool: False if the queue is full.
+        """
+        with self.lock:
+            if len(self.queue) >= self.queue.maxlen:
+                return False
+            self.queue.append(job)
+            self._queued_at.append(time.monotonic())
+            self.work_ready.notify()
+        return True
+
+    def put_excess(self, job):
+        """
+        Add a rate-limited job to the lane's excess queue.
+
+        Args:
+            job (dict): The job.
+
+        Returns:
+            bool: False if the excess queue is full.
+        """
+        with self.lock:
+            if len(self.excess) >= self.excess.maxlen:
+                return False
+            self.excess.append(job)
+            self.space_ready.notify()
+        return True
+
+    def status(self):
+        """
+        Returns:
+            dict: Queue depths, breaker state and ingest stream statistics of the lane.
+        """
+        stream = self.stream
+        with self.lock:
+            return {
+                "queued": len(self.queue),
+                "excess": len(self.excess),
+                "held": sum(len(failed) for _, _, failed in self.held),
+                "breaker": self.breaker.state,
+                "breaker_opened": self.breaker.opened,
+                "stream": stream.stats() if stream is not None else None,
+            }
+
+    def delay(self):
+        """
+        Returns:
+            float: Seconds the oldest job of the main queue has been waiting, 0 if it is empty.
+        """
+        with self.lock:
+            return time.monotonic() - self._queued_at[0] if self._queued_at else 0.0
+
+    def load(self):
+        """
+        Report the load signals admission control in the API steers by.
+
+        The queueing delay is the time the job at the head of the main queue has
+        waited so far. It is measured, not predicted, so it reads zero while the
+        workers keep up and grows as soon as they fall behind. Jobs promoted from
+        the excess queue count from their promotion, so deliberately rate-limited
+        keys do not look like a backlog.
+
+        Returns:
+            dict: Main queue depth and capacity, excess depth, queueing delay in
+            milliseconds, drain rate in jobs per second over LOAD_WINDOW_SEC, and
+            the expected wait of a new job at that rate.
+        """
+        with self.lock:
+            now = time.monotonic()
+            rate = self._drain_rate(now)
+            depth = len(self.queue)
+            return {
+                "queued": depth,
+                "capacity": self.queue.maxlen,
+                "excess": len(self.excess),
+                "delay_ms": (now - self._queued_at[0]) * 1000 if self._queued_at else 0.0,
+                "drain_rate": rate,
+                "expected_wait_ms": depth / rate * 1000 if rate > 0 else None,
+            }
+
+    def _drain_rate(self, now):
+        """
+        Jobs drained per second over the last LOAD_WINDOW_SEC. Caller holds the lane lock.
+
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            float: The drain rate.
+        """
+        samples = self._drain_samples
+        if now - samples[-1][0] >= LOAD_WINDOW_SEC / 20:
+            samples.append((now, self.drained))
+        while len(samples) > 1 and now - samples[1][0] >= LOAD_WINDOW_SEC:
+            samples.popleft()
+        start, drained = samples[0]
+        return (self.drained - drained) / (now - start) if now > start else 0.0
+
+    def _pop_jobs(self, batch):
+        """
+        Move jobs from the head of the main queue into ``batch``. Caller holds the lane lock.
+
+        Args:
+            batch (list): The batch to fill up to BATCH_MAX_JOBS.
+        """
+        while self.queue and len(batch) < BATCH_MAX_JOBS:
+            batch.append(self.queue.popleft())
+            if self._queued_at:
+                self._queued_at.popleft()
+
+    def drain_batch(self):
+        """
+        Block until jobs are available, then pop up to BATCH_MAX_JOBS of them.
+
+        Once a first job is available the worker keeps collecting for up to
+        BATCH_WINDOW_MS (or until the batch is full), so bursts on the same key can be
+        coalesced into one store call.
+
+        Returns:
+            list: The drained jobs, empty if held jobs are waiting for a retry instead.
+        """
+        batch = []
+        with self.work_ready:
+            while not self.queue and not self.held:
+                self.work_ready.wait()
+            if self.held:
+                return batch
+            self._pop_jobs(batch)
+
+            if len(batch) < BATCH_MAX_JOBS and BATCH_WINDOW_MS > 0:
+                deadline = time.monotonic() + BATCH_WINDOW_MS / 1000.0
+                while len(batch) < BATCH_MAX_JOBS:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.work_ready.wait(remaining)
+                    self._pop_jobs(batch)
+            self.drained += len(batch)
+            self._drain_rate(time.monotonic())
+            self.space_ready.notify()
+        return batch
+
+    def worker(self):
+        """
+        Background worker thread that processes jobs from the lane's queue.
+
+        - Sleeps until jobs arrive, then drains them in batches (see drain_batch).
+        - Holds the batch while the lane's breaker is open.
+        - Skips jobs that are too old and moves them to the stale queue; jobs of a
+          disk-backed queue are never too old, a backlog on disk is worked off in order.
+        - Sends the rest to the store node, merging all increments of the same key
+          into a single store call; jobs whose store call failed go to the stale queue,
+          or with a disk-backed queue stay held by the lane (see _finish_batch).
+        - Over a stream, drains the next batch while earlier ones are still in flight
+          (see process_batch); the batch is acknowledged once the store answered.
+        """
+        disk = isinstance(self.queue, DiskQueue)
+        while True:
+            batch = self.drain_batch()
+            if not batch:
+                self._retry_held()
+                continue
+            delay = self.breaker.retry_in()
+            if delay > 0:
+                time.sleep(delay)
+
+            fresh = []
+            now = time.time()
+            for job in batch:
+                age = now - job.get("timestamp", now)
+                self.job_age.observe(age)
+                if "trace" in job:
+                    trace_dwell(job, now)
+                if disk or age <= STALE_THRESHOLD_SEC:
+                    fresh.append(job)
+                else:
+                    sideline(job, "age", f"age {age:.2f}s")
+
+            if fresh:
+                process_batch(fresh, functools.partial(self._finish_batch, batch))
+            else:
+                ack(self.queue, batch)
+
+    def _finish_batch(self, batch, failed):
+        """
+        Sideline the jobs of a drained batch whose store call failed and acknowledge the batch.
+
+        The stale queue lives in memory and drops jobs when it is full, so with a
+        disk-backed queue the failed jobs are held by the lane instead and the batch
+        stays unacknowledged on disk until they are applied (see _retry_held).
+
+        Args:
+            batch (list): Every job of the batch.
+            failed (list): The jobs to retry.
+        """
+        if failed and isinstance(self.queue, DiskQueue):
+            with self.lock:
+                self.held.append((time.monotonic() + STALE_RETRY_DELAY_MS / 1000.0, batch, failed))
+                self.work_ready.notify()
+            return
+        for job in failed:
+            sideline(job, "store_error", "store call failed")
+        ack(self.queue, batch)
+
+    def _retry_held(self):
+        """
+        Retry the failed jobs of the oldest held batch once STALE_RETRY_DELAY_MS has
+        passed and the breaker lets calls through.
+
+        Jobs are retried until they are applied; only jobs the store node rejected
+        more than MAX_STALE_RETRIES times are dropped, so a record the node cannot
+        apply does not hold up the lane for good.
+        """
+        with self.lock:
+            if not self.held:
+                return
+            retry_at, batch, failed = self.held.popleft()
+        delay = max(retry_at - time.monotonic(), self.breaker.retry_in())
+        if delay > 0:
+            time.sleep(delay)
+        retried = []
+        for job in failed:
+            job["retries"] = job.get("retries", 0) + 1
+            if job.get("rejections", 0) > MAX_STALE_RETRIES:
+                STALE_DROPPED.labels("rejected").inc()
+                if sampled(LOG_SAMPLE_RATE):
+                    logging.warning(f"Dropping held job key={job['key']} after {job['rejections']} rejections")
+            else:
+                retried.append(job)
+        process_retry(retried, functools.partial(self._finish_batch, batch))
+
+    def store_call(self, deltas, traceparent, call_id, callback):
+        """
+        Apply bulk increments on the lane's node; ``callback(error)`` gets None once
+        they are applied, or the exception.
+
+        With STORE_TRANSPORT=stream the increments are pipelined over the lane's
+        StoreStream and the callback runs when the node acknowledges them. Otherwise,
+        and for nodes without streaming ingest, this makes a ``POST /bulk/increment``
+        and calls back before returning. Either way the node applies a call id only
+        once, so a failed call can be retried with the same id.
+
+        Args:
+            deltas (dict): Mapping of key to the integer amount to add.
+            traceparent (str or None): Trace context for the node.
+            call_id (str): Idempotency key of the call.
+            callback (callable): Called once with None or an exception.
+        """
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.send(deltas, traceparent, callback, call_id)
+                return
+            except StreamUnavailable as e:
+                logging.warning(f"[worker] {e}, sending increments over HTTP")
+                self.stream = None
+        try:
+            post = self.session.post(f"{self.node}/bulk/increment", json={"deltas": deltas, "transfer_id": call_id},
+                                     timeout=STORE_TIMEOUT_SEC, headers={HEADER: traceparent} if traceparent else None)
+            post.raise_for_status()
+        except Exception as e:
+            callback(e)
+            return
+        callback(None)
+
+    def excess_worker(self):
+        """
+        Background thread that retries jobs from the lane's excess queue.
+
+        - Moves jobs from the excess queue to the main queue when there's capacity,
+          at most one every EXCESS_RELEASE_INTERVAL_MS.
+        - Sleeps until a job is sidelined, capacity is freed or the next release is due.
+        - Prevents loss of jobs that were sidelined due to per-key rate limits.
+        """
+        next_release = 0.0
+        with self.space_ready:
+            while True:
+                if not self.excess or len(self.queue) >= self.queue.maxlen:
+                    self.space_ready.wait()
+                    continue
+                remaining = next_release - time.monotonic()
+                if remaining > 0:
+                    self.space_ready.wait(remaining)
+                    continue
+                job = self.excess.popleft()
+                if sampled(LOG_SAMPLE_RATE):
+                    logging.log(logging.INFO, f"[excess worker] retrying {job['key']}")
+                self.queue.append(job)
+                self._queued_at.append(time.monotonic())
+                ack(self.excess, [job])
+                self.work_ready.notify()
+                next_release = time.monotonic() + EXCESS_RELEASE_INTERVAL_MS / 1000.0
+
+    def start(self):
+        """
+        Start the lane's WORKER_COUNT workers and its excess worker.
+        """
+        for _ in range(WORKER_COUNT):
+            threading.Thread(target=self.worker, daemon=True).start()
+        threading.Thread(target=self.excess_worker, daemon=True).start()
+
+
+# lanes for every node that may still have queued jobs, including nodes a persisted topology replaced
+LANES = {node: ShardLane(node) for node in dict.fromkeys(
+    STORE_NODES + TOPOLOGY.nodes + (TOPOLOGY.previous.nodes if TOPOLOGY.previous is not None else []))}
 
 
 @app.route("/enqueue", methods=["POST"])
@@ -46,147 +474,571 @@ def enqueue():
     Handle POST requests to enqueue a job.
 
     A job must contain a 'key' and an 'action'. This endpoint handles:
-    - Rate limiting per key over a 10-second sliding window.
-    - Adding jobs to the main queue or, if over the rate limit, to the excess queue.
-    - Rejecting requests if both the main and excess queues are full.
+    - Routing the job to the lane of its store node (see ShardLane).
+    - Rate limiting per key over a 10-second window (see ratelimit.py).
+    - Sending increments of hot keys to a random sub-counter (see hotkeys.py), each
+      with its own rate limit; with HOT_KEY_AUTO a key that hits the limit becomes hot.
+    - Adding jobs to the lane's main queue or, if over the rate limit, to its excess queue.
+    - Rejecting requests if the lane's queues are full or its store node is failing.
+
+    Accepted jobs are answered with the lane's queueing delay in the
+    X-Queue-Delay-Ms header, the signal admission control in the API steers by.
 
     Returns:
         Response: JSON indicating the result ("enqueued" or "sidelined:rate").
     Raises:
         400: If required fields are missing.
-        429: If the queue or excess queue is full.
+        429: If the lane's queue or excess queue is full.
+        503: If the lane's circuit breaker is open.
     """
     job = request.get_json()
     if not job or "action" not in job or "key" not in job:
         abort(400, description="Must provide JSON with 'action' and 'key'")
+    if "delta" in job and (not isinstance(job["delta"], int) or isinstance(job["delta"], bool)):
+        abort(400, description="'delta' must be an integer")
 
     job["timestamp"] = time.time()
+    span = TRACER.current()
+    if span is not None:
+        job["trace"] = span.traceparent()  # the worker continues the trace, see trace_dwell
 
     key = job["key"]
-    now = time.time()
+    hot = HOTKEYS.shards(key) > 0
+    allowed = hot or RATE_LIMIT.allow(key)
+    if not allowed and HOT_KEY_AUTO and job["action"] == "increment":
+        HOTKEYS.add(key)
+        hot = True
+        logging.warning(f"[enqueue] {key} reached the rate limit, splitting it into {HOTKEYS.shards(key)} sub-counters")
+    if hot:
+        key = job["key"] = HOTKEYS.pick(key)
+        allowed = RATE_LIMIT.allow(key)
 
-    KEY_TIMESTAMPS[key] = [t for t in KEY_TIMESTAMPS[key] if now - t < 10]
-    KEY_TIMESTAMPS[key].append(now)
-    timestamps = KEY_TIMESTAMPS[key]
+    lane = LANES[TOPOLOGY.ring.get_node(key)]
+    if lane.breaker.retry_in() > 0:
+        abort(503, description="Store shard is unavailable")
 
-    if len(timestamps) > MAX_KEY_RATE:
-        with LOCK:
-            if len(EXCESS_QUEUE) >= EXCESS_QUEUE.maxlen:
-                abort(429, description="Excess queue is full")
-            EXCESS_QUEUE.append(job)
-            logging.warning(f"[enqueue] sidelined {key} to EXCESS_QUEUE (rate limit of {MAX_KEY_RATE} requests per key reached)")
-            return jsonify({"status": "sidelined:rate"}), 202
+    if not allowed:
+        if not lane.put_excess(job):
+            abort(429, description="Excess queue is full")
+        RATE_LIMITED.labels(lane.node).inc()
+        if sampled(LOG_SAMPLE_RATE):
+            logging.warning(f"[enqueue] sidelined {key} to excess queue (rate limit of {MAX_KEY_RATE} requests per key reached)")
+        return jsonify({"status": "sidelined:rate"}), 202, {DELAY_HEADER: f"{lane.delay() * 1000:.1f}"}
 
+    if not lane.put(job):
+        abort(429, description="Queue is full")
+
+    return jsonify({"status": "enqueued"}), 202, {DELAY_HEADER: f"{lane.delay() * 1000:.1f}"}
+
+
+@app.route("/hotkeys", methods=["GET"])
+def get_hotkeys():
+    """
+    Report the keys whose increments are split into sub-counters.
+
+    The API polls this endpoint to know which counters to read as sums.
+
+    Returns:
+        JSON: {"keys": {<key>: <number of sub-counters>, ...}} with 200 OK.
+    """
+    return jsonify({"keys": HOTKEYS.to_dict()}), 200
+
+
+@app.route("/hotkeys", methods=["POST"])
+def add_hotkey():
+    """
+    Split a key into sub-counters from now on.
+
+    Request Body:
+        JSON: {"key": <key>, "shards": <int, optional>}
+
+    Returns:
+        JSON: {"key": <key>, "shards": <int>} with 201 Created; a key that is
+        already hot keeps its number of sub-counters.
+    Raises:
+        400: If 'key' is missing or 'shards' is not a positive integer.
+    """
+    body = request.get_json(silent=True) or {}
+    key, shards = body.get("key"), body.get("shards")
+    if not isinstance(key, str) or not key:
+        abort(400, description="Request JSON must include a 'key'")
+    if shards is not None and (not isinstance(shards, int) or isinstance(shards, bool) or shards < 1):
+        abort(400, description="'shards' must be a positive integer")
+    return jsonify({"key": key, "shards": HOTKEYS.add(key, shards)}), 201
+
+
+@app.route("/lanes", methods=["GET"])
+def lanes():
+    """
+    Report the state of every shard lane.
+
+    Returns:
+        JSON: {<node>: {"queued", "excess", "held", "breaker", "breaker_opened", "stream"}} plus the stale
+        queue depth, 200 OK.
+    """
     with LOCK:
-        if len(QUEUE) >= QUEUE.maxlen:
-            abort(429, description="Queue is full")
-        QUEUE.append(job)
+        stale = len(STALE_QUEUE)
+    return jsonify({"lanes": {node: lane.status() for node, lane in LANES.items()}, "stale": stale}), 200
 
-    return jsonify({"status": "enqueued"}), 202
 
+@app.route("/load", methods=["GET"])
+def load():
+    """
+    Report the load signals of every shard lane, see ShardLane.load.
 
-def worker():
+    Returns:
+        JSON: {"lanes": {<node>: {"queued", "capacity", "excess", "delay_ms", "drain_rate",
+        "expected_wait_ms"}}, "stale": <depth>, "delay_ms": <largest lane delay>} with 200 OK.
     """
-    Background worker thread that processes jobs from the main queue.
+    loads = {node: lane.load() for node, lane in LANES.items()}
+    with LOCK:
+        stale = len(STALE_QUEUE)
+    delay = max((lane["delay_ms"] for lane in loads.values()), default=0.0)
+    return jsonify({"lanes": loads, "stale": stale, "delay_ms": delay}), 200
+
 
-    - Skips jobs that are too old and moves them to the stale queue.
-    - For valid jobs, routes them to the appropriate storage node using consistent hashing.
+@app.route("/debug/traces", methods=["GET"])
+def debug_traces():
     """
-    while True:
-        job = None
-        with LOCK:
-            if QUEUE:
-                job = QUEUE.popleft()
+    Return the newest finished spans of the queue.
+
+    Query Parameters:
+        trace_id (str, optional): Only spans of this trace.
+        limit (int, optional): Maximum number of spans, default 1000.
+
+    Returns:
+        JSON: {"spans": [...]} oldest first, with 200 OK.
+    """
+    limit = request.args.get("limit", 1000, type=int)
+    return jsonify({"spans": TRACER.recent(request.args.get("trace_id"), limit)}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Expose request latency, queue depths, job ages, sidelines and drops for Prometheus.
+
+    Returns:
+        Response: The metrics in the Prometheus text format, 200 OK.
+    """
+    return Response(METRICS.expose(), mimetype=CONTENT_TYPE)
+
+
+def queue_depths():
+    """
+    Returns:
+        dict: {(queue, node): jobs waiting} for the main and excess queue of every lane.
+    """
+    depths = {}
+    for node, lane in LANES.items():
+        depths[("main", node)] = len(lane.queue)
+        depths[("excess", node)] = len(lane.excess)
+    return depths
+
+
+METRICS.gauge("queue_depth", "Jobs waiting in a lane's main or excess queue", queue_depths, ("queue", "node"))
+METRICS.gauge("queue_delay_seconds", "How long the oldest job of a lane's main queue has waited",
+              lambda: {(node,): lane.delay() for node, lane in LANES.items()}, ("node",))
+METRICS.gauge("queue_stale_depth", "Jobs waiting in the stale queue", lambda: len(STALE_QUEUE))
+METRICS.gauge("queue_breaker_open", "1 while a lane's circuit breaker sheds traffic",
+              lambda: {(node,): int(lane.breaker.retry_in() > 0) for node, lane in LANES.items()}, ("node",))
+
+
+@app.route("/topology", methods=["GET"])
+def get_topology():
+    """
+    Report the current shard topology and the progress of the latest migration.
 
-        if not job:
-            time.sleep(0.05)
+    The API polls this endpoint to follow topology changes.
+
+    Returns:
+        JSON: {"topology": {...}, "migration": {...} or null} with 200 OK.
+    """
+    return jsonify({"topology": TOPOLOGY.to_dict(), "migration": MIGRATION.status() if MIGRATION else None}), 200
+
+
+@app.route("/topology", methods=["POST"])
+def change_topology():
+    """
+    Switch to a new shard topology and move the affected keys in the background.
+
+    New writes are routed with the new ring right away (lanes for added nodes are
+    started first). After REBALANCE_GRACE_SEC, so batches already sent to old
+    owners have landed, the keys whose owner changed are streamed from their old
+    owners to their new ones (see rebalance.py). Until that finishes the topology
+    reports ``migrating`` and readers combine a moving key's value from both nodes.
+    The topology is saved to TOPOLOGY_PATH and the migration journaled to
+    MIGRATION_PATH, so a restarted queue keeps the topology and resumes the migration.
+
+    Request Body:
+        JSON: {"version": <int>, "nodes": [<url>, ...], "secondaries": [<url>, ...]}
+
+    Returns:
+        JSON: The new topology with 202 Accepted.
+    Raises:
+        400: If the topology is malformed.
+        409: If the version does not increase or a migration is still running.
+    """
+    global TOPOLOGY, MIGRATION, LANES
+    with TOPOLOGY_LOCK:
+        current = TOPOLOGY
+        if current.previous is not None:
+            abort(409, description="A migration is still running")
+        try:
+            new = Topology.from_dict(request.get_json(silent=True), previous=current, memo_size=RING_MEMO_SIZE)
+        except ValueError as e:
+            abort(400, description=str(e))
+        if new.version <= current.version:
+            abort(409, description=f"Topology version must be greater than {current.version}")
+        save_state(TOPOLOGY_PATH, new.to_dict())
+
+        added = {node: ShardLane(node) for node in new.nodes if node not in LANES}
+        for lane in added.values():
+            lane.start()
+        LANES = {**LANES, **added}
+        TOPOLOGY = new
+        MIGRATION = Migration(current, new, REBALANCE_BATCH, REBALANCE_TIMEOUT_SEC, path=MIGRATION_PATH)
+        threading.Thread(target=migrate, args=(MIGRATION,), daemon=True).start()
+    logging.info(f"[topology] v{current.version} -> v{new.version}: {new.nodes}")
+    return jsonify(new.to_dict()), 202
+
+
+def migrate(migration):
+    """
+    Background thread that runs a migration and then marks the topology settled.
+
+    Args:
+        migration (Migration): The migration to run.
+    """
+    global TOPOLOGY
+    time.sleep(REBALANCE_GRACE_SEC)
+    migration.run()
+    with TOPOLOGY_LOCK:
+        if TOPOLOGY is migration.current:
+            settled = migration.current.settled()
+            save_state(TOPOLOGY_PATH, settled.to_dict())
+            TOPOLOGY = settled
+
+
+def ack(queue, jobs):
+    """
+    Confirm that jobs popped from ``queue`` were handled, so a disk-backed queue
+    does not redeliver them after a restart. No-op for in-memory queues.
+
+    Args:
+        queue (deque or DiskQueue): The queue the jobs were popped from.
+        jobs (list): The handled jobs.
+    """
+    if isinstance(queue, DiskQueue):
+        queue.ack(jobs)
+
+
+def sideline(job, reason, detail):
+    """
+    Move a job to the stale queue for a delayed retry, or drop it if that is full.
+
+    Args:
+        job (dict): The job.
+        reason (str): Why the job is sidelined, the metrics label.
+        detail (str): Why the job is sidelined, for the log.
+    """
+    with LOCK:
+        if len(STALE_QUEUE) >= STALE_QUEUE.maxlen:
+            STALE_DROPPED.labels("full").inc()
+            if sampled(LOG_SAMPLE_RATE):
+                logging.warning(f"[worker] dropped key={job['key']}, STALE_QUEUE is full ({detail})")
+            return
+        job["retry_at"] = time.monotonic() + STALE_RETRY_DELAY_MS / 1000.0
+        STALE_QUEUE.append(job)
+        STALE_READY.notify()
+    SIDELINED.labels(reason).inc()
+    if sampled(LOG_SAMPLE_RATE):
+        logging.warning(f"[worker] sidelined key={job['key']} to STALE_QUEUE ({detail})")
+
+
+def trace_dwell(job, picked_at):
+    """
+    Record how long a traced job waited in the queues before a worker picked it up.
+
+    Args:
+        job (dict): A job carrying the trace context of its enqueue request.
+        picked_at (float): When the worker took the job.
+    """
+    span = TRACER.continue_from(job["trace"], "queue.dwell", job["timestamp"],
+                                retries=job.get("retries", 0), sidelined="retry_at" in job)
+    span.finish(end=picked_at)
+
+
+def coalesce(jobs):
+    """
+    Group increment jobs by target node, summing the deltas of each key.
+
+    Args:
+        jobs (list): Jobs with 'key', 'action' and an optional integer 'delta'.
+
+    Returns:
+        dict: {node: ({key: delta}, [jobs])} for all supported jobs.
+    """
+    supported = []
+    for job in jobs:
+        action = job["action"]
+        if action != "increment":
+            logging.error(f"[worker] unknown action: {action}")
             continue
+        supported.append(job)
 
-        age = time.time() - job.get("timestamp", time.time())
-        if age > STALE_THRESHOLD_SEC:
-            with LOCK:
-                if len(STALE_QUEUE) >= STALE_QUEUE.maxlen:
-                    abort(429, description="Stale queue is full")
-                STALE_QUEUE.append(job)
-                logging.warning(f"[worker] sidelined key={job['key']} to STALE_QUEUE (age {age:.2f}s)")
-                continue
-        else:
-            process_job(job)
+    grouped = {}
+    for job, node in zip(supported, TOPOLOGY.ring.get_nodes([job["key"] for job in supported])):
+        key = job["key"]
+        if node not in grouped:
+            grouped[node] = (defaultdict(int), [])
+        deltas, node_jobs = grouped[node]
+        deltas[key] += job.get("delta", 1)
+        node_jobs.append(job)
+    return grouped
+
+
+class BatchOutcome:
+    """
+    Collects the failed jobs of a batch's store calls, which may complete on other threads.
+    """
+
+    def __init__(self, calls, done=None):
+        """
+        Args:
+            calls (int): Store calls the batch makes.
+            done (callable, optional): Called with the failed jobs after the last
+                call completed; without it, :meth:`wait` returns them.
+        """
+        self._remaining = calls
+        self._failed = []
+        self._done = done
+        self._lock = threading.Lock()
+        self._complete = threading.Event()
+        if calls == 0:
+            self._finish()
 
+    def add(self, failed):
+        """
+        Record the completion of one store call.
 
-def process_job(job):
+        Args:
+            failed (list): Its jobs if it failed, else an empty list.
+        """
+        with self._lock:
+            self._failed.extend(failed)
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            self._finish()
+
+    def wait(self):
+        """
+        Returns:
+            list: The failed jobs, once every store call completed.
+        """
+        self._complete.wait()
+        return self._failed
+
+    def _finish(self):
+        if self._done is not None:
+            self._done(self._failed)
+        self._complete.set()
+
+
+def process_batch(jobs, done=None):
     """
-    Process a single job by incrementing its value in the appropriate store node.
+    Apply a batch of jobs with one bulk increment call per store node.
+
+    Each call goes through the node's lane (see ShardLane.store_call) and circuit
+    breaker and is bounded by STORE_TIMEOUT_SEC. Over streams the calls are
+    pipelined: with ``done`` this returns once they are sent, so the caller can
+    go on while the store commits them.
 
     Args:
-        job (dict): The job to process. Must include 'key' and 'action'.
+        jobs (list): The jobs to process. Each must include 'key' and 'action'.
+        done (callable, optional): Called with the failed jobs once every store
+            node answered; without it, the call waits for the answers.
+
+    Returns:
+        list or None: Without ``done``, the jobs whose store call failed or was
+        refused by an open breaker.
+    """
+    return send_calls([(node, deltas, node_jobs, None) for node, (deltas, node_jobs) in coalesce(jobs).items()], done)
+
 
-    Logs errors if the storage request fails or the action is unsupported.
+def send_calls(calls, done=None):
     """
-    action = job["action"]
-    key = job["key"]
-    if action != "increment":
-        logging.exception(msg=f"[worker] unknown action: {action}")
-        return
+    Make store calls through their lanes, like :func:`process_batch`.
 
-    node = ring.get_node(key)
-    logging.log(logging.INFO, f"[worker] routing key={key} → node={node}")
-    store_url = f"{node}/store/{key}/increment"
+    A new call gets an id. When it fails its jobs keep the call (id and node)
+    in ``job["store_call"]``, so the stale worker repeats that call and the store
+    node, which remembers call ids, does not apply it twice if the first attempt
+    went through after all.
 
-    try:
-        post = requests.post(store_url)
-        post.raise_for_status()
-    except Exception as e:
-        logging.exception(f"[worker] increment error ({key}@{node}): {e}")
+    Args:
+        calls (list): ``(node, deltas, jobs, call)`` tuples; ``call`` is the
+            ``store_call`` dict of a retried call, None for a new one.
+        done (callable, optional): Called with the failed jobs once every store
+            node answered; without it, the call waits for the answers.
 
-def excess_worker():
+    Returns:
+        list or None: Without ``done``, the jobs whose store call failed or was
+        refused by an open breaker.
     """
-    Background thread that retries jobs from the excess queue.
+    outcome = BatchOutcome(len(calls), done)
+    for node, deltas, node_jobs, call in calls:
+        lane = LANES[node]
+        if not lane.breaker.allow():
+            outcome.add(node_jobs)
+            continue
+        if call is None:
+            call = {"id": f"{CALL_ID_PREFIX}-{next(CALL_IDS)}", "node": node}
+        if sampled(LOG_SAMPLE_RATE):
+            logging.log(logging.INFO, f"[worker] routing {len(deltas)} keys → node={node}")
+        spans = [TRACER.continue_from(job["trace"], "queue.store_call", node=node, keys=len(deltas), jobs=len(node_jobs))
+                 for job in node_jobs if "trace" in job]
+        lane.store_call(deltas, spans[0].traceparent() if spans else None, call["id"],
+                        store_callback(lane, call, node_jobs, spans, outcome))
+    return outcome.wait() if done is None else None
+
 
-    - Moves jobs from the excess queue to the main queue when there's capacity.
-    - Prevents loss of jobs that were sidelined due to per-key rate limits.
+def store_callback(lane, call, jobs, spans, outcome):
     """
-    while True:
-        with LOCK:
-            if len(QUEUE) < MAX_QUEUE_SIZE and EXCESS_QUEUE:
-                job = EXCESS_QUEUE.popleft()
-                logging.log(logging.INFO, f"[excess worker] retrying {job['key']}")
-                QUEUE.append(job)
-        time.sleep(0.05)
+    Build the callback of one store call, which feeds the result to the lane's
+    breaker, the metrics, the traced jobs' spans and the batch's outcome.
+
+    Args:
+        lane (ShardLane): The lane of the store node.
+        call (dict): The call's id and node, kept by its jobs if it fails.
+        jobs (list): The jobs the call applies.
+        spans (list): Spans of the traced jobs.
+        outcome (BatchOutcome): The batch the call belongs to.
+
+    Returns:
+        callable: ``callback(error)``, error None on success.
+    """
+    started = time.monotonic()
+
+    def callback(error):
+        lane.store_latency.observe(time.monotonic() - started)
+        if error is not None:
+            lane.breaker.record_failure()
+            logging.error(f"[worker] bulk increment error ({len(jobs)} jobs@{lane.node}): {error}")
+            for span in spans:
+                span.finish(error=str(error))
+            rejection = int(isinstance(error, (StoreError, requests.HTTPError)))  # the node answered, see _retry_held
+            for job in jobs:
+                job["store_call"] = call
+                job["rejections"] = job.get("rejections", 0) + rejection
+            outcome.add(jobs)
+            return
+        lane.breaker.record_success()
+        for span in spans:
+            span.finish()
+        JOBS_PROCESSED.labels(lane.node).inc(len(jobs))
+        outcome.add([])
+
+    return callback
+
+
+def process_retry(jobs, done=None):
+    """
+    Retry jobs from the stale queue or held by a lane.
+
+    Jobs of a failed store call repeat that call with the same id (see
+    send_calls); any other job is processed anew. The deltas of a repeated call
+    are summed up again from the jobs given, so jobs of the call that were
+    dropped in the meantime (a full stale queue) are not applied by the retry.
+
+    Args:
+        jobs (list): The jobs, all jobs of a failed ``store_call`` together.
+        done (callable, optional): Called with the jobs that failed again once
+            every store node answered; without it, the call waits for the answers.
+
+    Returns:
+        list or None: Without ``done``, the jobs that failed again.
+    """
+    calls, fresh = {}, []
+    for job in jobs:
+        call = job.get("store_call")
+        if call is None:
+            fresh.append(job)
+        else:
+            calls.setdefault(id(call), (call, []))[1].append(job)
+    retried = []
+    for call, call_jobs in calls.values():
+        deltas = defaultdict(int)
+        for job in call_jobs:
+            deltas[job["key"]] += job.get("delta", 1)
+        retried.append((call["node"], deltas, call_jobs, call))
+    retried += [(node, deltas, node_jobs, None) for node, (deltas, node_jobs) in coalesce(fresh).items()]
+    return send_calls(retried, done)
 
 
 def stale_worker():
     """
     Background thread that retries stale jobs.
 
-    - Retries jobs in the stale queue up to MAX_STALE_RETRIES.
+    - Retries jobs in the stale queue up to MAX_STALE_RETRIES; the jobs of one
+      failed store call are taken out together and retried as that call.
     - Drops jobs that exceed the retry limit.
-    - Adds delay (backoff) to reduce system pressure.
+    - Schedules each retry STALE_RETRY_DELAY_MS after the job was sidelined and
+      after the previous retry (backoff), sleeping until that deadline.
     """
+    next_retry = 0.0
     while True:
-        job = None
-        with LOCK:
-            if STALE_QUEUE:
-                job = STALE_QUEUE.popleft()
-
-        if not job:
-            time.sleep(0.1)
-            continue
+        with STALE_READY:
+            while True:
+                if not STALE_QUEUE:
+                    STALE_READY.wait()
+                    continue
+                remaining = max(STALE_QUEUE[0].get("retry_at", 0.0), next_retry) - time.monotonic()
+                if remaining <= 0:
+                    break
+                STALE_READY.wait(remaining)
+            job = STALE_QUEUE.popleft()
+            jobs = [job]
+            call = job.get("store_call")
+            if call is not None:
+                jobs += [other for other in STALE_QUEUE if other.get("store_call") is call]
+                if len(jobs) > 1:
+                    rest = [other for other in STALE_QUEUE if other.get("store_call") is not call]
+                    STALE_QUEUE.clear()
+                    STALE_QUEUE.extend(rest)
 
-        job["retries"] = job.get("retries", 0) + 1
+        now = time.time()
+        for stale in jobs:
+            stale["retries"] = stale.get("retries", 0) + 1
+            if "trace" in stale:
+                trace_dwell(stale, now)
         if job["retries"] > MAX_STALE_RETRIES:
-            logging.warning(f"Dropping stale job key={job['key']} after {job['retries']} retries")
+            STALE_DROPPED.labels("retries").inc(len(jobs))
+            if sampled(LOG_SAMPLE_RATE):
+                logging.warning(f"Dropping stale job key={job['key']} after {job['retries']} retries"
+                                + (f" with {len(jobs) - 1} more of its store call" if len(jobs) > 1 else ""))
             continue
 
-        time.sleep(0.2)
-
-        process_job(job)
+        next_retry = time.monotonic() + STALE_RETRY_DELAY_MS / 1000.0
+        for failed in process_retry(jobs):
+            sideline(failed, "retry_failed", f"retry {failed['retries']} failed")
 
-if __name__ == "__main__":
-    for _ in range(WORKER_COUNT):
-        threading.Thread(target=worker, daemon=True).start()
 
-    threading.Thread(target=excess_worker, daemon=True).start()
+def start_workers():
+    """
+    Start the workers of every shard lane and the stale worker, and resume a
+    migration that was running when the queue stopped.
+    """
+    global MIGRATION
+    for lane in LANES.values():
+        lane.start()
     threading.Thread(target=stale_worker, daemon=True).start()
+    if TOPOLOGY.previous is not None:
+        MIGRATION = Migration(TOPOLOGY.previous, TOPOLOGY, REBALANCE_BATCH, REBALANCE_TIMEOUT_SEC, path=MIGRATION_PATH)
+        threading.Thread(target=migrate, args=(MIGRATION,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    start_workers()
 
     app.run(host="0.0.0.0", port=QUEUE_PORT)
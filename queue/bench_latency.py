@@ -0,0 +1,143 @@
+"""
+Enqueue-to-store latency benchmark for the queue workers.
+
+Compares the event-driven workers in ``app.py`` against the previous
+sleep-polling loop. Jobs are posted to ``/enqueue`` through Flask's test client
+with exponentially distributed gaps, so the queue is idle most of the time, and
+the store call is replaced by a stub that records how long each job waited.
+
+Usage:
+    python bench_latency.py [--jobs 2000] [--gap-ms 10] [--store-ms 1] [--workers 1]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+
+def percentile(values, p):
+    """
+    Args:
+        values (list): Sorted samples.
+        p (float): Percentile between 0 and 100.
+
+    Returns:
+        float: The nearest-rank percentile.
+    """
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))
+    return values[idx]
+
+
+def legacy_worker(app, lane):
+    """
+    The worker loop before it became event-driven: poll, sleep 50 ms when idle.
+
+    Args:
+        app (module): The queue app module.
+        lane (ShardLane): The lane to drain.
+    """
+    while True:
+        batch = []
+        with lane.lock:
+            while lane.queue and len(batch) < app.BATCH_MAX_JOBS:
+                batch.append(lane.queue.popleft())
+        if batch and len(batch) < app.BATCH_MAX_JOBS and app.BATCH_WINDOW_MS > 0:
+            time.sleep(app.BATCH_WINDOW_MS / 1000.0)
+            with lane.lock:
+                while lane.queue and len(batch) < app.BATCH_MAX_JOBS:
+                    batch.append(lane.queue.popleft())
+        if not batch:
+            time.sleep(0.05)
+            continue
+        app.process_batch(batch)
+
+
+def run(mode, jobs, gap_ms, store_ms, workers):
+    """
+    Run one benchmark in this process.
+
+    Args:
+        mode (str): ``event`` for the current workers, ``poll`` for the legacy loop.
+        jobs (int): Number of jobs to enqueue.
+        gap_ms (float): Mean gap between jobs in milliseconds.
+        store_ms (float): Simulated store call duration in milliseconds.
+        workers (int): Number of worker threads.
+
+    Returns:
+        dict: Latency percentiles in milliseconds.
+    """
+    os.environ.setdefault("MAX_KEY_RATE", str(jobs * 10))
+    os.environ.setdefault("MAX_QUEUE_SIZE", str(jobs))
+    os.environ["WORKER_COUNT"] = str(workers)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    latencies = []
+    done = threading.Event()
+
+    def fake_process_batch(batch):
+        time.sleep(store_ms / 1000.0)
+        now = time.time()
+        latencies.extend((now - job["timestamp"]) * 1000 for job in batch)
+        if len(latencies) >= jobs:
+            done.set()
+        return []
+
+    app.process_batch = fake_process_batch
+    if mode == "event":
+        app.start_workers()
+    else:
+        for lane in app.LANES.values():
+            for _ in range(workers):
+                threading.Thread(target=legacy_worker, args=(app, lane), daemon=True).start()
+
+    client = app.app.test_client()
+    rng = random.Random(42)
+    for i in range(jobs):
+        client.post("/enqueue", json={"action": "increment", "key": f"key-{i % 100}"})
+        time.sleep(rng.expovariate(1000.0 / gap_ms))
+    done.wait(60)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "jobs": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["event", "poll"], help="run a single mode and print JSON")
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--gap-ms", type=float, default=10.0)
+    parser.add_argument("--store-ms", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args.jobs, args.gap_ms, args.store_ms, args.workers)))
+        return
+
+    # each mode gets a fresh process so the app module's queues and threads are isolated
+    print(f"{'mode':<6} {'jobs':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for mode in ("poll", "event"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--jobs", str(args.jobs), "--gap-ms", str(args.gap_ms),
+             "--store-ms", str(args.store_ms), "--workers", str(args.workers)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['mode']:<6} {r['jobs']:>6} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Lookup throughput and distribution benchmark for the consistent hash ring.
+
+Compares the array-backed ring in ``shard.py`` (used by both the API and the
+queue) against the previous MD5 ring. Throughput is measured for single
+lookups without and with the memo, and for batch lookups; the distribution
+report shows how evenly keys spread over the nodes and which fraction of keys
+moves when one node is added (ideally 1 / (nodes + 1)). The ring hashes with
+the function selected by ``RING_HASH``.
+
+Usage:
+    RING_HASH=md5|blake2b|crc32 python bench_shard.py [--keys 200000] [--nodes 2,3,5,10] [--replicas 100]
+"""
+import argparse
+import bisect
+import hashlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from shard import RING_HASH, ConsistentHash
+
+
+class LegacyConsistentHash:
+    """
+    The ring before it was array-backed: MD5 hex digests parsed into 128-bit
+    ints, a sorted list re-sorted after every node and a dict from hash to node.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self.replicas = replicas
+        self.ring = {}
+        self._sorted = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}-{i}")
+            self.ring[h] = node
+            self._sorted.append(h)
+        self._sorted.sort()
+
+    def get_node(self, key):
+        if not self.ring:
+            return None
+        h = self._hash(key)
+        idx = bisect.bisect(self._sorted, h)
+        if idx == len(self._sorted):
+            idx = 0
+        return self.ring[self._sorted[idx]]
+
+    @staticmethod
+    def _hash(x):
+        return int(hashlib.md5(x.encode()).hexdigest(), 16)
+
+
+def rate(fn, count):
+    """
+    Args:
+        fn (callable): Performs ``count`` lookups.
+        count (int): Number of lookups.
+
+    Returns:
+        float: Lookups per second.
+    """
+    start = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - start)
+
+
+def throughput(keys, nodes, replicas):
+    """
+    Args:
+        keys (list): Keys to look up.
+        nodes (list): Node identifiers.
+        replicas (int): Virtual nodes per node.
+
+    Returns:
+        list: (label, lookups per second) rows.
+    """
+    legacy = LegacyConsistentHash(nodes, replicas)
+    plain = ConsistentHash(nodes, replicas)
+    memo = ConsistentHash(nodes, replicas, memo_size=len(keys))
+    memo.get_nodes(keys)  # warm the memo
+    return [
+        ("legacy md5 get_node", rate(lambda: [legacy.get_node(k) for k in keys], len(keys))),
+        ("get_node", rate(lambda: [plain.get_node(k) for k in keys], len(keys))),
+        ("get_nodes (batch)", rate(lambda: plain.get_nodes(keys), len(keys))),
+        ("get_node (memo hit)", rate(lambda: [memo.get_node(k) for k in keys], len(keys))),
+        ("get_nodes (memo hit)", rate(lambda: memo.get_nodes(keys), len(keys))),
+    ]
+
+
+def distribution(ring_cls, keys, nodes, replicas):
+    """
+    Args:
+        ring_cls (type): Ring implementation.
+        keys (list): Keys to place.
+        nodes (list): Node identifiers.
+        replicas (int): Virtual nodes per node.
+
+    Returns:
+        dict: Min/max/stddev of node load relative to a perfect split, and the
+        fraction of keys that moved when one more node was added.
+    """
+    ring = ring_cls(nodes, replicas)
+    before = [ring.get_node(k) for k in keys]
+    counts = {node: 0 for node in nodes}
+    for node in before:
+        counts[node] += 1
+    shares = [c * len(nodes) / len(keys) for c in counts.values()]
+
+    ring.add(f"http://store{len(nodes) + 1}:9000")
+    moved = sum(1 for k, old in zip(keys, before) if ring.get_node(k) != old)
+    return {
+        "min": min(shares),
+        "max": max(shares),
+        "stddev": statistics.pstdev(shares),
+        "moved": moved / len(keys),
+        "ideal_moved": 1 / (len(nodes) + 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=200000)
+    parser.add_argument("--nodes", default="2,3,5,10", help="comma-separated node counts for the distribution report")
+    parser.add_argument("--replicas", type=int, default=100)
+    args = parser.parse_args()
+
+    keys = [f"counter:{i}" for i in range(args.keys)]
+    node_counts = [int(n) for n in args.nodes.split(",")]
+
+    nodes = [f"http://store{i}:9000" for i in range(1, node_counts[0] + 1)]
+    print(f"lookups per second ({args.keys} keys, {len(nodes)} nodes, {args.replicas} replicas, RING_HASH={RING_HASH})")
+    for label, per_sec in throughput(keys, nodes, args.replicas):
+        print(f"  {label:<22} {per_sec:>12,.0f}")
+
+    print()
+    print("distribution (node load relative to a perfect split; keys moved when adding one node)")
+    print(f"  {'ring':<7} {'nodes':>5} {'min':>6} {'max':>6} {'stddev':>7} {'moved':>7} {'ideal':>7}")
+    for n in node_counts:
+        nodes = [f"http://store{i}:9000" for i in range(1, n + 1)]
+        for label, ring_cls in (("legacy", LegacyConsistentHash), (RING_HASH, ConsistentHash)):
+            d = distribution(ring_cls, keys, nodes, args.replicas)
+            print(f"  {label:<7} {n:>5} {d['min']:>6.3f} {d['max']:>6.3f} {d['stddev']:>7.3f} "
+                  f"{d['moved']:>7.3f} {d['ideal_moved']:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
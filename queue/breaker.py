@@ -0,0 +1,102 @@
+import threading
+import time
+
+CLOSED    = "closed"     # requests flow normally
+OPEN      = "open"       # requests are shed until reset_timeout has passed
+HALF_OPEN = "half_open"  # one trial request decides whether to close again
+
+
+class CircuitBreaker:
+    """
+    A consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` failures in a row the breaker opens and
+    :meth:`allow` refuses requests for ``reset_timeout`` seconds. It then lets a
+    single trial request through (half-open): a success closes it again, a
+    failure re-opens it for another ``reset_timeout``.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before a trial.
+        opened (int): Number of times the breaker has opened.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=5.0, clock=time.monotonic):
+        """
+        Args:
+            failure_threshold (int): Consecutive failures that open the breaker.
+            reset_timeout (float): Seconds the breaker stays open before a trial.
+            clock (callable): Monotonic time source, in seconds.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.opened = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+
+    @property
+    def state(self):
+        """
+        str: ``closed``, ``open`` or ``half_open``.
+        """
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def retry_in(self):
+        """
+        Returns:
+            float: Seconds until the breaker lets a trial request through, 0 if not open.
+        """
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def allow(self):
+        """
+        Decide whether a request may be sent now.
+
+        Returns:
+            bool: True if the request may proceed. In half-open state only the
+            first caller gets True until its outcome is recorded.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._trial = False
+            if self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        """
+        Record a successful request, closing the breaker.
+        """
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Record a failed request, opening the breaker once the threshold is reached.
+        """
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened += 1
+                self._state = OPEN
+                self._opened_at = self._clock()
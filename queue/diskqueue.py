@@ -0,0 +1,241 @@
+import glob
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+OFFSET_FIELD = "_offset"
+
+
+class DiskQueue:
+    """
+    A FIFO job queue backed by append-only segment files, with a consumer offset.
+
+    It offers the subset of the ``deque`` interface the queue service uses
+    (``append``, ``popleft``, ``len``, truthiness and ``maxlen``), so it can stand in
+    for the in-memory queues, plus :meth:`ack`.
+
+    Every job is appended as one JSON line to the active segment
+    ``<directory>/<name>.<base>``, where ``base`` is the index of the segment's first
+    job. The newest jobs are also kept in a small in-memory hot window, so a consumer
+    that keeps up never reads the disk; a backlog beyond the window is read back
+    sequentially. Popped jobs carry their index in ``_offset`` and must be passed to
+    :meth:`ack` once handled. The lowest unacknowledged index is persisted in
+    ``<directory>/<name>.offset``, so after a crash consumption resumes there
+    (at-least-once) and fully consumed segments are deleted.
+
+    Attributes:
+        directory (str): Directory holding the segments and offset file.
+        name (str): File name prefix.
+        maxlen (int): Maximum number of unconsumed jobs.
+        hot_size (int): Maximum number of jobs kept in memory.
+        segment_bytes (int): Size after which a new segment is started.
+    """
+
+    def __init__(self, directory, name, maxlen, hot_size=1000, segment_bytes=16 * 1024 * 1024):
+        """
+        Open the queue, recovering the committed offset and any unconsumed jobs.
+
+        Args:
+            directory (str): Directory holding the segments and offset file.
+            name (str): File name prefix.
+            maxlen (int): Maximum number of unconsumed jobs.
+            hot_size (int): Maximum number of jobs kept in memory.
+            segment_bytes (int): Size after which a new segment is started.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.maxlen = maxlen
+        self.hot_size = hot_size
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+
+        self._segments = self._discover_segments()
+        self._committed = self._load_offset()
+        last = self._segments[-1]
+        self._tail = last + self._count_records(self._segment_path(last))
+        self._committed = min(max(self._committed, self._segments[0]), self._tail)
+        self._head = self._committed
+        self._writer = open(self._segment_path(last), "ab")
+
+        self._hot = deque()
+        self._hot_start = self._head
+        self._reader = None
+        self._reader_base = None
+        self._reader_pos = None
+        self._inflight = set()
+
+        if self._tail > self._head:
+            logging.log(logging.INFO, f"[{name}] recovered {self._tail - self._head} unconsumed jobs from {directory}")
+
+    def __len__(self):
+        with self._lock:
+            return self._tail - self._head
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, job):
+        """
+        Append a job to the end of the queue.
+
+        Args:
+            job (dict): A JSON-serializable job.
+        """
+        job = {k: v for k, v in job.items() if k != OFFSET_FIELD}
+        line = (json.dumps(job, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            if self._writer.tell() >= self.segment_bytes:
+                self._rotate()
+            self._writer.write(line)
+            self._writer.flush()
+            if self._hot_start + len(self._hot) == self._tail and len(self._hot) < self.hot_size:
+                self._hot.append(job)
+            self._tail += 1
+
+    def popleft(self):
+        """
+        Remove and return the job at the head of the queue.
+
+        Returns:
+            dict: The job, with its index in ``_offset``.
+
+        Raises:
+            IndexError: If the queue is empty.
+        """
+        with self._lock:
+            if self._head >= self._tail:
+                raise IndexError("pop from an empty queue")
+            idx = self._head
+            if self._hot and self._hot_start == idx:
+                job = self._hot.popleft()
+                self._hot_start += 1
+            else:
+                job = self._read(idx)
+                if not self._hot:
+                    self._hot_start = idx + 1
+            self._head += 1
+            self._inflight.add(idx)
+            job[OFFSET_FIELD] = idx
+            return job
+
+    def ack(self, jobs):
+        """
+        Mark popped jobs as handled and persist the new consumer offset.
+
+        Args:
+            jobs (list): Jobs returned by :meth:`popleft`.
+        """
+        with self._lock:
+            for job in jobs:
+                self._inflight.discard(job.get(OFFSET_FIELD))
+            committed = min(self._inflight) if self._inflight else self._head
+            if committed == self._committed:
+                return
+            self._committed = committed
+            self._save_offset()
+            self._drop_consumed()
+
+    def _segment_path(self, base):
+        return os.path.join(self.directory, f"{self.name}.{base:012d}")
+
+    def _discover_segments(self):
+        """
+        Returns:
+            list: Sorted base indexes of the segments on disk, never empty.
+        """
+        prefix = os.path.join(self.directory, self.name) + "."
+        segments = sorted(
+            int(path[len(prefix):]) for path in glob.glob(glob.escape(prefix) + "*")
+            if path[len(prefix):].isdigit()
+        )
+        if not segments:
+            open(self._segment_path(0), "ab").close()
+            segments = [0]
+        return segments
+
+    @staticmethod
+    def _count_records(path):
+        """
+        Count the complete jobs in a segment, dropping a torn trailing line.
+
+        Args:
+            path (str): Segment file to scan.
+
+        Returns:
+            int: Number of newline-terminated jobs.
+        """
+        count = 0
+        good_bytes = 0
+        with open(path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                count += 1
+                good_bytes += len(raw)
+        if good_bytes < os.path.getsize(path):
+            logging.warning(f"[queue] truncating torn job at end of {path}")
+            with open(path, "r+b") as f:
+                f.truncate(good_bytes)
+        return count
+
+    def _load_offset(self):
+        try:
+            with open(os.path.join(self.directory, f"{self.name}.offset")) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _save_offset(self):
+        path = os.path.join(self.directory, f"{self.name}.offset")
+        with open(f"{path}.tmp", "w") as f:
+            f.write(str(self._committed))
+        os.replace(f"{path}.tmp", path)
+
+    def _rotate(self):
+        """
+        Seal the active segment and start a new one at the current tail.
+        """
+        self._writer.close()
+        self._segments.append(self._tail)
+        self._writer = open(self._segment_path(self._tail), "ab")
+
+    def _drop_consumed(self):
+        """
+        Delete sealed segments whose jobs are all below the committed offset.
+        """
+        while len(self._segments) > 1 and self._segments[1] <= self._committed:
+            base = self._segments.pop(0)
+            if self._reader_base == base:
+                self._reader.close()
+                self._reader = None
+            try:
+                os.remove(self._segment_path(base))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, idx):
+        """
+        Read the job at ``idx`` from disk, reading sequentially where possible.
+
+        Args:
+            idx (int): Index of the job.
+
+        Returns:
+            dict: The job.
+        """
+        base = max(b for b in self._segments if b <= idx)
+        if self._reader is None or self._reader_base != base or self._reader_pos > idx:
+            if self._reader is not None:
+                self._reader.close()
+            self._reader = open(self._segment_path(base), "rb")
+            self._reader_base = base
+            self._reader_pos = base
+        while self._reader_pos < idx:
+            self._reader.readline()
+            self._reader_pos += 1
+        raw = self._reader.readline()
+        self._reader_pos += 1
+        return json.loads(raw)
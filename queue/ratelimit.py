@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    Base class for per-key rate limiters with constant-time checks and bounded memory.
+
+    Per-key state lives in an ``OrderedDict`` kept in least-recently-seen order.
+    Every check moves its key to the end and evicts keys from the front that have
+    been idle for longer than ``idle_after`` (their state no longer affects any
+    decision) or that exceed ``max_keys``, so memory stays bounded no matter how
+    many distinct keys are seen. All operations take one short internal lock.
+
+    Subclasses implement :meth:`_new_state` and :meth:`_check`.
+
+    Attributes:
+        limit (int): Requests allowed per window.
+        window (float): Window length in seconds.
+        max_keys (int): Maximum number of keys tracked at once.
+        idle_after (float): Seconds after which an idle key's state is dropped.
+        evictions (int): Number of keys evicted so far.
+    """
+
+    def __init__(self, limit, window, max_keys=1_000_000, clock=time.monotonic):
+        """
+        Args:
+            limit (int): Requests allowed per window.
+            window (float): Window length in seconds.
+            max_keys (int): Maximum number of keys tracked at once.
+            clock (callable): Monotonic time source, in seconds.
+        """
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.idle_after = 2 * window
+        self.evictions = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = OrderedDict()
+
+    def allow(self, key):
+        """
+        Record a request for ``key`` and decide whether it is within the limit.
+
+        Args:
+            key (str): The key being requested.
+
+        Returns:
+            bool: True if the request is within the limit.
+        """
+        now = self._clock()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                state = self._state[key] = self._new_state(now)
+            else:
+                self._state.move_to_end(key)
+            allowed = self._check(state, now)
+            self._evict(now)
+        return allowed
+
+    def __len__(self):
+        with self._lock:
+            return len(self._state)
+
+    def _evict(self, now):
+        """
+        Drop idle keys and keys over ``max_keys`` from the least-recently-seen end.
+
+        Args:
+            now (float): Current clock reading.
+        """
+        while self._state:
+            key, state = next(iter(self._state.items()))
+            if len(self._state) <= self.max_keys and now - state[-1] < self.idle_after:
+                break
+            del self._state[key]
+            self.evictions += 1
+
+    def _new_state(self, now):
+        """
+        Args:
+            now (float): Current clock reading.
+
+        Returns:
+            list: Fresh mutable state for a key; the last element is the last-seen time.
+        """
+        raise NotImplementedError
+
+    def _check(self, state, now):
+        """
+        Update ``state`` for one request and decide whether it is allowed.
+
+        Args:
+            state (list): The key's state from :meth:`_new_state`.
+            now (float): Current clock reading.
+
+        Returns:
+            bool: True if the request is within the limit.
+        """
+        raise NotImplementedError
+
+
+class SlidingWindowLimiter(RateLimiter):
+    """
+    Sliding-window counter: approximates the number of requests in the last
+    ``window`` seconds from the counts of the current and previous fixed windows.
+
+    Like the old timestamp list, every request is counted, including rejected ones,
+    so a key that keeps hammering stays limited.
+    """
+
+    def _new_state(self, now):
+        # [window index, current count, previous count, last seen]
+        return [int(now // self.window), 0, 0, now]
+
+    def _check(self, state, now):
+        idx = int(now // self.window)
+        if idx != state[0]:
+            state[2] = state[1] if idx == state[0] + 1 else 0
+            state[1] = 0
+            state[0] = idx
+        state[1] += 1
+        state[3] = now
+        elapsed = (now - idx * self.window) / self.window
+        return state[2] * (1.0 - elapsed) + state[1] <= self.limit
+
+
+class TokenBucketLimiter(RateLimiter):
+    """
+    Token bucket holding up to ``limit`` tokens, refilled at ``limit / window``
+    tokens per second. Allows bursts up to ``limit`` and only rejected requests
+    do not consume a token.
+    """
+
+    def __init__(self, limit, window, max_keys=1_000_000, clock=time.monotonic):
+        super().__init__(limit, window, max_keys, clock)
+        self.rate = limit / window
+        self.idle_after = window
+
+    def _new_state(self, now):
+        # [tokens, last seen]
+        return [float(self.limit), now]
+
+    def _check(self, state, now):
+        state[0] = min(float(self.limit), state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        if state[0] >= 1.0:
+            state[0] -= 1.0
+            return True
+        return False
+
+
+LIMITERS = {
+    "sliding": SlidingWindowLimiter,
+    "token": TokenBucketLimiter,
+}
+
+
+def make_limiter(kind, limit, window, max_keys=1_000_000):
+    """
+    Create a rate limiter by name.
+
+    Args:
+        kind (str): One of ``LIMITERS``.
+        limit (int): Requests allowed per window.
+        window (float): Window length in seconds.
+        max_keys (int): Maximum number of keys tracked at once.
+
+    Returns:
+        RateLimiter: The configured limiter.
+
+    Raises:
+        ValueError: If ``kind`` is unknown.
+    """
+    if kind not in LIMITERS:
+        raise ValueError(f"Unknown rate limiter {kind!r}, expected one of {tuple(LIMITERS)}")
+    return LIMITERS[kind](limit, window, max_keys)
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+
+def save_state(path, state):
+    """
+    Write JSON state to ``path`` atomically and durably.
+
+    The state goes to a temporary file that is synced and then renamed over
+    ``path``, so after a crash the file holds either the old or the new state.
+
+    Args:
+        path (str): Destination file.
+        state: JSON-serializable state.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def counter(value):
+    """
+    Args:
+        value (str): A value read from a store node.
+
+    Returns:
+        int or None: The value as counter, None if it is not a canonical integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if str(number) == value else None
+
+
+class Migration:
+    """
+    Moves the keys whose owner changed between two topologies.
+
+    Every node of the previous topology streams its key set from ``GET /keys``.
+    Keys are checked against the new ring in batches. Each batch of moving keys
+    is read from its old owner with ``POST /bulk/read``, copied to its new owners
+    with one ``POST /bulk/increment`` per owner (``/bulk/write`` for values that
+    are not counters) and only then taken back from the old owner with one
+    ``POST /bulk/drain``, which subtracts the copied values. Increments that
+    reached the old owner after the read are left there and moved in another
+    round, until nothing is left.
+
+    Counter increments commute, so a key that already received increments on its
+    new owner ends up with the sum of both parts. Every call carries a transfer
+    id that the store remembers durably and is retried until it succeeds, which
+    makes a retried call neither lose nor double-count values.
+
+    With a ``path`` the progress is journaled there: the nodes already done, the
+    transfer id counter and the batch in flight with its values and step, written
+    before each step. A migration created again for the same versions after a
+    restart resumes from the journal, finishing the batch in flight with the same
+    transfer ids.
+
+    Attributes:
+        previous (Topology): Topology the keys are moving away from.
+        current (Topology): Topology the keys are moving to.
+        batch_size (int): Keys checked and moved per batch.
+        path (str or None): JSON file the progress is journaled to.
+        stats (dict): Progress counters.
+    """
+
+    def __init__(self, previous, current, batch_size=1000, timeout=30.0, retry_delay=1.0, path=None):
+        """
+        Args:
+            previous (Topology): Topology the keys are moving away from.
+            current (Topology): Topology the keys are moving to.
+            batch_size (int): Keys checked and moved per batch.
+            timeout (float): Seconds allowed per store call.
+            retry_delay (float): Initial backoff between retries, doubled up to 30 s.
+            path (str, optional): JSON file to journal the progress to and resume from.
+        """
+        self.previous = previous
+        self.current = current
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.path = path
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._batches = 0  # transfer ids issued, never reused
+        self._done = []  # nodes of the previous topology fully migrated
+        self._pending = None  # batch in flight: {"node", "transfer", "values", "step"}
+        self.stats = {
+            "from_version": previous.version,
+            "to_version": current.version,
+            "state": "pending",
+            "keys_scanned": 0,
+            "keys_moved": 0,
+            "batches": 0,
+            "retries": 0,
+            "resumed": False,
+            "started_at": None,
+            "finished_at": None,
+        }
+        if path and os.path.exists(path):
+            with open(path) as f:
+                journal = json.load(f)
+            if (journal["from_version"], journal["to_version"]) == (previous.version, current.version):
+                self._batches = journal["batches"]
+                self._done = journal["done"]
+                self._pending = journal["pending"]
+                self.stats.update(journal["stats"], state="pending", resumed=True)
+
+    def status(self):
+        """
+        Returns:
+            dict: A copy of the progress counters.
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def run(self):
+        """
+        Move every affected key. Blocks until done; store errors are retried.
+        """
+        self._update(state="running", started_at=self.stats["started_at"] or time.time())
+        if self._pending is not None:
+            logging.info(f"[rebalance] resuming batch {self._pending['transfer']} at {self._pending['step']}")
+            self._move_values(self._pending)
+        for node in self.previous.nodes:
+            if node in self._done:
+                continue
+            while True:
+                try:
+                    self._migrate_node(node)
+                    break
+                except requests.RequestException as e:
+                    # keys already moved are gone from the node, so streaming again only resumes
+                    logging.warning(f"[rebalance] key stream from {node} failed, restarting: {e}")
+                    self._update(retries=1)
+                    time.sleep(self.retry_delay)
+            self._done.append(node)
+            self._save()
+        self._update(state="done", finished_at=time.time())
+        self._save()
+        logging.info(f"[rebalance] v{self.previous.version} -> v{self.current.version} done: {self.status()}")
+
+    def _migrate_node(self, node):
+        """
+        Stream the keys of one node and move those it no longer owns.
+
+        Args:
+            node (str): A primary of the previous topology.
+        """
+        with self.session.get(f"{node}/keys", stream=True, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            batch = []
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                batch.append(json.loads(line))
+                if len(batch) >= self.batch_size:
+                    self._move(node, batch)
+                    batch = []
+            if batch:
+                self._move(node, batch)
+
+    def _move(self, node, keys):
+        """
+        Move the keys of one batch that belong to another node now.
+
+        Args:
+            node (str): The node the keys were read from.
+            keys (list): The batch.
+        """
+        moving = [key for key, owner in zip(keys, self.current.ring.get_nodes(keys)) if owner != node]
+        self._update(keys_scanned=len(keys))
+        if not moving:
+            return
+        values = self._call(node, "/bulk/read", {"keys": moving})["values"]
+        while values:
+            with self._lock:
+                self._batches += 1
+                transfer = f"v{self.current.version}:{node}:{self._batches}"
+            values = self._move_values({"node": node, "transfer": transfer, "values": values, "step": "copy"})
+
+    def _move_values(self, batch):
+        """
+        Copy a batch of values to their new owners, then drain them from the old one.
+
+        The batch is journaled before each step, so a restart repeats at most the
+        step in flight, with the same transfer ids.
+
+        Args:
+            batch (dict): {"node": old owner, "transfer": transfer id, "values":
+                {key: value read from the old owner}, "step": "copy" or "drain"}.
+
+        Returns:
+            dict: Values that changed on the old owner after they were read and
+            still have to be moved.
+        """
+        node, transfer, values = batch["node"], batch["transfer"], batch["values"]
+        self._pending = batch
+        self._save()
+        if batch["step"] == "copy":
+            deltas, writes = {}, {}
+            for key, owner in zip(values, self.current.ring.get_nodes(list(values))):
+                number = counter(values[key])
+                if number is not None:
+                    deltas.setdefault(owner, {})[key] = number
+                else:
+                    writes.setdefault(owner, {})[key] = values[key]
+            for owner, owner_deltas in deltas.items():
+                self._call(owner, "/bulk/increment", {"deltas": owner_deltas, "transfer_id": f"{transfer}:{owner}"})
+            for owner, owner_values in writes.items():
+                self._call(owner, "/bulk/write", {"values": owner_values, "transfer_id": f"{transfer}:{owner}:write"})
+            batch["step"] = "drain"
+            self._save()
+        kept = self._call(node, "/bulk/drain", {"values": values, "transfer_id": f"{transfer}:drain"})["kept"]
+        self._pending = None
+        self._update(keys_moved=len(values) - len(kept), batches=1)
+        self._save()
+        return kept
+
+    def _call(self, node, path, body):
+        """
+        POST to a store node until it succeeds, backing off between attempts.
+
+        Args:
+            node (str): The store node.
+            path (str): Request path.
+            body (dict): JSON body.
+
+        Returns:
+            dict: The parsed response.
+        """
+        delay = self.retry_delay
+        while True:
+            try:
+                resp = self.session.post(f"{node}{path}", json=body, timeout=self.timeout)
+                resp.raise_for_status()
+                return resp.json()
+            except requests.RequestException as e:
+                logging.warning(f"[rebalance] {path} on {node} failed, retrying in {delay:.1f}s: {e}")
+                self._update(retries=1)
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    def _save(self):
+        """
+        Journal the progress to ``path``, if set.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            journal = {
+                "from_version": self.previous.version,
+                "to_version": self.current.version,
+                "batches": self._batches,
+                "done": list(self._done),
+                "pending": self._pending,
+                "stats": dict(self.stats),
+            }
+        save_state(self.path, journal)
+
+    def _update(self, **changes):
+        """
+        Add numeric changes to the progress counters and set the others.
+        """
+        with self._lock:
+            for name, value in changes.items():
+                if isinstance(value, int) and isinstance(self.stats[name], int):
+                    self.stats[name] += value
+                else:
+                    self.stats[name] = value
@@ -1,33 +1,104 @@
 import bisect
 import hashlib
+import os
+import zlib
+from array import array
+
+RING_HASH = os.getenv("RING_HASH", "md5")  # md5 | blake2b | crc32, must match in the API and the queue
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15  # 2^64 / golden ratio
+_BUCKET_SHIFT = 48            # the top 16 bits of a position select its bucket
+
+
+def _md5_64(data):
+    """
+    Hash to the top 64 bits of the MD5 digest.
+
+    Positions sort like the full 128-bit MD5 integers the ring has always used,
+    so keys stay where existing data put them.
+
+    Args:
+        data (bytes): The input to hash.
+
+    Returns:
+        int: An unsigned 64-bit ring position.
+    """
+    return int.from_bytes(hashlib.md5(data).digest(), "big") >> 64
+
+
+def _blake2b_64(data):
+    """
+    Hash to a 64-bit BLAKE2b digest.
+
+    Args:
+        data (bytes): The input to hash.
+
+    Returns:
+        int: An unsigned 64-bit ring position.
+    """
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def _crc32_64(data):
+    """
+    Hash to the CRC-32 of the bytes spread over 64 bits by a Fibonacci multiplication.
+
+    The cheapest option, but there are only 2^32 distinct positions.
+
+    Args:
+        data (bytes): The input to hash.
+
+    Returns:
+        int: An unsigned 64-bit ring position.
+    """
+    return (zlib.crc32(data) * _GOLDEN) & _MASK64
+
+
+_HASHES = {"md5": _md5_64, "blake2b": _blake2b_64, "crc32": _crc32_64}
+if RING_HASH not in _HASHES:
+    raise ValueError(f"RING_HASH must be one of {', '.join(_HASHES)}, not {RING_HASH!r}")
+hash64 = _HASHES[RING_HASH]  # placement function of every ring, bytes -> 64-bit position
 
 
 class ConsistentHash:
     """
-    A simple implementation of consistent hashing with virtual nodes.
+    A consistent hash ring with virtual nodes.
 
     This class distributes keys across a set of nodes such that:
     - Minimal keys are remapped when nodes are added or removed.
     - Virtual nodes (replicas) are used to improve key distribution.
 
+    Ring positions are kept sorted in a typed ``array('Q')`` with the index of
+    the owning node at the same position in a parallel ``array('I')``. A third
+    array maps the top 16 bits of a position to the first ring entry at or after
+    that prefix, so most lookups find their entry without searching and the rest
+    bisect only the few entries sharing their prefix. An optional memo of recent
+    key-to-node mappings skips the hash as well; it is cleared whenever it fills
+    up or the ring changes.
+
     Attributes:
         replicas (int): Number of virtual nodes per physical node.
-        ring (dict): Mapping of hash values to node identifiers.
-        _sorted (list): Sorted list of hash values for bisecting.
+        nodes (list): Node identifiers, indexed by the ring's owner array.
+        memo_size (int): Maximum number of memoized keys, 0 disables the memo.
     """
-    def __init__(self, nodes, replicas=100):
+    def __init__(self, nodes, replicas=100, memo_size=0):
         """
         Initialize the hash ring and add the initial nodes.
 
         Args:
             nodes (list): List of node identifiers (e.g., URLs or hostnames).
             replicas (int): Number of virtual nodes per real node.
+            memo_size (int): Maximum number of memoized key lookups, 0 disables it.
         """
         self.replicas = replicas
-        self.ring = {}
-        self._sorted = []
+        self.nodes = []
+        self.memo_size = memo_size
+        self._memo = {}
+        self._points = []  # (hash, node index) of every virtual node, for rebuilding
         for node in nodes:
-            self.add(node)
+            self._points.extend(self._place(node))
+        self._rebuild()
 
     def add(self, node):
         """
@@ -36,11 +107,25 @@ class ConsistentHash:
         Args:
             node (str): Node identifier to add to the ring.
         """
-        for i in range(self.replicas):
-            h = self._hash(f"{node}-{i}")
-            self.ring[h] = node
-            self._sorted.append(h)
-        self._sorted.sort()
+        self._points.extend(self._place(node))
+        self._rebuild()
+
+    def remove(self, node):
+        """
+        Remove a node and its virtual replicas from the hash ring.
+
+        Only the keys that were owned by the removed node change owner.
+
+        Args:
+            node (str): Node identifier to remove.
+
+        Raises:
+            ValueError: If the node is not on the ring.
+        """
+        index = self.nodes.index(node)
+        self.nodes = self.nodes[:index] + self.nodes[index + 1:]
+        self._points = [(h, i - (i > index)) for h, i in self._points if i != index]
+        self._rebuild()
 
     def get_node(self, key):
         """
@@ -52,23 +137,102 @@ class ConsistentHash:
         Returns:
             str or None: The node identifier responsible for the key.
         """
-        if not self.ring:
+        memo = self._memo
+        node = memo.get(key)
+        if node is not None:
+            return node
+        hashes, owners, buckets, nodes = self._table
+        if not hashes:
             return None
-        h = self._hash(key)
-        idx = bisect.bisect(self._sorted, h)
-        if idx == len(self._sorted):
-            idx = 0
-        return self.ring[self._sorted[idx]]
+        h = hash64(key.encode())
+        b = h >> _BUCKET_SHIFT
+        idx, end = buckets[b], buckets[b + 1]
+        if idx != end:
+            idx = bisect.bisect(hashes, h, idx, end)
+        node = nodes[owners[idx if idx < len(hashes) else 0]]
+        if self.memo_size:
+            if len(memo) >= self.memo_size:
+                memo.clear()
+            memo[key] = node
+        return node
+
+    def get_nodes(self, keys):
+        """
+        Get the responsible node of many keys at once.
+
+        Args:
+            keys (iterable): The keys to route.
+
+        Returns:
+            list: The node identifier of each key, in order.
+        """
+        (hashes, owners, buckets, nodes), memo = self._table, self._memo
+        if not hashes:
+            return [None for _ in keys]
+        size = len(hashes)
+        find, position = bisect.bisect, hash64
+        result = []
+        for key in keys:
+            node = memo.get(key)
+            if node is None:
+                # get_node() inlined, this loop is the hot path of bulk reads and batch coalescing
+                h = position(key.encode())
+                b = h >> _BUCKET_SHIFT
+                idx, end = buckets[b], buckets[b + 1]
+                if idx != end:
+                    idx = find(hashes, h, idx, end)
+                node = nodes[owners[idx if idx < size else 0]]
+                if self.memo_size:
+                    if len(memo) >= self.memo_size:
+                        memo.clear()
+                    memo[key] = node
+            result.append(node)
+        return result
+
+    def group(self, keys):
+        """
+        Partition keys by their responsible node.
+
+        Args:
+            keys (iterable): The keys to route.
 
-    @staticmethod
-    def _hash(x):
+        Returns:
+            dict: {node: [keys]} in first-seen order.
+        """
+        keys = list(keys)
+        grouped = {}
+        for key, node in zip(keys, self.get_nodes(keys)):
+            grouped.setdefault(node, []).append(key)
+        return grouped
+
+    def _place(self, node):
         """
-        Compute a hash for the given input using MD5.
+        Register a node and compute the ring positions of its virtual nodes.
 
         Args:
-            x (str): The input string to hash.
+            node (str): Node identifier.
 
         Returns:
-            int: A 128-bit integer hash.
+            list: (hash, node index) pairs.
+        """
+        index = len(self.nodes)
+        self.nodes = self.nodes + [node]
+        return [(hash64(f"{node}-{i}".encode()), index) for i in range(self.replicas)]
+
+    def _rebuild(self):
+        """
+        Sort all virtual nodes into the typed arrays and drop memoized lookups.
         """
-        return int(hashlib.md5(x.encode()).hexdigest(), 16)
+        self._points.sort()
+        hashes = array("Q", (h for h, _ in self._points))
+        owners = array("I", (i for _, i in self._points))
+        buckets = array("I")
+        idx = 0
+        for b in range((_MASK64 >> _BUCKET_SHIFT) + 2):
+            start = b << _BUCKET_SHIFT
+            while idx < len(hashes) and hashes[idx] < start:
+                idx += 1
+            buckets.append(idx)
+        # swapped in as one tuple so concurrent lookups never mix old and new arrays or node lists
+        self._table = (hashes, owners, buckets, tuple(self.nodes))
+        self._memo = {}
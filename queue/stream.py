@@ -0,0 +1,212 @@
+import json
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+
+
+class StreamUnavailable(Exception):
+    """
+    The store node does not offer streaming ingest; use its HTTP endpoints instead.
+    """
+
+
+class StoreError(Exception):
+    """
+    The store node rejected a streamed record.
+    """
+
+
+class StoreStream:
+    """
+    A persistent, pipelined ingest connection to one store node.
+
+    Bulk increments are written as JSON lines ``[seq, {key: delta}, traceparent,
+    record id]`` to the node's ingest port (looked up with ``GET /ingest``)
+    without waiting for earlier records to be answered. The node acknowledges every record with
+    ``[seq, error]`` once it is durable, and a reader thread hands each ack to the
+    callback of its sequence number. At most ``max_inflight`` records are
+    unanswered at a time; :meth:`send` blocks beyond that, which pushes back on
+    the lane's workers.
+
+    If the connection breaks or the oldest record stays unanswered for
+    ``timeout``, every record in flight fails with that error and the next send
+    reconnects. A failed record may still have been applied, as with an HTTP
+    call that timed out; the node remembers record ids, so resending it with the
+    same id does not apply it twice.
+
+    The lock guarding the connection and the records in flight is never held
+    while writing to the socket, so the reader can always deliver acks; a
+    separate lock keeps concurrent records from interleaving on the wire.
+
+    Attributes:
+        node (str): Base URL of the store node.
+        timeout (float): Seconds to connect, and to wait for the oldest ack.
+        sent (int): Records written.
+        acked (int): Records the node applied.
+        failed (int): Records that failed.
+        reconnects (int): Connections opened.
+    """
+
+    def __init__(self, node, max_inflight=64, timeout=2.0, session=None):
+        """
+        Args:
+            node (str): Base URL of the store node.
+            max_inflight (int): Records sent but not yet answered.
+            timeout (float): Seconds to connect, and to wait for the oldest ack.
+            session (requests.Session, optional): Session for the ``GET /ingest`` lookup.
+        """
+        self.node = node
+        self.timeout = timeout
+        self.sent = self.acked = self.failed = self.reconnects = 0
+        self._session = session or requests.Session()
+        self._window = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()  # held while writing a record, so lines are not interleaved
+        self._address = None
+        self._sock = None
+        self._seq = 0
+        self._pending = OrderedDict()  # seq -> (callback, sent at)
+
+    def send(self, deltas, traceparent, callback, record_id=None):
+        """
+        Stream one bulk increment; ``callback(error)`` is called with None once the
+        node applied it, or with the exception if it failed. Connection failures are
+        reported through the callback too, possibly before this returns.
+
+        Args:
+            deltas (dict): Mapping of key to the integer amount to add.
+            traceparent (str or None): Trace context for the node.
+            callback (callable): Called once with None or an exception.
+            record_id (str, optional): Idempotency key; the node applies a record
+                with an id it has seen before only once.
+
+        Raises:
+            StreamUnavailable: If the node has no ingest port; nothing was sent.
+        """
+        body = f"{json.dumps(deltas, separators=(',', ':'))},{json.dumps(traceparent)},{json.dumps(record_id)}]\n"
+        self._window.acquire()
+        try:
+            with self._lock:
+                if self._sock is None:
+                    self._connect()
+                sock = self._sock
+                self._seq += 1
+                seq = self._seq
+                self._pending[seq] = (callback, time.monotonic())
+        except StreamUnavailable:
+            self._window.release()
+            raise
+        except Exception as e:  # lookup or connect failed, nothing is in flight
+            self._window.release()
+            with self._lock:
+                self.failed += 1
+            callback(e)
+            return
+        try:
+            with self._send_lock:
+                sock.sendall(f"[{seq},{body}".encode())
+        except OSError as e:
+            self._fail(sock, e)
+            return
+        with self._lock:
+            self.sent += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Connection state, records in flight and the record counters.
+        """
+        with self._lock:
+            return {
+                "connected": self._sock is not None,
+                "inflight": len(self._pending),
+                "sent": self.sent,
+                "acked": self.acked,
+                "failed": self.failed,
+                "reconnects": self.reconnects,
+            }
+
+    def _connect(self):
+        """
+        Look up the ingest port if needed and connect. Caller holds the lock.
+
+        Raises:
+            StreamUnavailable: If the node has no ingest port.
+        """
+        if self._address is None:
+            resp = self._session.get(f"{self.node}/ingest", timeout=self.timeout)
+            if resp.status_code == 404:
+                raise StreamUnavailable(f"{self.node} has no streaming ingest")
+            resp.raise_for_status()
+            self._address = (urlsplit(self.node).hostname, resp.json()["port"])
+        try:
+            sock = socket.create_connection(self._address, timeout=self.timeout)
+        except OSError:
+            self._address = None  # the node may have restarted on another port
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self.reconnects += 1
+        threading.Thread(target=self._read, args=(sock,), daemon=True).start()
+
+    def _read(self, sock):
+        """
+        Hand the acks arriving on a connection to their callbacks until it breaks.
+        """
+        buffer = b""
+        try:
+            while True:
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    with self._lock:
+                        oldest = next(iter(self._pending.values()), None)
+                    if oldest is not None and time.monotonic() - oldest[1] >= self.timeout:
+                        raise TimeoutError(f"no ack from {self.node} within {self.timeout}s")
+                    continue
+                if not chunk:
+                    raise ConnectionError(f"{self.node} closed the ingest connection")
+                *lines, buffer = (buffer + chunk).split(b"\n")
+                for line in lines:
+                    seq, error = json.loads(line)
+                    with self._lock:
+                        entry = self._pending.pop(seq, None)
+                        if entry is not None:
+                            if error is None:
+                                self.acked += 1
+                            else:
+                                self.failed += 1
+                    if entry is not None:
+                        self._window.release()
+                        _call(entry[0], StoreError(error) if error is not None else None)
+        except Exception as e:
+            self._fail(sock, e)
+
+    def _fail(self, sock, error):
+        """
+        Close a connection and fail every record in flight on it.
+        """
+        with self._lock:
+            if self._sock is not sock:
+                return  # already failed, and a new connection may be in use
+            self._sock = None
+            pending, self._pending = self._pending, OrderedDict()
+            self.failed += len(pending)
+        sock.close()
+        if pending:
+            logging.warning(f"[stream] ingest connection to {self.node} failed with {len(pending)} records in flight: {error}")
+        for callback, _ in pending.values():
+            self._window.release()
+            _call(callback, error)
+
+
+def _call(callback, error):
+    try:
+        callback(error)
+    except Exception:
+        logging.exception("[stream] ack callback failed")
@@ -0,0 +1,191 @@
+from shard import ConsistentHash
+
+
+class Topology:
+    """
+    A versioned, immutable description of the store shards.
+
+    Each topology owns its own hash ring. While keys are being moved after a
+    change, ``previous`` holds the topology they are moving away from: a key
+    whose owner differs between the two rings may still have (part of) its
+    value on the previous owner, so reads have to combine both. Once the move is
+    complete the topology is replaced by a settled copy without ``previous``.
+
+    Topologies are swapped as a whole, so a reader that grabbed one keeps a
+    consistent view for the rest of its request.
+
+    Attributes:
+        version (int): Monotonically increasing config version.
+        nodes (list): Primary store nodes.
+        secondaries (list): Secondary of each primary, by position (may be shorter).
+        ring (ConsistentHash): Ring over ``nodes``.
+        previous (Topology or None): Topology being migrated away from.
+    """
+
+    def __init__(self, version, nodes, secondaries=(), previous=None, memo_size=0):
+        """
+        Args:
+            version (int): Config version.
+            nodes (list): Primary store nodes.
+            secondaries (list): Secondary of each primary, by position.
+            previous (Topology, optional): Topology being migrated away from.
+            memo_size (int): Memo size of the hash ring.
+        """
+        self.version = version
+        self.nodes = list(nodes)
+        self.secondaries = list(secondaries)
+        self.previous = previous
+        self.memo_size = memo_size
+        self.ring = ConsistentHash(self.nodes, memo_size=memo_size)
+
+    @classmethod
+    def from_dict(cls, config, previous=None, memo_size=0):
+        """
+        Build a topology from its JSON form.
+
+        Args:
+            config (dict): {"version": int, "nodes": [...], "secondaries": [...]}.
+            previous (Topology, optional): Topology being migrated away from.
+            memo_size (int): Memo size of the hash ring.
+
+        Returns:
+            Topology: The new topology.
+
+        Raises:
+            ValueError: If the config is malformed.
+        """
+        if not isinstance(config, dict):
+            raise ValueError("Topology must be a JSON object")
+        version = config.get("version")
+        nodes = config.get("nodes")
+        secondaries = config.get("secondaries", [])
+        if not isinstance(version, int) or isinstance(version, bool):
+            raise ValueError("'version' must be an integer")
+        if not isinstance(nodes, list) or not nodes or not all(isinstance(n, str) and n for n in nodes):
+            raise ValueError("'nodes' must be a non-empty list of URLs")
+        if len(set(nodes)) != len(nodes):
+            raise ValueError("'nodes' must not contain duplicates")
+        if not isinstance(secondaries, list) or not all(isinstance(n, str) for n in secondaries):
+            raise ValueError("'secondaries' must be a list of URLs")
+        prev = config.get("previous")
+        if previous is None and prev:
+            previous = cls.from_dict(prev, memo_size=memo_size)
+        return cls(version, nodes, secondaries, previous, memo_size)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: JSON form, including the previous topology while migrating.
+        """
+        return {
+            "version": self.version,
+            "nodes": self.nodes,
+            "secondaries": self.secondaries,
+            "migrating": self.previous is not None,
+            "previous": self.previous.to_dict() if self.previous is not None else None,
+        }
+
+    def settled(self):
+        """
+        Returns:
+            Topology: This topology without the previous one, once migration is done.
+        """
+        return Topology(self.version, self.nodes, self.secondaries, None, self.memo_size)
+
+    def secondary_for(self, node):
+        """
+        Args:
+            node (str): A primary store node of this or the previous topology.
+
+        Returns:
+            str or None: Its secondary, if one is configured.
+        """
+        if node in self.nodes:
+            idx = self.nodes.index(node)
+            return self.secondaries[idx] if idx < len(self.secondaries) else None
+        if self.previous is not None:
+            return self.previous.secondary_for(node)
+        return None
+
+    def previous_owner(self, key):
+        """
+        Args:
+            key (str): The key.
+
+        Returns:
+            str or None: The node the key is moving away from, None if it is not moving.
+        """
+        if self.previous is None:
+            return None
+        old = self.previous.ring.get_node(key)
+        return old if old != self.ring.get_node(key) else None
+
+    def moving(self, keys):
+        """
+        Group the keys that are moving by the node they are moving away from.
+
+        Args:
+            keys (list): The keys.
+
+        Returns:
+            dict: {previous node: [keys]}, empty when no migration is running.
+        """
+        if self.previous is None:
+            return {}
+        grouped = {}
+        for key, new, old in zip(keys, self.ring.get_nodes(keys), self.previous.ring.get_nodes(keys)):
+            if new != old:
+                grouped.setdefault(old, []).append(key)
+        return grouped
+
+
+def merge_counts(current, previous):
+    """
+    Combine a counter read from its new owner with the part still on its previous owner.
+
+    Increments of a moving key go to the new owner while its earlier value is
+    still being transferred, so both parts add up to the counter. Values that
+    are not integers are not summed; the new owner's value wins.
+
+    Args:
+        current: Value on the new owner, None if the key is not there.
+        previous: Value on the previous owner, None if the key is not there.
+
+    Returns:
+        The combined value (as string), or None if neither node has the key.
+    """
+    if previous is None:
+        return current
+    if current is None:
+        return previous
+    try:
+        return str(int(current) + int(previous))
+    except (TypeError, ValueError):
+        return current
+
+
+def follow(current, config, memo_size=0):
+    """
+    Decide which topology to use after seeing the one published by the queue.
+
+    A newer version is adopted, as is the settled form of the current version
+    once its migration has finished; anything else keeps ``current``.
+
+    Args:
+        current (Topology): Topology in use.
+        config (dict): Published topology, in ``Topology.to_dict`` form.
+        memo_size (int): Memo size of the hash ring.
+
+    Returns:
+        Topology: ``current`` or the topology built from ``config``.
+
+    Raises:
+        ValueError: If the config is malformed.
+    """
+    version = config.get("version") if isinstance(config, dict) else None
+    if not isinstance(version, int):
+        raise ValueError("Topology must include an integer 'version'")
+    settled = version == current.version and current.previous is not None and not config.get("migrating")
+    if version > current.version or settled:
+        return Topology.from_dict(config, memo_size=memo_size)
+    return current
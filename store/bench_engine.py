@@ -0,0 +1,103 @@
+"""
+Memory and speed benchmark of the store's data engines.
+
+Fills a plain dict (``STORE_ENGINE=dict``) and a ``CompactTable``
+(``STORE_ENGINE=compact``) with ``--keys`` integer counters named like the
+bench keys (``counter-<i>``), then reports for each engine:
+
+- bytes per key, measured with tracemalloc while filling (keys and values included),
+- inserts per second while filling,
+- lookups per second (``get`` of random existing keys),
+- increments per second (``get`` plus write back, like ``SimpleStore.increment``).
+
+Usage:
+    python bench_engine.py [--keys 1000000] [--ops 500000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from compact import CompactTable, memory_usage
+
+ENGINES = {"dict": dict, "compact": CompactTable}
+
+
+def fill(engine, names, values):
+    data = ENGINES[engine]()
+    for name, value in zip(names, values):
+        data[name] = value
+    return data
+
+
+def measure_bytes(engine, keys, value_range):
+    """
+    Returns:
+        float: Bytes allocated per key while filling a fresh engine with fresh keys and values.
+    """
+    rnd = random.Random(1)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        # keys and values are created inside the measurement, as the store decodes them from requests
+        data = ENGINES[engine]()
+        for i in range(keys):
+            data[f"counter-{i}"] = rnd.randrange(value_range)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del data
+    return used / keys
+
+
+def timed_ops(ops):
+    start = time.perf_counter()
+    ops()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1000000)
+    parser.add_argument("--ops", type=int, default=500000, help="lookups and increments timed per engine")
+    parser.add_argument("--value-range", type=int, default=10 ** 6, help="counters are drawn from [0, value-range)")
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    names = [f"counter-{i}" for i in range(args.keys)]
+    values = [rnd.randrange(args.value_range) for _ in range(args.keys)]
+    probes = [names[rnd.randrange(args.keys)] for _ in range(args.ops)]
+
+    print(f"{args.keys} keys, {args.ops} timed operations per engine")
+    print(f"{'engine':>8} {'B/key':>8} {'reported':>9} {'inserts/s':>12} {'lookups/s':>12} {'increments/s':>13}")
+    rows = {}
+    for engine in ENGINES:
+        per_key = measure_bytes(engine, args.keys, args.value_range)
+        start = time.perf_counter()
+        data = fill(engine, names, values)
+        insert = args.keys / (time.perf_counter() - start)
+        reported = memory_usage(data)["bytes_per_key"]
+
+        def lookups():
+            get = data.get
+            for name in probes:
+                get(name)
+
+        def increments():
+            get = data.get
+            for name in probes:
+                data[name] = get(name, 0) + 1
+
+        lookup = args.ops / timed_ops(lookups)
+        increment = args.ops / timed_ops(increments)
+        rows[engine] = per_key
+        print(f"{engine:>8} {per_key:>8.1f} {reported:>9.1f} {insert:>12,.0f} {lookup:>12,.0f} {increment:>13,.0f}")
+        del data
+    print(f"compact holds {rows['dict'] / rows['compact']:.1f}x the keys of dict in the same memory")
+
+
+if __name__ == "__main__":
+    main()
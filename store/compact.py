@@ -0,0 +1,390 @@
+import sys
+import threading
+from array import array
+from collections.abc import MutableMapping
+from itertools import islice
+
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+HASH_MASK = 0xFFFFFFFF  # entries keep the low 32 bits of the key hash
+OFFSET_MAX = 0xFFFFFFFF  # arena size up to which key offsets take 4 bytes
+MEMORY_SAMPLE = 1000  # entries sampled to estimate the size of a dict
+
+LIVE, DELETED, OBJECT = 0, 1, 2  # entry states; OBJECT entries keep their value in ``_objects``
+
+_MISSING = object()
+
+
+class CompactTable(MutableMapping):
+    """
+    A dict-like key-value table for millions of counters at a fraction of a dict's memory.
+
+    A dict of str keys to int values costs over 100 bytes per counter in object
+    headers, pointers and hash table slack. This table keeps the keys UTF-8
+    encoded back to back in one ``bytearray`` (the arena), the values in a typed
+    int64 ``array`` and finds entries through an open addressing hash table (linear
+    probing) of 32-bit entry indices, so a counter costs its key length plus about
+    25 bytes and no Python objects at all.
+
+    Entries are appended in insertion order. A deleted entry stays in place,
+    marked deleted, until the next rebuild compacts the arrays; writing the key
+    again revives it. Values that are not int64 integers (strings, huge ints) are
+    kept as objects in a side dict, so every value of ``SimpleStore.data`` reads back
+    unchanged.
+
+    Lookups are Python code instead of C, so single operations are slower than on a
+    dict (see bench_engine.py). Every operation holds the table's lock, since writers
+    of different key stripes mutate the table concurrently. Growing rebuilds the
+    hash table in one pass under that lock; pass the expected number of keys as
+    ``capacity`` to avoid rebuilds of large tables.
+    """
+
+    def __init__(self, capacity=0):
+        """
+        Args:
+            capacity (int): Keys to make room for up front.
+        """
+        self._lock = threading.Lock()
+        self._arena = bytearray()
+        self._offsets = array("I", [0])  # entry i's key is arena[offsets[i]:offsets[i + 1]], see _set
+        self._values = array("q")
+        self._hashes = array("I")
+        self._flags = bytearray()
+        self._objects = {}  # entry -> value of OBJECT entries
+        self._count = 0
+        self._deleted = 0
+        self._scans = 0  # running key_chunks() iterations, which keep entries from moving
+        self._slots = array("i", [-1]) * _slots_for(capacity)
+        self._mask = len(self._slots) - 1
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._find(_encode(key), hash(key) & HASH_MASK)[0]
+            return entry >= 0 and self._flags[entry] != DELETED
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        """
+        Args:
+            key (str): The key.
+            default: Returned if the key is missing.
+
+        Returns:
+            int or str: The value of the key, ``default`` if it is missing.
+        """
+        with self._lock:
+            entry = self._find(_encode(key), hash(key) & HASH_MASK)[0]
+            if entry < 0:
+                return default
+            flag = self._flags[entry]
+            if flag == LIVE:
+                return self._values[entry]
+            return default if flag == DELETED else self._objects[entry]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def pop(self, key, default=_MISSING):
+        """
+        Remove a key and return its value.
+
+        Args:
+            key (str): The key.
+            default: Returned if the key is missing; without it a missing key raises KeyError.
+
+        Returns:
+            int or str: The removed value.
+        """
+        with self._lock:
+            entry = self._find(_encode(key), hash(key) & HASH_MASK)[0]
+            flag = self._flags[entry] if entry >= 0 else DELETED
+            if flag == DELETED:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+            value = self._values[entry] if flag == LIVE else self._objects.pop(entry)
+            self._flags[entry] = DELETED
+            self._count -= 1
+            self._deleted += 1
+            return value
+
+    def update(self, other=(), **kwargs):
+        """
+        Write many pairs under one lock acquisition, like ``dict.update``.
+
+        Args:
+            other (Mapping or iterable): Mapping or ``(key, value)`` pairs.
+        """
+        pairs = other.items() if hasattr(other, "items") else other
+        with self._lock:
+            for key, value in pairs:
+                self._set(key, value)
+            for key, value in kwargs.items():
+                self._set(key, value)
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def items(self):
+        """
+        Iterate over a point-in-time copy of the table, so writers are not blocked while it runs.
+
+        Yields:
+            tuple: ``(key, value)`` in insertion order.
+        """
+        with self._lock:
+            arena, offsets, values = bytes(self._arena), self._offsets[:], self._values[:]
+            flags, objects = bytes(self._flags), dict(self._objects)
+        for entry, flag in enumerate(flags):
+            if flag == DELETED:
+                continue
+            key = arena[offsets[entry]:offsets[entry + 1]].decode("utf-8", "surrogatepass")
+            yield key, values[entry] if flag == LIVE else objects[entry]
+
+    def key_chunks(self, size):
+        """
+        Iterate over the keys a chunk at a time, copying at most ``size`` entries under the lock at once.
+
+        Unlike ``items()`` this never copies the whole table. While it runs,
+        rebuilds keep deleted entries in place so entries do not move; keys
+        written meanwhile may or may not be included.
+
+        Args:
+            size (int): Entries read per chunk.
+
+        Yields:
+            list: The live keys of the next ``size`` entries, in insertion order.
+        """
+        with self._lock:
+            self._scans += 1
+        try:
+            entry = 0
+            while True:
+                with self._lock:
+                    end = min(entry + size, len(self._flags))
+                    if entry >= end:
+                        return
+                    offsets, flags = self._offsets[entry:end + 1], self._flags[entry:end]
+                    arena = bytes(self._arena[offsets[0]:offsets[-1]])
+                base = offsets[0]
+                keys = [arena[offsets[i] - base:offsets[i + 1] - base].decode("utf-8", "surrogatepass")
+                        for i, flag in enumerate(flags) if flag != DELETED]
+                entry = end
+                if keys:
+                    yield keys
+        finally:
+            with self._lock:
+                self._scans -= 1
+
+    def copy(self):
+        """
+        Returns:
+            CompactTable: An independent copy, made by copying the arrays.
+        """
+        table = CompactTable()
+        with self._lock:
+            table._arena = bytearray(self._arena)
+            table._offsets = self._offsets[:]
+            table._values = self._values[:]
+            table._hashes = self._hashes[:]
+            table._flags = bytearray(self._flags)
+            table._objects = dict(self._objects)
+            table._count, table._deleted = self._count, self._deleted
+            table._slots, table._mask = self._slots[:], self._mask
+        return table
+
+    def memory_usage(self):
+        """
+        Returns:
+            dict: Keys, deleted entries awaiting compaction, hash table slots and the
+            bytes allocated by each part of the table, in total and per key.
+        """
+        with self._lock:
+            parts = {
+                "arena": sys.getsizeof(self._arena),
+                "offsets": sys.getsizeof(self._offsets),
+                "values": sys.getsizeof(self._values),
+                "hashes": sys.getsizeof(self._hashes),
+                "flags": sys.getsizeof(self._flags),
+                "slots": sys.getsizeof(self._slots),
+                "objects": sys.getsizeof(self._objects) + sum(sys.getsizeof(v) for v in self._objects.values()),
+            }
+            total = sum(parts.values())
+            return {
+                "engine": "compact",
+                "keys": self._count,
+                "deleted": self._deleted,
+                "slots": len(self._slots),
+                "bytes": total,
+                "bytes_per_key": total / self._count if self._count else 0.0,
+                "estimated": False,
+                "parts": parts,
+            }
+
+    def _find(self, raw, h):
+        """
+        Probe for a key. Caller holds the lock.
+
+        Args:
+            raw (bytes): The encoded key.
+            h (int): Its 32-bit hash.
+
+        Returns:
+            tuple: (entry index or -1, the slot holding it or the empty slot that ends the probe).
+        """
+        slots, mask, hashes, offsets, arena = self._slots, self._mask, self._hashes, self._offsets, self._arena
+        slot = h & mask
+        while True:
+            entry = slots[slot]
+            if entry < 0 or (hashes[entry] == h and arena[offsets[entry]:offsets[entry + 1]] == raw):
+                return entry, slot
+            slot = (slot + 1) & mask
+
+    def _set(self, key, value):
+        """
+        Write a value, appending an entry for a new key. Caller holds the lock.
+        """
+        raw, h = _encode(key), hash(key) & HASH_MASK
+        entry, slot = self._find(raw, h)
+        if entry < 0:
+            if (len(self._values) + 1) * 3 > len(self._slots) * 2:
+                self._rebuild(self._count + 1)
+                entry, slot = self._find(raw, h)
+            entry = len(self._values)
+            self._arena += raw
+            if len(self._arena) > OFFSET_MAX and self._offsets.typecode == "I":
+                self._offsets = array("q", self._offsets)  # widen once the arena outgrows 32-bit offsets
+            self._offsets.append(len(self._arena))
+            self._values.append(0)
+            self._hashes.append(h)
+            self._flags.append(DELETED)
+            self._deleted += 1
+            self._slots[slot] = entry
+        flag = self._flags[entry]
+        if flag == DELETED:
+            self._count += 1
+            self._deleted -= 1
+        if type(value) is int and INT64_MIN <= value <= INT64_MAX:
+            self._values[entry] = value
+            if flag == OBJECT:
+                del self._objects[entry]
+            self._flags[entry] = LIVE
+        else:
+            self._objects[entry] = value
+            self._flags[entry] = OBJECT
+
+    def _rebuild(self, keys):
+        """
+        Size the hash table for ``keys`` keys and reinsert every entry; if deleted
+        entries make up a quarter or more of the arrays and no key_chunks() iteration
+        is running, drop them first. Caller holds the lock.
+        """
+        if self._deleted * 4 >= len(self._values) and not self._scans:
+            self._compact()
+        slots = array("i", [-1]) * _slots_for(2 * max(keys, len(self._values) + 1))  # room to grow
+        mask = len(slots) - 1
+        for entry, h in enumerate(self._hashes):
+            slot = h & mask
+            while slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            slots[slot] = entry
+        self._slots, self._mask = slots, mask
+
+    def _compact(self):
+        """
+        Rewrite the arrays without deleted entries. Caller holds the lock and rebuilds the slots after.
+        """
+        arena, values, hashes, flags, objects = bytearray(), array("q"), array("I"), bytearray(), {}
+        offsets = array(self._offsets.typecode, [0])
+        old_arena, old_offsets = self._arena, self._offsets
+        for entry, flag in enumerate(self._flags):
+            if flag == DELETED:
+                continue
+            if flag == OBJECT:
+                objects[len(values)] = self._objects[entry]
+            arena += old_arena[old_offsets[entry]:old_offsets[entry + 1]]
+            offsets.append(len(arena))
+            values.append(self._values[entry])
+            hashes.append(self._hashes[entry])
+            flags.append(flag)
+        self._arena, self._offsets, self._values, self._hashes = arena, offsets, values, hashes
+        self._flags, self._objects, self._deleted = flags, objects, 0
+
+
+def memory_usage(data):
+    """
+    Report the memory held by the data of a store, for either engine.
+
+    A dict is estimated from its own size plus the average size of a sample of
+    its keys and values; objects shared with other code (small ints, interned
+    strings) are counted as if they were not.
+
+    Args:
+        data (dict or CompactTable): The data.
+
+    Returns:
+        dict: Engine, keys, bytes in total and per key, and whether the bytes are estimated.
+    """
+    if isinstance(data, CompactTable):
+        return data.memory_usage()
+    keys = len(data)
+    try:
+        sample = list(islice(data.items(), MEMORY_SAMPLE))
+    except RuntimeError:  # resized by a concurrent writer
+        sample = []
+    per_entry = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in sample) / len(sample) if sample else 0.0
+    total = sys.getsizeof(data) + int(per_entry * keys)
+    return {
+        "engine": "dict",
+        "keys": keys,
+        "bytes": total,
+        "bytes_per_key": total / keys if keys else 0.0,
+        "estimated": True,
+    }
+
+
+def key_chunks(data, size):
+    """
+    Iterate over the keys of the data of a store in chunks, for either engine.
+
+    A CompactTable is read ``size`` entries at a time (see CompactTable.key_chunks).
+    A dict cannot be iterated while writers resize it, so its keys are listed first;
+    the list only holds references to the keys, 8 bytes each.
+
+    Args:
+        data (dict or CompactTable): The data.
+        size (int): Keys per chunk.
+
+    Returns:
+        iterator: Lists of keys.
+    """
+    if isinstance(data, CompactTable):
+        return data.key_chunks(size)
+    keys = list(data)
+    return (keys[start:start + size] for start in range(0, len(keys), size))
+
+
+def _encode(key):
+    return key.encode("utf-8", "surrogatepass")
+
+
+def _slots_for(keys):
+    """
+    Returns:
+        int: The power of two number of slots that holds ``keys`` keys at most two thirds full.
+    """
+    size = 8
+    while size * 2 < keys * 3:
+        size *= 2
+    return size
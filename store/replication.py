@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TRACED_MAX = 1000  # traced records awaiting delivery per secondary, the oldest are forgotten
+
+
+class ReplicationSender:
+    """
+    Ships log records to one secondary, in LSN order, over a keep-alive session.
+
+    Records are buffered in a bounded deque by :meth:`publish` (cheap, safe to call
+    while holding the store lock so the buffer order matches the log order). A single
+    sender thread takes up to ``max_batch`` records at a time, waits until they are
+    durable on the primary, posts them to ``<secondary>/replicate`` and removes them
+    once the secondary acknowledged the highest LSN it applied. Failed batches are
+    retried with exponential backoff, so the secondary never sees them out of order.
+
+    If the secondary falls more than ``buffer_size`` records behind, the oldest
+    records are dropped and counted; the secondary notices the gap in LSNs.
+
+    Records of traced requests (see :meth:`watch`) get a ``store.replicate`` span
+    that ends when the secondary acknowledged them; the batch carrying them
+    continues the trace on the secondary.
+
+    Attributes:
+        url (str): Base URL of the secondary.
+        buffer_size (int): Maximum number of records held for the secondary.
+        max_batch (int): Maximum number of records sent per request.
+        timeout (float): Request timeout in seconds.
+        acked_lsn (int): Highest LSN the secondary confirmed.
+        batches (int): Number of batches delivered.
+        failures (int): Number of failed delivery attempts.
+        dropped (int): Number of records dropped because the buffer was full.
+    """
+
+    def __init__(self, url, wait_durable, buffer_size=100000, max_batch=1000, timeout=2.0):
+        """
+        Start the sender thread for one secondary.
+
+        Args:
+            url (str): Base URL of the secondary.
+            wait_durable (callable): Blocks until the given LSN is durable locally.
+            buffer_size (int): Maximum number of records held for the secondary.
+            max_batch (int): Maximum number of records sent per request.
+            timeout (float): Request timeout in seconds.
+        """
+        self.url = url
+        self.buffer_size = buffer_size
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._wait_durable = wait_durable
+
+        self._cond = threading.Condition()
+        self._buffer = deque()
+        self._published_lsn = 0
+        self.acked_lsn = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._traced = {}  # lsn -> replicate span of a traced request, see watch
+
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+        threading.Thread(target=self._send_loop, daemon=True).start()
+
+    def publish(self, records):
+        """
+        Queue records for delivery.
+
+        Args:
+            records (list): ``(lsn, key, value)`` tuples in increasing LSN order.
+        """
+        now = time.time()
+        with self._cond:
+            for lsn, key, value in records:
+                self._buffer.append((lsn, key, value, now))
+            overflow = len(self._buffer) - self.buffer_size
+            for _ in range(max(overflow, 0)):
+                self._buffer.popleft()
+            if overflow > 0:
+                self.dropped += overflow
+            if records:
+                self._published_lsn = records[-1][0]
+            self._cond.notify()
+
+    def watch(self, lsn, span):
+        """
+        Trace the delivery of a record to the secondary.
+
+        Args:
+            lsn (int): LSN of the record.
+            span (Span): Span of the request that wrote it.
+        """
+        child = span.child("store.replicate", secondary=self.url, lsn=lsn)
+        with self._cond:
+            if lsn > self.acked_lsn:
+                self._traced[lsn] = child
+                while len(self._traced) > TRACED_MAX:
+                    self._traced.pop(next(iter(self._traced)))
+                return
+        child.finish()
+
+    def lag(self):
+        """
+        Returns:
+            dict: Records and seconds the secondary is behind, plus delivery counters.
+        """
+        with self._cond:
+            oldest = self._buffer[0][3] if self._buffer else None
+            return {
+                "acked_lsn": self.acked_lsn,
+                "published_lsn": self._published_lsn,
+                "lag_records": len(self._buffer),
+                "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+                "batches": self.batches,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+    def _send_loop(self):
+        """
+        Deliver buffered records in batches until the process exits.
+        """
+        backoff = 0.05
+        while True:
+            with self._cond:
+                while not self._buffer:
+                    self._cond.wait()
+                batch = [self._buffer[i] for i in range(min(self.max_batch, len(self._buffer)))]
+                last_lsn = batch[-1][0]
+                traced = next((span for lsn, span in self._traced.items() if lsn <= last_lsn), None)
+
+            try:
+                self._wait_durable(last_lsn)
+                resp = self._session.post(
+                    f"{self.url}/replicate",
+                    json={"records": [[lsn, key, value] for lsn, key, value, _ in batch]},
+                    timeout=self.timeout,
+                    headers=traced.headers() if traced is not None else None,
+                )
+                resp.raise_for_status()
+                applied = resp.json().get("applied_lsn", last_lsn)
+            except Exception as e:
+                self.failures += 1
+                logging.log(logging.INFO, f"[REPLICATION] {self.url} unavailable, retrying in {backoff:.2f}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 2.0)
+                continue
+
+            backoff = 0.05
+            with self._cond:
+                while self._buffer and self._buffer[0][0] <= last_lsn:
+                    self._buffer.popleft()
+                self.acked_lsn = max(self.acked_lsn, applied)
+                self.batches += 1
+                delivered = [self._traced.pop(lsn) for lsn in [lsn for lsn in self._traced if lsn <= last_lsn]]
+            for span in delivered:
+                span.finish(batch=len(batch))
+
+
+class Replicator:
+    """
+    Fans log records out to one :class:`ReplicationSender` per secondary.
+
+    Attributes:
+        senders (dict): Mapping of secondary URL to its sender.
+    """
+
+    def __init__(self, secondaries, wait_durable, **kwargs):
+        """
+        Args:
+            secondaries (list): Base URLs of the secondaries.
+            wait_durable (callable): Blocks until the given LSN is durable locally.
+            **kwargs: Passed on to each :class:`ReplicationSender`.
+        """
+        self.senders = {url: ReplicationSender(url, wait_durable, **kwargs) for url in secondaries}
+
+    def publish(self, records):
+        """
+        Queue records for every secondary.
+
+        Args:
+            records (list): ``(lsn, key, value)`` tuples in increasing LSN order.
+        """
+        for sender in self.senders.values():
+            sender.publish(records)
+
+    def watch(self, lsn, span):
+        """
+        Trace the delivery of a record to every secondary, see :meth:`ReplicationSender.watch`.
+
+        Args:
+            lsn (int): LSN of the record.
+            span (Span): Span of the request that wrote it.
+        """
+        for sender in self.senders.values():
+            sender.watch(lsn, span)
+
+    def lag(self):
+        """
+        Returns:
+            dict: Lag statistics per secondary URL.
+        """
+        return {url: sender.lag() for url, sender in self.senders.items()}
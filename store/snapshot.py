@@ -0,0 +1,115 @@
+import json
+import os
+from itertools import islice
+
+from logformat import decode_value
+
+CHUNK_KEYS = 10000  # keys per record of a snapshot
+
+
+def encode_snapshot(data, lsn, meta=None):
+    """
+    Encode a snapshot as a stream of JSON lines.
+
+    The first line is a header ``{"lsn": ..., "meta": {...}}``; every following
+    line is a JSON object with up to ``CHUNK_KEYS`` key-value pairs. Encoding
+    and decoding a chunk at a time means neither side ever holds a second full
+    copy of the data, on disk or over HTTP (``GET /snapshot`` streams the same
+    format).
+
+    Args:
+        data (dict or CompactTable): Key-value pairs to encode.
+        lsn (int): Log sequence number of the last record reflected in ``data``.
+        meta (dict, optional): Extra fields stored in the header.
+
+    Yields:
+        str: Newline-terminated lines.
+    """
+    yield json.dumps({"lsn": lsn, "meta": meta or {}}, separators=(",", ":")) + "\n"
+    pairs = iter(data.items())
+    while True:
+        chunk = dict(islice(pairs, CHUNK_KEYS))
+        if not chunk:
+            return
+        yield json.dumps(chunk, separators=(",", ":")) + "\n"
+
+
+def decode_snapshot(lines, data):
+    """
+    Decode a snapshot stream into ``data``, one chunk at a time.
+
+    Snapshots written before the chunked format (one JSON document with the
+    whole ``data`` object) are still read.
+
+    Args:
+        lines (iterable): The snapshot's lines, str or bytes.
+        data (dict or CompactTable): Mapping the pairs are added to, values decoded
+            with :func:`decode_value`.
+
+    Returns:
+        tuple: ``(lsn, meta)`` from the header.
+
+    Raises:
+        ValueError: If the stream is empty or malformed.
+    """
+    lines = iter(lines)
+    header = json.loads(next(lines, None) or "null")
+    if not isinstance(header, dict) or "lsn" not in header:
+        raise ValueError("Snapshot does not start with a header")
+    chunks = lines if "data" not in header else [header.pop("data")]
+    for chunk in chunks:
+        if isinstance(chunk, (str, bytes)):
+            if not chunk.strip():
+                continue
+            chunk = json.loads(chunk)
+        data.update((key, decode_value(val)) for key, val in chunk.items())
+    return header["lsn"], header.get("meta", {})
+
+
+def write_snapshot(path, data, lsn, meta=None):
+    """
+    Atomically write a snapshot of the store to disk.
+
+    The snapshot is written to a temporary file, fsynced and then renamed over
+    ``path``, so a crash never leaves a half-written snapshot behind. It is
+    encoded in chunks (see :func:`encode_snapshot`).
+
+    Args:
+        path (str): Destination file.
+        data (dict or CompactTable): Key-value pairs to persist.
+        lsn (int): Log sequence number of the last record reflected in ``data``.
+        meta (dict, optional): Extra fields stored alongside the data.
+
+    Returns:
+        int: Size of the snapshot file in bytes.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.writelines(encode_snapshot(data, lsn, meta))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return os.path.getsize(path)
+
+
+def load_snapshot(path, data):
+    """
+    Load the latest snapshot from disk into ``data``, a chunk at a time.
+
+    Args:
+        path (str): Snapshot file.
+        data (dict or CompactTable): Mapping to fill, normally empty.
+
+    Returns:
+        tuple: ``(lsn, meta)``; LSN 0 and no meta if no snapshot exists.
+    """
+    if not os.path.exists(path):
+        return 0, {}
+    with open(path, "r") as f:
+        return decode_snapshot(f, data)
@@ -1,8 +1,21 @@
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort
+import json
 import os
 import threading
 import requests
 import logging
+import time
+from itertools import islice
+
+from compact import CompactTable, key_chunks, memory_usage
+from ingest import IngestServer
+from locks import StripedLock
+from logformat import decode_value
+from metrics import CONTENT_TYPE, Registry, instrument_flask
+from replication import Replicator
+from snapshot import decode_snapshot, encode_snapshot, load_snapshot, write_snapshot
+from tracing import Tracer, trace_flask
+from wal import WriteAheadLog
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,86 +28,276 @@ SECONDARIES_RAW = os.getenv("SECONDARIES", "")
 SECONDARIES    = [url for url in SECONDARIES_RAW.split(",") if url]
 STORE_PORT      = int(os.getenv("STORE_PORT", "9000"))
 PRIMARY_URL = os.getenv("PRIMARY_URL")
+WAL_FSYNC       = os.getenv("WAL_FSYNC", "batch")  # always | batch | interval
+WAL_FSYNC_INTERVAL_MS = int(os.getenv("WAL_FSYNC_INTERVAL_MS", "50"))
+WAL_MAX_BATCH   = int(os.getenv("WAL_MAX_BATCH", "1024"))
+WAL_SEGMENT_BYTES = int(os.getenv("WAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+WAL_FORMAT      = os.getenv("WAL_FORMAT", "binary")  # binary | text, format of new log segments
+SNAPSHOT_PATH   = os.getenv("SNAPSHOT_PATH", f"{LOG_PATH}.snapshot")
+SNAPSHOT_INTERVAL_SEC = int(os.getenv("SNAPSHOT_INTERVAL_SEC", "60"))
+SNAPSHOT_MIN_RECORDS  = int(os.getenv("SNAPSHOT_MIN_RECORDS", "10000"))  # new records needed before a snapshot
+REPL_BUFFER_SIZE = int(os.getenv("REPL_BUFFER_SIZE", "100000"))  # records held per secondary
+REPL_MAX_BATCH   = int(os.getenv("REPL_MAX_BATCH", "1000"))      # records sent per replication request
+REPL_TIMEOUT_SEC = float(os.getenv("REPL_TIMEOUT_SEC", "2"))
+CATCHUP_INTERVAL_SEC = float(os.getenv("CATCHUP_INTERVAL_SEC", "10"))  # secondary polls the primary log this often
+CATCHUP_BATCH    = int(os.getenv("CATCHUP_BATCH", "5000"))  # records pulled per catch-up request
+KEYS_CHUNK       = int(os.getenv("KEYS_CHUNK", "10000"))  # keys per chunk of a GET /keys stream
+TRANSFER_MEMORY  = int(os.getenv("TRANSFER_MEMORY", "100000"))  # transfer ids remembered for retries, see _claim_transfer
+STORE_LOCK_STRIPES = int(os.getenv("STORE_LOCK_STRIPES", "64"))  # key locks, writers of keys on different stripes run in parallel
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))  # fraction of requests traced, 0 traces only requests with a sampled traceparent
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))  # finished spans kept for GET /debug/traces
+TRACE_FILE      = os.getenv("TRACE_FILE", "")  # JSON lines file finished spans are appended to, empty disables
+STORE_ENGINE    = os.getenv("STORE_ENGINE", "dict")  # dict | compact, see compact.py
+STORE_CAPACITY  = int(os.getenv("STORE_CAPACITY", "0"))  # keys the compact engine makes room for up front
+INGEST_PORT     = int(os.getenv("INGEST_PORT", "9001"))  # streaming ingest for queue workers (see ingest.py), 0 disables
+
+TRANSFER_PREFIX  = "__transfer__/"  # reserved keys holding the remembered transfer ids, never listed or moved
+TRANSFER_USED    = f"{TRANSFER_PREFIX}used"  # reserved key counting the slots written so far, bounds the scan at startup
+
+METRICS = Registry()  # exposed on GET /metrics
+REQUEST_LATENCY = METRICS.histogram("store_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+LOCK_WAIT = METRICS.histogram("store_lock_wait_seconds", "Time writers waited for a contended key lock stripe",
+                              buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+TRACER = Tracer("store", TRACE_SAMPLE_RATE, TRACE_BUFFER_SIZE, TRACE_FILE or None)
 
-STORE_LOCK = threading.Lock()
 
 class SimpleStore:
     """
     A simple, thread-safe key-value store with write-ahead logging and async primary-copy replication.
 
+    Writes lock only the stripes of their keys (``STORE_LOCK_STRIPES``), so
+    writers of unrelated keys do not wait for each other, and queue their records
+    on the write-ahead log while still holding them; log order is kept by the
+    log's own lock. The caller then waits for the group commit outside all locks,
+    so concurrent writers share a single write and fsync. Taking every stripe
+    gives a consistent view of ``data`` and the LSN it covers (see :meth:`copy`).
+
+    Counters are stored as native ints and other values as strings (see
+    :func:`decode_value`); they are formatted as strings only at the HTTP boundary.
+    With ``STORE_ENGINE=compact`` the data lives in a :class:`CompactTable` instead
+    of a dict, which holds about three times as many counters in the same memory.
+
+    Every logged record is also handed to the :class:`Replicator` as it gets its
+    LSN, under the log lock, which ships it to the secondaries in LSN order; a secondary applies replicated
+    batches with :meth:`apply_replicated` and skips anything it has already seen.
+    When a secondary misses records it pulls the log tail after its ``replica_lsn``
+    from the primary, or the primary's full state if that part of the log has been
+    compacted away (see :meth:`catch_up`).
+
+    A background thread periodically snapshots ``data`` together with the LSN it
+    covers and drops the log segments behind it, so a restart loads the snapshot
+    and only replays the tail of the log.
+
+    Writes may carry a transfer id that makes retries idempotent. The last
+    ``TRANSFER_MEMORY`` ids are kept in reserved ``TRANSFER_PREFIX`` keys that are
+    written in the same log batch as the records they guard, so they are as
+    durable as the data and survive restarts, snapshots and replication.
+
     Attributes:
-        data (dict): In-memory key-value data store.
-        log_path (str): Path to the persistent log file.
+        data (dict or CompactTable): In-memory key-value data store.
+        log_path (str): Base path of the persistent log segments.
+        snapshot_path (str): Path to the latest snapshot.
+        wal (WriteAheadLog): Group-committing log writer.
+        replicator (Replicator): Ordered, batched replication to the secondaries.
+        replica_lsn (int): Highest primary LSN applied on this secondary.
+        transfer_repeats (int): Writes skipped because their transfer id was applied before.
+        stats (dict): Recovery and snapshot timings.
     """
 
-    def __init__(self, log_path):
+    def __init__(self, log_path, snapshot_path=None):
         """
-        Initialize the store and replay the log file to rebuild state.
+        Initialize the store from the latest snapshot and replay the log tail.
 
         Args:
-            log_path (str): Path to the persistent log file.
+            log_path (str): Base path of the persistent log segments.
+            snapshot_path (str, optional): Path to the snapshot file.
         """
-        self.data = {}
+        self.data = self._empty()
         self.log_path = log_path
-        open(self.log_path, "a").close()
+        self.snapshot_path = snapshot_path or f"{log_path}.snapshot"
+        self.stats = {
+            "snapshot_load_ms": 0.0,
+            "replay_ms": 0.0,
+            "replayed_records": 0,
+            "snapshot_lsn": 0,
+            "snapshots_taken": 0,
+            "last_snapshot_ms": 0.0,
+            "last_snapshot_bytes": 0,
+            "last_snapshot_at": None,
+            "segments_removed": 0,
+        }
+        self.wal = WriteAheadLog(
+            log_path,
+            fsync_mode=WAL_FSYNC,
+            fsync_interval=WAL_FSYNC_INTERVAL_MS / 1000.0,
+            max_batch=WAL_MAX_BATCH,
+            segment_bytes=WAL_SEGMENT_BYTES,
+            log_format=WAL_FORMAT,
+        )
+        self.replicator = Replicator(
+            SECONDARIES,
+            self.wal.wait,
+            buffer_size=REPL_BUFFER_SIZE,
+            max_batch=REPL_MAX_BATCH,
+            timeout=REPL_TIMEOUT_SEC,
+        )
+        self.replica_lsn = 0
+        self.replica_gaps = 0
+        self._locks = StripedLock(STORE_LOCK_STRIPES, on_wait=LOCK_WAIT.labels().observe)
+        self._transfers = {}  # transfer id -> LSN of its records, None while they are being applied
+        self._transfer_slots = {}  # slot -> transfer id stored in it, see _claim_transfer
+        self._transfer_claims = {}  # transfer id -> its slot, while its write is being applied
+        self._transfer_next = 0  # sequence number of the next transfer id
+        self.transfer_repeats = 0  # writes skipped because their transfer id was applied before
+        self._transfer_done = threading.Condition()  # a transfer id was settled
+        self._replica_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._catchup = threading.Event()
         self._replay_log()
+        self._load_transfers()
 
+        threading.Thread(target=self._snapshot_loop, daemon=True).start()
         if PRIMARY_URL:
-            threading.Thread(target=self._reconcile_loop, daemon=True).start()
+            self._primary = requests.Session()
+            self._catchup.set()
+            threading.Thread(target=self._catchup_loop, daemon=True).start()
 
-    def _reconcile_loop(self):
+    def _catchup_loop(self):
         """
-        Periodically reconcile the local store with the primary store.
+        Keep the secondary in sync with the primary's log.
 
-        This method runs in an infinite loop, checking every 10 seconds if the primary
-        store is available. For each key in the local store, it attempts to fetch the
-        corresponding value from the primary store. If the value in the primary store
-        is greater than the local value, the local store is updated to match the primary.
+        Runs a catch-up every ``CATCHUP_INTERVAL_SEC``, or immediately when a
+        replicated batch revealed a gap.
+        """
+        while True:
+            self._catchup.wait(CATCHUP_INTERVAL_SEC)
+            self._catchup.clear()
+            try:
+                self.catch_up()
+            except Exception as e:
+                logging.log(logging.INFO, f"[CATCHUP] Could not catch up with primary: {e}")
 
-        The reconciliation process ensures eventual consistency between the local store
-        and the primary store.
+    def catch_up(self):
+        """
+        Pull and apply the primary's log records after ``replica_lsn``.
 
-        Raises:
-            Exception: Logs any exceptions encountered while contacting the primary store.
+        If the primary no longer has those records (compacted into a snapshot),
+        its full state is transferred instead and the tail is pulled after that.
+
+        Returns:
+            int: The highest primary LSN applied.
         """
-        import time
         while True:
-            time.sleep(10)
-            if not PRIMARY_URL:
+            resp = self._primary.get(
+                f"{PRIMARY_URL}/log",
+                params={"since": self.replica_lsn, "limit": CATCHUP_BATCH},
+                timeout=REPL_TIMEOUT_SEC,
+            )
+            if resp.status_code == 410:
+                self._install_primary_snapshot()
                 continue
+            resp.raise_for_status()
+            body = resp.json()
+            if body["records"]:
+                self.apply_replicated(body["records"], contiguous=False)
+            if not body["records"] or self.replica_lsn >= body["last_lsn"]:
+                return self.replica_lsn
 
-            for key in list(self.data.keys()):
-                try:
-                    resp = requests.get(f"{PRIMARY_URL}/store/{key}", timeout=1)
-                    if resp.status_code != 200:
-                        logging.log(logging.INFO, f"[RECONCILE] Skipping key={key} (primary gave status {resp.status_code})")
-                        continue
-                    primary_val = resp.json().get("value")
-                    with STORE_LOCK:
-                        local_val = self.data.get(key)
-                        if int(primary_val) > int(local_val):
-                            logging.log(logging.INFO,f"[RECONCILE] Updating key={key} from {local_val} → {primary_val}")
-                            self.data[key] = primary_val
-                            with open(self.log_path, "a") as f:
-                                f.write(f"{key}:{primary_val}\n")
-                except Exception as e:
-                    logging.log(logging.INFO,f"[RECONCILE] Could not contact primary for key={key}: {e}")
-                    continue
+    def _install_primary_snapshot(self):
+        """
+        Replace the local state with a full copy of the primary's state.
+
+        The snapshot is decoded into the new data chunk by chunk as it arrives.
+        """
+        with self._primary.get(f"{PRIMARY_URL}/snapshot", stream=True, timeout=max(REPL_TIMEOUT_SEC, 30)) as resp:
+            resp.raise_for_status()
+            data = self._empty()
+            lsn, _ = decode_snapshot(resp.iter_lines(chunk_size=64 * 1024), data)
+        with self._replica_lock:
+            with self._locks.all():
+                self.data = data
+                self.replica_lsn = lsn
+            logging.log(logging.INFO, f"[CATCHUP] installed primary snapshot at lsn={lsn} ({len(data)} keys)")
+            self._load_transfers()
+            self.snapshot()
 
     def _replay_log(self):
         """
-        Reconstruct the in-memory store by replaying the write-ahead log.
+        Reconstruct the in-memory store from the latest snapshot and the log records after it.
+        """
+        start = time.perf_counter()
+        self.data = self._empty()
+        snapshot_lsn, meta = load_snapshot(self.snapshot_path, self.data)
+        self.replica_lsn = meta.get("replica_lsn", 0)
+        loaded = time.perf_counter()
+
+        replayed = self.wal.replay(self.data, since=snapshot_lsn)
+        done = time.perf_counter()
+
+        self.stats["snapshot_lsn"] = snapshot_lsn
+        self.stats["snapshot_load_ms"] = (loaded - start) * 1000
+        self.stats["replay_ms"] = (done - loaded) * 1000
+        self.stats["replayed_records"] = replayed
+        logging.log(logging.INFO, f"[RECOVERY] loaded snapshot at lsn={snapshot_lsn} ({len(self.data)} keys) in "
+                                  f"{self.stats['snapshot_load_ms']:.1f}ms, replayed {replayed} records in "
+                                  f"{self.stats['replay_ms']:.1f}ms")
+
+    @staticmethod
+    def _empty():
+        """
+        Returns:
+            dict or CompactTable: Empty data of the configured STORE_ENGINE.
+        """
+        return CompactTable(STORE_CAPACITY) if STORE_ENGINE == "compact" else {}
+
+    def _snapshot_loop(self):
+        """
+        Periodically snapshot the store once enough new records have been logged.
+        """
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL_SEC)
+            if self.wal.last_lsn - self.stats["snapshot_lsn"] < SNAPSHOT_MIN_RECORDS:
+                continue
+            try:
+                self.snapshot()
+            except Exception as e:
+                logging.exception(f"[SNAPSHOT] failed: {e}")
+
+    def snapshot(self):
+        """
+        Write a snapshot of the current state and drop the log segments it covers.
+
+        Returns:
+            dict: The updated snapshot statistics.
+        """
+        with self._snapshot_lock:
+            start = time.perf_counter()
+            data, lsn = self.copy()
+            meta = {"replica_lsn": self.replica_lsn}
+            self.wal.wait(lsn)
+            size = write_snapshot(self.snapshot_path, data, lsn, meta)
+            removed = self.wal.truncate(lsn)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            self.stats["snapshot_lsn"] = lsn
+            self.stats["snapshots_taken"] += 1
+            self.stats["last_snapshot_ms"] = elapsed
+            self.stats["last_snapshot_bytes"] = size
+            self.stats["last_snapshot_at"] = time.time()
+            self.stats["segments_removed"] += removed
+            logging.log(logging.INFO, f"[SNAPSHOT] lsn={lsn} keys={len(data)} bytes={size} "
+                                      f"took {elapsed:.1f}ms, removed {removed} segments")
+            return dict(self.stats)
+
+    def copy(self):
         """
-        with open(self.log_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                key, val = line.split(":", 1)
-                if val == "__deleted__":
-                    self.data.pop(key, None)
-                else:
-                    self.data[key] = val
+        Copy the data together with the LSN it covers, holding every key stripe.
+
+        Returns:
+            tuple: (copy of ``data``, last LSN applied to it).
+        """
+        with self._locks.all():
+            return self.data.copy(), self.wal.last_lsn
 
     def append(self, key, value):
         """
@@ -104,11 +307,11 @@ class SimpleStore:
             key (str): The key to write.
             value (str): The value to associate with the key.
         """
-        with STORE_LOCK:
+        value = decode_value(value)
+        with self._locks.for_key(key):
             self.data[key] = value
-            with open(self.log_path, "a") as f:
-                f.write(f"{key}:{value}\n")
-        threading.Thread(target=self._replicate, args=(key, value), daemon=True).start()
+            seq = self.wal.append(key, value, lambda lsn: self._publish([(lsn, key, value)]))
+        self.wal.wait(seq)
 
     def increment(self, key, delta=1):
         """Atomically increment a key by ``delta``.
@@ -120,15 +323,108 @@ class SimpleStore:
         Returns:
             int: The new value after incrementing.
         """
-        with STORE_LOCK:
-            current = int(self.data.get(key, "0"))
+        span = TRACER.current()
+        locking = time.time() if span is not None else None
+        with self._locks.for_key(key):
+            locked = time.time() if span is not None else None
+            current = self.data.get(key, 0)
+            if type(current) is not int:
+                current = int(current)
             new_value = current + delta
-            self.data[key] = str(new_value)
-            with open(self.log_path, "a") as f:
-                f.write(f"{key}:{self.data[key]}\n")
-        threading.Thread(target=self._replicate, args=(key, self.data[key]), daemon=True).start()
+            self.data[key] = new_value
+            seq = self.wal.append(key, new_value, lambda lsn: self._publish([(lsn, key, new_value)]))
+        if span is not None:
+            span.record("store.lock_wait", locking, locked)
+        self.commit(seq, span)
         return new_value
 
+    def increment_many(self, deltas, transfer_id=None):
+        """
+        Atomically increment several keys under one lock acquisition per stripe and one log batch.
+
+        Args:
+            deltas (dict): Mapping of key to the integer amount to add.
+            transfer_id (str, optional): Idempotency key; a repeated id returns the
+                keys' current values without applying the deltas again.
+
+        Returns:
+            dict: Mapping of key to its new value.
+        """
+        span = TRACER.current()
+        values, seq = self.stage_increments(deltas, transfer_id)
+        if seq is not None:
+            self.commit(seq, span)
+        return values
+
+    def stage_increments(self, deltas, transfer_id=None):
+        """
+        Apply and log several increments like :meth:`increment_many`, without waiting for the log.
+
+        Streaming ingest applies records as they arrive and waits for durability
+        separately, so records in flight on one connection share a group commit.
+
+        Args:
+            deltas (dict): Mapping of key to the integer amount to add.
+            transfer_id (str, optional): Idempotency key, see :meth:`_claim_transfer`.
+
+        Returns:
+            tuple: (mapping of key to its new value, LSN to pass to ``wal.wait``;
+            for a repeated transfer id the keys' current values and the LSN of
+            the first application, which logs nothing).
+        """
+        marker = None
+        if transfer_id is not None:
+            lsn, marker = self._claim_transfer(transfer_id)
+            if marker is None:
+                return self._current(deltas), lsn
+        values = {}
+        data = self.data
+        span = TRACER.current()
+        locking = time.time() if span is not None else None
+        try:
+            with self._locks.for_keys(deltas if marker is None else [*deltas, *marker]):
+                locked = time.time() if span is not None else None
+                for key, delta in deltas.items():
+                    current = data.get(key, 0)
+                    if type(current) is not int:
+                        current = int(current)
+                    values[key] = current + delta
+                # written only once every key converted, so a bad value changes nothing
+                data.update(values)
+                seq = self._log_many(values, marker)
+        except Exception:
+            self._settle_transfer(transfer_id, None)
+            raise
+        self._settle_transfer(transfer_id, seq)
+        if span is not None:
+            span.record("store.lock_wait", locking, locked, keys=len(deltas))
+        return values, seq
+
+    def append_many(self, values, transfer_id=None):
+        """
+        Write several key-value pairs under one lock acquisition per stripe and one log batch.
+
+        Args:
+            values (dict): Mapping of key to value (as string).
+            transfer_id (str, optional): Idempotency key; a repeated id writes nothing.
+        """
+        marker = None
+        if transfer_id is not None:
+            lsn, marker = self._claim_transfer(transfer_id)
+            if marker is None:
+                self.wal.wait(lsn)
+                return
+        try:
+            values = {key: decode_value(val) for key, val in values.items()}
+            with self._locks.for_keys(values if marker is None else [*values, *marker]):
+                self.data.update(values)
+                seq = self._log_many(values, marker)
+        except Exception:
+            self._settle_transfer(transfer_id, None)
+            raise
+        self._settle_transfer(transfer_id, seq)
+        self.wal.wait(seq)
+
     def delete(self, key):
         """
         Delete a key from the store and log the deletion.
@@ -139,34 +435,280 @@ class SimpleStore:
         Returns:
             bool: True if the key existed, False otherwise.
         """
-        with STORE_LOCK:
-            existed = key in self.data
-            self.data.pop(key, None)
-            with open(self.log_path, "a") as f:
-                f.write(f"{key}:__deleted__\n")
-        threading.Thread(target=self._replicate, args=(key, "__deleted__"), daemon=True).start()
+        with self._locks.for_key(key):
+            existed = self.data.pop(key, None) is not None
+            seq = self.wal.append(key, None, lambda lsn: self._publish([(lsn, key, None)]))
+        self.wal.wait(seq)
         return existed
 
-    def _replicate(self, key, value):
+    def drain_many(self, values, transfer_id=None):
         """
-        Fire-and-forget replication to all configured secondaries.
+        Take back values that were copied to another shard, the last step of moving keys there.
+
+        A counter drops by the copied amount and is removed once nothing is left;
+        any other value is removed if it still equals the copied one. Whatever
+        changed after the copy stays and is returned, to be moved as well. The
+        changes are logged and replicated like other writes.
 
         Args:
-            key (str): The key to replicate.
-            value (str): The value to replicate (or "__deleted__").
+            values (dict): Mapping of key to the value copied away (as string).
+            transfer_id (str, optional): Idempotency key; a repeated id changes nothing.
+
+        Returns:
+            dict: Mapping of every key still present to its value.
         """
-        for secondary in SECONDARIES:
-            try:
-                requests.post(
-                    f"{secondary}/store/{key}",
-                    json={"value": value},
-                    timeout=1
-                )
-            except Exception:
-                pass
-
-store = SimpleStore(LOG_PATH)
+        marker = None
+        if transfer_id is not None:
+            lsn, marker = self._claim_transfer(transfer_id)
+            if marker is None:
+                self.wal.wait(lsn)
+                return self._current(values)
+        data = self.data
+        seq = None
+        try:
+            with self._locks.for_keys(values if marker is None else [*values, *marker]):
+                changed = {}
+                for key, copied in values.items():
+                    current, copied = data.get(key), decode_value(copied)
+                    if current is None:
+                        continue
+                    if type(current) is int and type(copied) is int:
+                        changed[key] = (current - copied) or None
+                    elif current == copied:
+                        changed[key] = None
+                for key, value in changed.items():
+                    if value is None:
+                        del data[key]
+                    else:
+                        data[key] = value
+                kept = self._current(values)
+                if changed or marker is not None:
+                    seq = self._log_many(changed, marker)
+        except Exception:
+            self._settle_transfer(transfer_id, None)
+            raise
+        self._settle_transfer(transfer_id, seq)
+        if seq is not None:
+            self.wal.wait(seq)
+        return kept
+
+    def _current(self, keys):
+        """
+        Args:
+            keys (iterable): The keys.
+
+        Returns:
+            dict: Mapping of every key present to its value.
+        """
+        data = self.data
+        return {key: data[key] for key in keys if key in data}
+
+    def _load_transfers(self):
+        """
+        Rebuild the index of remembered transfer ids from their slots in ``data``.
+
+        Only the slots written so far are read (``TRANSFER_USED``); data from before
+        that key was kept has every slot read once.
+        """
+        transfers, slots, last = {}, {}, -1
+        used = self.data.get(TRANSFER_USED)
+        for slot in range(TRANSFER_MEMORY if used is None else min(int(used), TRANSFER_MEMORY)):
+            entry = self.data.get(f"{TRANSFER_PREFIX}{slot}")
+            if not isinstance(entry, str):
+                continue
+            seq, _, transfer_id = entry.partition(" ")
+            transfers[transfer_id] = 0  # recovered, so already durable
+            slots[slot] = transfer_id
+            last = max(last, int(seq))
+        with self._transfer_done:
+            self._transfers, self._transfer_slots, self._transfer_next = transfers, slots, last + 1
+
+    def _claim_transfer(self, transfer_id):
+        """
+        Look up a transfer id, or reserve the oldest of the ``TRANSFER_MEMORY`` slots for it.
+
+        The caller of a new id stores and logs the returned slot entry together with
+        its records (see :meth:`_log_many`) and then calls :meth:`_settle_transfer`.
+        A request with an id that is still being applied waits for it, so a retry
+        never races the original. A slot whose id is still being applied is never
+        taken over; the next one is used, and with every slot in use the request
+        waits for one to settle.
+
+        Args:
+            transfer_id (str): Idempotency key of the write.
+
+        Returns:
+            tuple: (LSN of the first application, None) for a repeated id,
+            (None, {reserved key: value}) for a new one: its slot entry and, until
+            every slot was used once, the new ``TRANSFER_USED`` count.
+        """
+        with self._transfer_done:
+            while True:
+                if transfer_id in self._transfers:
+                    lsn = self._transfers[transfer_id]
+                    if lsn is not None:
+                        self.transfer_repeats += 1
+                        return lsn, None
+                elif len(self._transfer_claims) < TRANSFER_MEMORY:
+                    break
+                self._transfer_done.wait()
+            while True:
+                seq = self._transfer_next
+                self._transfer_next += 1
+                slot = seq % TRANSFER_MEMORY
+                evicted = self._transfer_slots.get(slot)
+                if evicted not in self._transfer_claims:
+                    break
+            if evicted is not None:
+                self._transfers.pop(evicted, None)
+            self._transfer_slots[slot] = transfer_id
+            self._transfer_claims[transfer_id] = slot
+            self._transfers[transfer_id] = None
+            marker = {f"{TRANSFER_PREFIX}{slot}": f"{seq} {transfer_id}"}
+            if seq < TRANSFER_MEMORY:
+                marker[TRANSFER_USED] = seq + 1
+            return None, marker
+
+    def _settle_transfer(self, transfer_id, lsn):
+        """
+        Record the outcome of a write claimed with :meth:`_claim_transfer`.
+
+        Args:
+            transfer_id (str or None): Idempotency key, None to skip.
+            lsn (int or None): LSN of its records, None if the write failed and may be retried.
+        """
+        if transfer_id is None:
+            return
+        with self._transfer_done:
+            slot = self._transfer_claims.pop(transfer_id, None)
+            if lsn is None:
+                self._transfers.pop(transfer_id, None)
+                if self._transfer_slots.get(slot) == transfer_id:
+                    del self._transfer_slots[slot]
+            else:
+                self._transfers[transfer_id] = lsn
+            self._transfer_done.notify_all()
+
+    def commit(self, seq, span=None):
+        """
+        Wait until a record is durable, timing the wait for a traced request.
+
+        Args:
+            seq (int): LSN of the request's last record.
+            span (Span or None): The request's span, None if it is not traced.
+        """
+        if span is None:
+            self.wal.wait(seq)
+            return
+        start = time.time()
+        self.wal.wait(seq)
+        span.record("store.wal_commit", start, time.time(), lsn=seq)
+
+    def _publish(self, records):
+        """
+        Hand records that just got their LSNs to the replicator. Called under the log lock.
+
+        For a traced request the delivery of its last record to every secondary
+        is timed too; watching before publishing makes sure the sender sees it.
+
+        Args:
+            records (list): ``(lsn, key, value)`` tuples in increasing LSN order.
+        """
+        span = TRACER.current()
+        if span is not None:
+            self.replicator.watch(records[-1][0], span)
+        self.replicator.publish(records)
+
+    def _log_many(self, values, marker=None):
+        """
+        Queue several records on the log and for replication. Caller holds the stripes of the keys.
+
+        Args:
+            values (dict): Mapping of key to value, None for a deleted key.
+            marker (dict, optional): Reserved keys of a new transfer id (see
+                :meth:`_claim_transfer`), stored and logged in the same batch as the records.
+
+        Returns:
+            int: LSN of the last record, to pass to ``wal.wait``.
+        """
+        records = list(values.items())
+        if marker is not None:
+            if TRANSFER_USED in marker:  # claims may be logged out of order, never lower the count
+                marker[TRANSFER_USED] = max(marker[TRANSFER_USED], int(self.data.get(TRANSFER_USED, 0)))
+            self.data.update(marker)
+            records.extend(marker.items())
+
+        def publish(last):
+            first = last - len(records) + 1
+            self._publish([(first + i, key, val) for i, (key, val) in enumerate(records)])
+
+        return self.wal.append_many(records, publish)
+
+    def apply_replicated(self, records, contiguous=True):
+        """
+        Apply a batch of records shipped by the primary, in LSN order.
+
+        Records at or below ``replica_lsn`` were applied before (e.g. a retried
+        batch) and are skipped. A pushed batch that does not continue right after
+        ``replica_lsn`` is rejected and triggers a catch-up from the primary's log.
+
+        Args:
+            records (list): ``[lsn, key, value]`` entries from the primary's log, None values for deletes.
+            contiguous (bool): Reject the batch if it leaves a gap.
+
+        Returns:
+            int: The highest primary LSN applied so far.
+        """
+        with self._replica_lock:
+            fresh = [r for r in sorted(records, key=lambda r: r[0]) if r[0] > self.replica_lsn]
+            if not fresh:
+                return self.replica_lsn
+            if contiguous and fresh[0][0] > self.replica_lsn + 1:
+                self.replica_gaps += 1
+                logging.warning(f"[REPLICATION] gap in primary log: expected lsn {self.replica_lsn + 1}, "
+                                f"got {fresh[0][0]}, catching up")
+                self._catchup.set()
+                return self.replica_lsn
+            with self._locks.for_keys(key for _, key, _ in fresh):
+                applied = [(key, decode_value(value)) for _, key, value in fresh]
+                for key, value in applied:
+                    if value is None:
+                        self.data.pop(key, None)
+                    else:
+                        self.data[key] = value
+                seq = self.wal.append_many(applied)
+            self.wal.wait(seq)
+            self.replica_lsn = fresh[-1][0]
+            return self.replica_lsn
+
+store = SimpleStore(LOG_PATH, SNAPSHOT_PATH)
 app   = Flask(__name__)
+instrument_flask(app, REQUEST_LATENCY)
+trace_flask(app, TRACER)
+INGEST = IngestServer(INGEST_PORT, lambda deltas, record_id: store.stage_increments(deltas, record_id)[1], store.commit,
+                      TRACER) if INGEST_PORT > 0 else None  # started with the app
+
+METRICS.gauge("store_keys", "Keys in the store", lambda: len(store.data))
+METRICS.gauge("store_data_bytes", "Memory held by the keys and values, estimated for STORE_ENGINE=dict",
+              lambda: memory_usage(store.data)["bytes"])
+METRICS.gauge("store_wal_last_lsn", "LSN of the last logged record", lambda: store.wal.last_lsn)
+METRICS.counter_fn("store_wal_bytes_written_total", "Bytes written to the write-ahead log", lambda: store.wal.bytes_written)
+METRICS.counter_fn("store_wal_fsyncs_total", "fsync calls of the write-ahead log", lambda: store.wal.fsyncs)
+METRICS.counter_fn("store_wal_batches_total", "Group-commit batches written", lambda: store.wal.batches)
+METRICS.gauge("store_replication_lag_records", "Records published but not yet acknowledged by a secondary",
+              lambda: {(url,): lag["lag_records"] for url, lag in store.replicator.lag().items()}, ("secondary",))
+METRICS.gauge("store_replication_lag_seconds", "Age of the oldest record not yet acknowledged by a secondary",
+              lambda: {(url,): lag["lag_seconds"] for url, lag in store.replicator.lag().items()}, ("secondary",))
+METRICS.counter_fn("store_replication_failures_total", "Failed replication requests",
+                   lambda: {(url,): lag["failures"] for url, lag in store.replicator.lag().items()}, ("secondary",))
+METRICS.gauge("store_ingest_connections", "Open streaming ingest connections",
+              lambda: INGEST.connections if INGEST is not None else 0)
+METRICS.counter_fn("store_ingest_records_total", "Records received on streaming ingest connections",
+                   lambda: INGEST.records if INGEST is not None else 0)
+METRICS.counter_fn("store_transfer_repeats_total", "Writes skipped because their transfer or record id was applied before",
+                   lambda: store.transfer_repeats)
+METRICS.gauge("store_replica_lsn", "Highest primary LSN applied on this secondary", lambda: store.replica_lsn)
+
 
 @app.route("/store/<key>", methods=["POST"])
 def write_key(key):
@@ -194,16 +736,255 @@ def increment_key(key):
     """
     Increment the value of a given key in the store.
 
+    Request Body (optional):
+        JSON: {"delta": <int>} to increment by more than one.
+
     Args:
         key (str): The key whose value should be incremented.
 
     Returns:
         Response: A JSON object containing the key and its new value with a 201 Created status.
         Example: {"key": "example_key", "value": "new_value"}
+
+    Raises:
+        400: If 'delta' is not an integer.
     """
-    new_val = store.increment(key)
+    body = request.get_json(silent=True) or {}
+    delta = body.get("delta", 1)
+    if not isinstance(delta, int) or isinstance(delta, bool):
+        abort(400, description="'delta' must be an integer")
+    new_val = store.increment(key, delta)
     return jsonify({"key": key, "value": str(new_val)}), 201
 
+@app.route("/bulk/increment", methods=["POST"])
+def bulk_increment():
+    """
+    Atomically increment many keys at once.
+
+    A retried request with the same 'transfer_id' applies nothing and returns the
+    current values.
+
+    Request Body:
+        JSON: {"deltas": {<key>: <int>, ...}, "transfer_id": <str, optional>}
+
+    Returns:
+        JSON: {"values": {<key>: <new value>, ...}} with 201 Created.
+
+    Raises:
+        400: If 'deltas' is missing or contains non-integer amounts, or 'transfer_id' is not a string.
+    """
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body.get("deltas"), dict):
+        abort(400, description="Request JSON must include a 'deltas' object")
+    deltas = body["deltas"]
+    for delta in deltas.values():
+        if not isinstance(delta, int) or isinstance(delta, bool):
+            abort(400, description="All deltas must be integers")
+    transfer_id = request_transfer_id(body)
+    if not deltas:
+        return jsonify({"values": {}}), 201
+    values = store.increment_many(deltas, transfer_id)
+    return jsonify({"values": {key: str(val) for key, val in values.items()}}), 201
+
+@app.route("/bulk/write", methods=["POST"])
+def bulk_write():
+    """
+    Write many key-value pairs at once.
+
+    A retried request with the same 'transfer_id' writes nothing.
+
+    Request Body:
+        JSON: {"values": {<key>: <value>, ...}, "transfer_id": <str, optional>}
+
+    Returns:
+        JSON: {"values": {<key>: <value>, ...}} with 201 Created.
+
+    Raises:
+        400: If 'values' is missing or 'transfer_id' is not a string.
+    """
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body.get("values"), dict):
+        abort(400, description="Request JSON must include a 'values' object")
+    values = {key: str(val) for key, val in body["values"].items()}
+    transfer_id = request_transfer_id(body)
+    if values:
+        store.append_many(values, transfer_id)
+    return jsonify({"values": values}), 201
+
+@app.route("/bulk/read", methods=["POST"])
+def bulk_read():
+    """
+    Retrieve the current values of many keys at once.
+
+    Request Body:
+        JSON: {"keys": [<key>, ...]}
+
+    Returns:
+        JSON: {"values": {<key>: <value>, ...}} with 200 OK; missing keys are omitted.
+
+    Raises:
+        400: If 'keys' is missing or not a list of strings.
+    """
+    body = request.get_json(silent=True)
+    keys = body.get("keys") if isinstance(body, dict) else None
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        abort(400, description="Request JSON must include a 'keys' list of strings")
+    data = store.data
+    values = {}
+    for key in keys:
+        val = data.get(key)
+        if val is not None:
+            values[key] = str(val)
+    return jsonify({"values": values}), 200
+
+@app.route("/bulk/drain", methods=["POST"])
+def bulk_drain():
+    """
+    Take back values that were copied to their new owner, for shard rebalancing.
+
+    Counters are reduced by the copied amount and removed once they reach zero,
+    other values are removed if they still equal the copied value (see
+    ``SimpleStore.drain_many``). A retried request with the same 'transfer_id'
+    changes nothing.
+
+    Request Body:
+        JSON: {"values": {<key>: <copied value>, ...}, "transfer_id": <str, optional>}
+
+    Returns:
+        JSON: {"kept": {<key>: <value>, ...}} with 200 OK, the keys still present
+        because they changed after the copy.
+
+    Raises:
+        400: If 'values' is missing or 'transfer_id' is not a string.
+    """
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body.get("values"), dict):
+        abort(400, description="Request JSON must include a 'values' object")
+    kept = store.drain_many(body["values"], request_transfer_id(body))
+    return jsonify({"kept": {key: str(val) for key, val in kept.items()}}), 200
+
+def request_transfer_id(body):
+    """
+    Args:
+        body (dict): A request body.
+
+    Returns:
+        str or None: Its optional 'transfer_id'.
+
+    Raises:
+        400: If 'transfer_id' is present but not a non-empty string.
+    """
+    transfer_id = body.get("transfer_id")
+    if transfer_id is not None and (not isinstance(transfer_id, str) or not transfer_id):
+        abort(400, description="'transfer_id' must be a non-empty string")
+    return transfer_id
+
+@app.route("/keys", methods=["GET"])
+def stream_keys():
+    """
+    Stream every key held by this node, for shard rebalancing.
+
+    The keys are read and streamed KEYS_CHUNK at a time (see compact.key_chunks),
+    so large stores are transferred without building one big response or copying
+    the compact table. The reserved transfer id keys stay on their node and are
+    left out.
+
+    Returns:
+        Response: One JSON-encoded key per line (application/x-ndjson) with 200 OK.
+    """
+    chunks = key_chunks(store.data, KEYS_CHUNK)
+
+    def generate():
+        for keys in chunks:
+            lines = "".join(json.dumps(key) + "\n" for key in keys if not key.startswith(TRANSFER_PREFIX))
+            if lines:
+                yield lines
+
+    return Response(generate(), mimetype="application/x-ndjson"), 200
+
+@app.route("/ingest", methods=["GET"])
+def ingest_port():
+    """
+    Tell queue workers where to open their streaming ingest connection (see ingest.py).
+
+    Returns:
+        JSON: {"port": <int>} with 200 OK.
+
+    Raises:
+        404: If streaming ingest is disabled (INGEST_PORT=0).
+    """
+    if INGEST is None or not INGEST.port:
+        abort(404, description="Streaming ingest is disabled")
+    return jsonify({"port": INGEST.port}), 200
+
+@app.route("/replicate", methods=["POST"])
+def replicate():
+    """
+    Apply an ordered batch of log records from the primary.
+
+    Request Body:
+        JSON: {"records": [[<lsn>, <key>, <value>], ...]}, a null value for a deleted key.
+
+    Returns:
+        JSON: {"applied_lsn": <int>} with 200 OK.
+
+    Raises:
+        400: If 'records' is missing or malformed.
+    """
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body.get("records"), list):
+        abort(400, description="Request JSON must include a 'records' list")
+    records = body["records"]
+    for record in records:
+        if not isinstance(record, list) or len(record) != 3 or not isinstance(record[0], int):
+            abort(400, description="Records must be [lsn, key, value] lists")
+    return jsonify({"applied_lsn": store.apply_replicated(records)}), 200
+
+@app.route("/log", methods=["GET"])
+def read_log():
+    """
+    Stream committed log records after a given LSN, for secondaries catching up.
+
+    Query Parameters:
+        since (int): Return records with a greater LSN. Defaults to 0.
+        limit (int): Maximum number of records. Defaults to CATCHUP_BATCH.
+
+    Returns:
+        JSON: {"records": [[<lsn>, <key>, <value>], ...], "last_lsn": <int>} with 200 OK;
+        a null value marks a deleted key.
+
+    Raises:
+        400: If 'since' is negative or 'limit' is not positive.
+        410: If the records after 'since' were compacted away or never existed.
+    """
+    since = request.args.get("since", 0, type=int)
+    limit = request.args.get("limit", CATCHUP_BATCH, type=int)
+    if since < 0 or limit <= 0:
+        abort(400, description="'since' must be non-negative and 'limit' positive")
+    wal = store.wal
+    last_lsn = wal.durable_lsn
+    if since < wal.first_lsn or since > last_lsn:
+        abort(410, description=f"Log after lsn {since} is not available")
+    records = [[lsn, key, val] for lsn, key, val in islice(wal.records(since=since), limit)]
+    return jsonify({"records": records, "last_lsn": last_lsn}), 200
+
+@app.route("/snapshot", methods=["GET"])
+def read_snapshot():
+    """
+    Stream a consistent copy of the full store state, for secondaries whose log
+    position was compacted away.
+
+    The copy is encoded a chunk at a time while it is sent, in the snapshot file
+    format (see snapshot.py).
+
+    Returns:
+        Response: A {"lsn": <int>, "meta": {}} header line followed by lines of
+        {<key>: <value>, ...} chunks (application/x-ndjson) with 200 OK.
+    """
+    data, lsn = store.copy()
+    store.wal.wait(lsn)
+    return Response(encode_snapshot(data, lsn), mimetype="application/x-ndjson"), 200
+
 @app.route("/store/<key>", methods=["GET"])
 def read_key(key):
     """
@@ -218,9 +999,10 @@ def read_key(key):
     Raises:
         404: If the key is not found.
     """
-    if key not in store.data:
+    value = store.data.get(key)
+    if value is None:
         abort(404)
-    return jsonify({"key": key, "value": store.data[key]}), 200
+    return jsonify({"key": key, "value": str(value)}), 200
 
 @app.route("/store/<key>", methods=["DELETE"])
 def delete_key(key):
@@ -241,5 +1023,96 @@ def delete_key(key):
         abort(404)
     return "", 204
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    """
+    Report log, snapshot, recovery and replication statistics.
+
+    Returns:
+        JSON: Key count, WAL counters, snapshot/replay timings and per-secondary lag with 200 OK.
+    """
+    wal = store.wal
+    return jsonify({
+        "keys": len(store.data),
+        "wal": {
+            "last_lsn": wal.last_lsn,
+            "durable_lsn": wal.durable_lsn,
+            "first_lsn": wal.first_lsn,
+            "segments": wal.segment_count(),
+            "batches": wal.batches,
+            "fsyncs": wal.fsyncs,
+            "bytes_written": wal.bytes_written,
+            "rotations": wal.rotations,
+        },
+        "snapshot": store.stats,
+        "replication": {
+            "secondaries": store.replicator.lag(),
+            "replica_lsn": store.replica_lsn,
+            "replica_gaps": store.replica_gaps,
+        },
+    }), 200
+
+@app.route("/memory", methods=["GET"])
+def memory():
+    """
+    Report the memory used by the store's data and by the whole process.
+
+    Returns:
+        JSON: Engine, keys, bytes of the data in total and per key (estimated for
+        the dict engine, per part for the compact one) and the process's resident
+        set size ("rss_bytes", null where unavailable) with 200 OK.
+    """
+    report = memory_usage(store.data)
+    report["rss_bytes"] = rss_bytes()
+    return jsonify(report), 200
+
+def rss_bytes():
+    """
+    Returns:
+        int or None: Resident set size of this process, None if /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+@app.route("/debug/traces", methods=["GET"])
+def debug_traces():
+    """
+    Return the newest finished spans of this store node.
+
+    Query Parameters:
+        trace_id (str, optional): Only spans of this trace.
+        limit (int, optional): Maximum number of spans, default 1000.
+
+    Returns:
+        JSON: {"spans": [...]} oldest first, with 200 OK.
+    """
+    limit = request.args.get("limit", 1000, type=int)
+    return jsonify({"spans": TRACER.recent(request.args.get("trace_id"), limit)}), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Expose request latency, lock waits, WAL and replication metrics for Prometheus.
+
+    Returns:
+        Response: The metrics in the Prometheus text format, 200 OK.
+    """
+    return Response(METRICS.expose(), mimetype=CONTENT_TYPE)
+
+@app.route("/snapshot", methods=["POST"])
+def take_snapshot():
+    """
+    Force a snapshot and log truncation now.
+
+    Returns:
+        JSON: The updated snapshot statistics with 201 Created.
+    """
+    return jsonify(store.snapshot()), 201
+
 if __name__ == "__main__":
+    if INGEST is not None:
+        INGEST.start()
     app.run(host="0.0.0.0", port=STORE_PORT)
@@ -0,0 +1,547 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+import logformat
+from logformat import BINARY, FORMATS, SEGMENT_HEADER
+
+FSYNC_ALWAYS   = "always"    # fsync after every single record
+FSYNC_BATCH    = "batch"     # one fsync per group-commit batch
+FSYNC_INTERVAL = "interval"  # ack once written, fsync at most every interval
+FSYNC_MODES    = (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_INTERVAL)
+
+
+class WriteAheadLog:
+    """
+    An append-only, segmented, group-committing write-ahead log.
+
+    Writers enqueue records with :meth:`append` (cheap, safe to call while holding
+    a key lock so the log order matches the in-memory order) and then block in
+    :meth:`wait` until their record is durable. A single flusher thread keeps the
+    active segment open, writes all queued records in one batch and acknowledges
+    every writer of that batch at once. Appends wake only the flusher, commits
+    wake only the waiting writers.
+
+    A record is a ``(key, value)`` pair, where ``value`` is an int, a string or
+    None for a deleted key. Every record gets a log sequence number (LSN),
+    starting at 1. The log is split into segment files named ``<path>.<base>``
+    where ``base`` is the LSN of the last record before the segment. Once a segment
+    grows past ``segment_bytes`` a new one is started, and segments fully covered
+    by a snapshot can be dropped with :meth:`truncate`.
+
+    New segments are written in ``log_format`` (see :mod:`logformat`): checksummed
+    binary frames, one per batch, or the original ``key:value`` text lines. Each
+    segment records its own format, so a log can mix both; when the format of a
+    non-empty active segment does not match, a new segment is started on open.
+    When a binary segment that was written from its start by this process is
+    sealed, a summary with the final value of each key it touched is saved next
+    to it, so :meth:`replay` applies every key of a sealed segment once instead
+    of every record.
+
+    Attributes:
+        path (str): Base path of the log segments.
+        fsync_mode (str): One of ``always``, ``batch`` or ``interval``.
+        fsync_interval (float): Seconds between fsyncs in ``interval`` mode.
+        max_batch (int): Maximum number of records written per batch.
+        segment_bytes (int): Size after which the active segment is rotated.
+        log_format (str): Format of new segments, one of ``logformat.FORMATS``.
+    """
+
+    def __init__(self, path, fsync_mode=FSYNC_BATCH, fsync_interval=0.05, max_batch=1024,
+                 segment_bytes=64 * 1024 * 1024, log_format=BINARY):
+        """
+        Open the newest log segment for appending and start the flusher thread.
+
+        A plain log file at ``path`` left by older versions is adopted as the first
+        segment.
+
+        Args:
+            path (str): Base path of the log segments.
+            fsync_mode (str): Durability mode, see ``FSYNC_MODES``.
+            fsync_interval (float): Seconds between fsyncs in ``interval`` mode.
+            max_batch (int): Maximum number of records written per batch.
+            segment_bytes (int): Size after which the active segment is rotated.
+            log_format (str): Format of new segments, ``binary`` or ``text``.
+
+        Raises:
+            ValueError: If ``fsync_mode`` or ``log_format`` is unknown.
+        """
+        if fsync_mode not in FSYNC_MODES:
+            raise ValueError(f"Unknown fsync mode {fsync_mode!r}, expected one of {FSYNC_MODES}")
+        if log_format not in FORMATS:
+            raise ValueError(f"Unknown log format {log_format!r}, expected one of {FORMATS}")
+        self.path = path
+        self.fsync_mode = fsync_mode
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.segment_bytes = segment_bytes
+        self.log_format = log_format
+
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)  # writers wait here for their records to be committed
+        self._work = threading.Condition(lock)  # the flusher waits here for records
+        self._segments = self._discover_segments()
+        active_base = self._segments[-1]
+        fmt, count = self._recover_segment(self._segment_path(active_base))
+        last_lsn = active_base + count
+        if fmt is not None and fmt != log_format:
+            if count:
+                logging.log(logging.INFO, f"[WAL] active segment is {fmt}, starting a {log_format} segment")
+                self._segments.append(last_lsn)
+                active_base = last_lsn
+            else:
+                os.truncate(self._segment_path(active_base), 0)
+        self._file = self._create_segment(active_base)
+        # final value per key of the active segment, only known if this process wrote all of it
+        self._summary = {} if log_format == BINARY and active_base == last_lsn else None
+        self._pending = []
+        self._appended_seq = last_lsn
+        self._durable_seq = last_lsn
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self._error = None
+        self._closed = False
+
+        self.batches = 0
+        self.fsyncs = 0
+        self.bytes_written = 0
+        self.rotations = 0
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    @property
+    def last_lsn(self):
+        """
+        int: LSN of the most recently appended record.
+        """
+        with self._cond:
+            return self._appended_seq
+
+    @property
+    def durable_lsn(self):
+        """
+        int: LSN up to which all records have been committed.
+        """
+        with self._cond:
+            return self._durable_seq
+
+    @property
+    def first_lsn(self):
+        """
+        int: LSN of the oldest record still retained on disk, minus one.
+        """
+        with self._cond:
+            return self._segments[0]
+
+    def segment_count(self):
+        """
+        Returns:
+            int: Number of segment files currently on disk.
+        """
+        with self._cond:
+            return len(self._segments)
+
+    def append(self, key, value, on_append=None):
+        """
+        Queue a record for the next batch without waiting for it.
+
+        Args:
+            key (str): The key.
+            value (int, str or None): Its new value, None if it was deleted.
+            on_append (callable, optional): Called with the record's LSN while the log
+                lock is held, so calls happen in LSN order (e.g. publishing for replication).
+
+        Returns:
+            int: The record's LSN, to pass to :meth:`wait`.
+        """
+        with self._cond:
+            if self._closed:
+                raise IOError("write-ahead log is closed")
+            self._pending.append((key, value))
+            self._appended_seq += 1
+            seq = self._appended_seq
+            if on_append is not None:
+                on_append(seq)
+            self._work.notify()
+        return seq
+
+    def append_many(self, records, on_append=None):
+        """
+        Queue several records so they are committed in the same batch.
+
+        Args:
+            records (list): ``(key, value)`` pairs.
+            on_append (callable, optional): Called with the LSN of the last record while
+                the log lock is held, so calls happen in LSN order.
+
+        Returns:
+            int: The LSN of the last record, to pass to :meth:`wait`.
+        """
+        with self._cond:
+            if self._closed:
+                raise IOError("write-ahead log is closed")
+            self._pending.extend(records)
+            self._appended_seq += len(records)
+            seq = self._appended_seq
+            if on_append is not None:
+                on_append(seq)
+            self._work.notify()
+        return seq
+
+    def wait(self, seq):
+        """
+        Block until the record with the given LSN has been committed.
+
+        Args:
+            seq (int): LSN returned by :meth:`append`.
+
+        Raises:
+            IOError: If the flusher failed to write the log.
+        """
+        with self._cond:
+            while self._durable_seq < seq and self._error is None:
+                self._cond.wait()
+            if self._durable_seq < seq:
+                raise IOError(f"write-ahead log failed: {self._error}")
+
+    def write(self, key, value):
+        """
+        Append a record and wait until it is committed.
+
+        Args:
+            key (str): The key.
+            value (int, str or None): Its new value, None if it was deleted.
+
+        Returns:
+            int: The record's LSN.
+        """
+        seq = self.append(key, value)
+        self.wait(seq)
+        return seq
+
+    def records(self, since=0):
+        """
+        Iterate over committed records with an LSN greater than ``since``.
+
+        Args:
+            since (int): Only records after this LSN are returned.
+
+        Yields:
+            tuple: ``(lsn, key, value)`` in log order; ``value`` is None for a deleted key.
+        """
+        for first, keys, values, _ in self.read_batches(since):
+            yield from zip(range(first, first + len(keys)), keys, values)
+
+    def replay(self, data, since=0):
+        """
+        Apply the committed records after ``since`` to a dict, a whole batch at a time.
+
+        Batches without deletes are applied with a single ``dict.update``, and a
+        sealed segment that lies entirely after ``since`` is applied from its
+        summary if it has a valid one.
+
+        Args:
+            data (dict): The state to update; a None value removes the key.
+            since (int): Only records after this LSN are applied.
+
+        Returns:
+            int: Number of log records covered.
+        """
+        replayed = 0
+        segments, upto = self._committed()
+        for base, next_base in zip(segments, segments[1:] + [None]):
+            if next_base is not None and next_base <= since:
+                continue
+            if base >= upto:
+                break
+            summary = None
+            if next_base is not None and since <= base and next_base <= upto:
+                summary = logformat.read_summary(self._summary_path(base), next_base)
+            if summary is not None:
+                batches = [summary]
+                replayed += next_base - base
+            else:
+                batches = (batch[1:] for batch in self._segment_batches(base, since, upto))
+            for keys, values, has_deletes in batches:
+                if has_deletes:
+                    for key, value in zip(keys, values):
+                        if value is None:
+                            data.pop(key, None)
+                        else:
+                            data[key] = value
+                else:
+                    data.update(zip(keys, values))
+                if summary is None:
+                    replayed += len(keys)
+        return replayed
+
+    def read_batches(self, since=0):
+        """
+        Iterate over committed records with an LSN greater than ``since``, in decoded batches.
+
+        Args:
+            since (int): Only records after this LSN are returned.
+
+        Yields:
+            tuple: (LSN of the first record, keys, values, whether any value is None).
+        """
+        segments, upto = self._committed()
+        for base, next_base in zip(segments, segments[1:] + [None]):
+            if next_base is not None and next_base <= since:
+                continue
+            if base >= upto:
+                return
+            yield from self._segment_batches(base, since, upto)
+
+    def _committed(self):
+        """
+        Returns:
+            tuple: (segment base LSNs, durable LSN), taken together.
+        """
+        with self._cond:
+            return list(self._segments), self._durable_seq
+
+    def _segment_batches(self, base, since, upto):
+        """
+        Decode the records of one segment with an LSN in ``(since, upto]``.
+
+        Segments are read through a memory map (binary) or a large buffer (text).
+
+        Args:
+            base (int): LSN of the last record before the segment.
+            since (int): Only records after this LSN are returned.
+            upto (int): Only records up to this LSN are returned.
+
+        Yields:
+            tuple: (LSN of the first record, keys, values, whether any value is None).
+        """
+        lsn = base
+        try:
+            for keys, values, has_deletes in logformat.read_segment(self._segment_path(base)):
+                first, lsn = lsn + 1, lsn + len(keys)
+                if lsn <= since:
+                    continue
+                if first <= since or lsn > upto:
+                    start, stop = max(since - first + 1, 0), max(min(upto, lsn) - first + 1, 0)
+                    keys, values = keys[start:stop], values[start:stop]
+                    has_deletes = has_deletes and None in values
+                    first += start
+                if keys:
+                    yield first, keys, values, has_deletes
+                if lsn >= upto:
+                    return
+        except FileNotFoundError:
+            # truncated underneath us, the caller asked for compacted history
+            return
+
+    def truncate(self, upto):
+        """
+        Delete sealed segments whose records all have an LSN of at most ``upto``.
+
+        Args:
+            upto (int): LSN covered by a durable snapshot.
+
+        Returns:
+            int: Number of segment files removed.
+        """
+        with self._cond:
+            doomed = []
+            while len(self._segments) > 1 and self._segments[1] <= upto:
+                doomed.append(self._segments.pop(0))
+        for base in doomed:
+            for path in (self._segment_path(base), self._summary_path(base)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(doomed)
+
+    def close(self):
+        """
+        Flush all queued records, stop the flusher and close the file.
+        """
+        with self._cond:
+            self._closed = True
+            self._work.notify()
+        self._flusher.join()
+
+    def _segment_path(self, base):
+        """
+        Args:
+            base (int): LSN of the last record before the segment.
+
+        Returns:
+            str: File name of the segment.
+        """
+        return f"{self.path}.{base:012d}"
+
+    def _summary_path(self, base):
+        """
+        Args:
+            base (int): LSN of the last record before the segment.
+
+        Returns:
+            str: File name of the segment's summary.
+        """
+        return f"{self._segment_path(base)}.summary"
+
+    def _discover_segments(self):
+        """
+        Find existing segments on disk, adopting a legacy single-file log.
+
+        Returns:
+            list: Sorted segment base LSNs, never empty.
+        """
+        segments = []
+        for name in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = name[len(self.path) + 1:]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        segments.sort()
+        if not segments:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                logging.log(logging.INFO, f"[WAL] adopting legacy log {self.path} as first segment")
+                os.replace(self.path, self._segment_path(0))
+            segments.append(0)
+        return segments
+
+    def _create_segment(self, base):
+        """
+        Open a segment for appending, starting it with the format header if it is new.
+
+        Args:
+            base (int): LSN of the last record before the segment.
+
+        Returns:
+            file: The segment opened for appending.
+        """
+        f = open(self._segment_path(base), "ab")
+        if f.tell() == 0 and self.log_format == BINARY:
+            f.write(SEGMENT_HEADER)
+            f.flush()
+        return f
+
+    @staticmethod
+    def _recover_segment(path):
+        """
+        Count the intact records in a segment, dropping a torn or corrupt tail.
+
+        Args:
+            path (str): Segment file to scan.
+
+        Returns:
+            tuple: (format of the segment or None if it is empty, number of intact records).
+        """
+        if not os.path.exists(path):
+            return None, 0
+        fmt, count, good_bytes = logformat.scan(path)
+        if good_bytes < os.path.getsize(path):
+            logging.warning(f"[WAL] truncating torn record at end of {path}")
+            with open(path, "r+b") as f:
+                f.truncate(good_bytes)
+        return fmt, count
+
+    def _flush_loop(self):
+        """
+        Write queued records in batches and acknowledge their writers.
+        """
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    if self.fsync_mode == FSYNC_INTERVAL and self._dirty:
+                        remaining = self.fsync_interval - (time.monotonic() - self._last_fsync)
+                        if remaining <= 0:
+                            break
+                        self._work.wait(remaining)
+                    else:
+                        self._work.wait()
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                last_seq = self._appended_seq - len(self._pending)
+                closing = self._closed and not self._pending
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+                if self.fsync_mode == FSYNC_INTERVAL and self._dirty and (
+                        closing or time.monotonic() - self._last_fsync >= self.fsync_interval):
+                    self._fsync()
+                if self._file.tell() >= self.segment_bytes:
+                    self._rotate(last_seq)
+            except Exception as e:
+                logging.exception(f"[WAL] write to {self.path} failed: {e}")
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._durable_seq = last_seq
+                self._cond.notify_all()
+
+            if closing:
+                self._file.close()
+                return
+
+    def _write_batch(self, batch):
+        """
+        Write one batch of records according to the configured fsync mode.
+
+        Args:
+            batch (list): ``(key, value)`` records.
+        """
+        encode = logformat.encode_frame if self.log_format == BINARY else logformat.encode_lines
+        if self.fsync_mode == FSYNC_ALWAYS:
+            for record in batch:
+                data = encode([record])
+                self._file.write(data)
+                self._file.flush()
+                self._fsync()
+                self.bytes_written += len(data)
+        else:
+            data = encode(batch)
+            self._file.write(data)
+            self._file.flush()
+            self.bytes_written += len(data)
+            if self.fsync_mode == FSYNC_BATCH:
+                self._fsync()
+            else:
+                self._dirty = True
+        if self._summary is not None:
+            self._summary.update(batch)
+        self.batches += 1
+
+    def _rotate(self, base):
+        """
+        Seal the active segment and start a new one.
+
+        Args:
+            base (int): LSN of the last record in the sealed segment.
+        """
+        if self._dirty:
+            self._fsync()
+        self._file.close()
+        if self._summary is not None:
+            sealed = self._segments[-1]
+            try:
+                logformat.write_summary(self._summary_path(sealed), base, self._summary)
+            except OSError as e:
+                # only slows down replay, which then reads the whole segment
+                logging.warning(f"[WAL] could not write summary of segment {sealed}: {e}")
+        self._summary = {} if self.log_format == BINARY else None
+        self._file = self._create_segment(base)
+        with self._cond:
+            self._segments.append(base)
+        self.rotations += 1
+
+    def _fsync(self):
+        """
+        Force the active segment to stable storage.
+        """
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self.fsyncs += 1
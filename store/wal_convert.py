@@ -0,0 +1,98 @@
+"""
+One-shot conversion of a store's write-ahead log between the text and binary formats.
+
+Every segment of LOG_PATH that is not yet in the target format is decoded and
+rewritten (binary: one frame per --frame-records records), then atomically
+replaced. A torn tail is dropped like on recovery. A plain single-file log left
+by older versions is adopted as the first segment first. Stop the store before
+converting; afterwards start it with the matching WAL_FORMAT, otherwise it just
+starts a new segment in its own format.
+
+Usage:
+    python wal_convert.py LOG_PATH [--to binary] [--frame-records 1024]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import logformat
+from logformat import BINARY, FORMATS, SEGMENT_HEADER
+
+
+def segments(path):
+    """
+    Args:
+        path (str): Base path of the log.
+
+    Returns:
+        list: Segment file names in LSN order.
+    """
+    if os.path.exists(path) and os.path.getsize(path) > 0 and not glob.glob(glob.escape(path) + ".*"):
+        os.replace(path, f"{path}.{0:012d}")
+    names = [name for name in glob.glob(glob.escape(path) + ".*") if name[len(path) + 1:].isdigit()]
+    return sorted(names, key=lambda name: int(name[len(path) + 1:]))
+
+
+def convert(segment, target, frame_records):
+    """
+    Rewrite one segment in the target format.
+
+    Args:
+        segment (str): The segment file.
+        target (str): ``binary`` or ``text``.
+        frame_records (int): Records per binary frame.
+
+    Returns:
+        tuple: (records written, keys containing ':' written to a text segment).
+    """
+    tmp = f"{segment}.tmp"
+    records = ambiguous = 0
+    with open(tmp, "wb") as out:
+        if target == BINARY:
+            out.write(SEGMENT_HEADER)
+        for keys, values, _ in logformat.read_segment(segment):
+            batch = list(zip(keys, values))
+            for start in range(0, len(batch), frame_records):
+                chunk = batch[start:start + frame_records]
+                if target == BINARY:
+                    out.write(logformat.encode_frame(chunk))
+                else:
+                    ambiguous += sum(1 for key, _ in chunk if ":" in key)
+                    out.write(logformat.encode_lines(chunk))
+            records += len(batch)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, segment)
+    return records, ambiguous
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log_path", help="LOG_PATH of the store")
+    parser.add_argument("--to", default=BINARY, choices=FORMATS)
+    parser.add_argument("--frame-records", type=int, default=1024)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    converted = records = ambiguous = before = after = 0
+    for segment in segments(args.log_path):
+        if logformat.detect(segment) in (None, args.to):
+            continue
+        before += os.path.getsize(segment)
+        count, bad = convert(segment, args.to, args.frame_records)
+        after += os.path.getsize(segment)
+        converted += 1
+        records += count
+        ambiguous += bad
+        print(f"{segment}: {count} records")
+    print(f"converted {converted} segments, {records} records to {args.to}: "
+          f"{before} -> {after} bytes in {time.perf_counter() - start:.1f}s")
+    if ambiguous:
+        print(f"warning: {ambiguous} records have keys containing ':', which the text format cannot represent")
+
+
+if __name__ == "__main__":
+    main()